@@ -1,8 +1,27 @@
 import os
+import pytest
+import tempfile
 
 from pathlib import Path
+from typing import List
 from _pytest.config.argparsing import Parser
-from src.tools.logger import init_config
+from src.tools.logger import init_config, shutdown
+from src.tools.compress import bundle
+from src.tools.profiler import FIXTURES, LEVELS, OFF, TIME, PhaseProfiler
+from src.tools.namespace import Namespace
+from src.tools.topology import Topology
+from src.tools.proxy import impairments
+from src.tools.sequence import PATTERN
+from src.tools.latency import PATTERN as LATENCY_PATTERN
+from src.tools.enums import LineLength, Stamp
+
+
+def _ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item]
+
+
+def _strs(value: str) -> List[str]:
+    return [item for item in value.split(',') if item]
 
 
 def pytest_addoption(parser: Parser):
@@ -26,24 +45,376 @@ def pytest_addoption(parser: Parser):
         default = 'current',
         help = 'Desired Node Version to build Image'
     )
+    parser.addoption(
+        '--build_cache',
+        action = 'store',
+        default = 3,
+        type = int,
+        help = 'Number of app images kept in the build cache, 0 to build from scratch and remove the image afterwards'
+    )
+    parser.addoption(
+        '--index_cache',
+        action = 'store',
+        default = 1024 * 1024 * 1024,
+        type = int,
+        help = 'Bytes of master indexes kept in the pytest cache across sessions (0 to index the master every time)'
+    )
+    parser.addoption(
+        '--artifact_cap',
+        action = 'store',
+        default = 64 * 1024 * 1024,
+        type = int,
+        help = 'Bytes kept of each collected container log, half from its start and half from its end (0 for all)'
+    )
+    parser.addoption(
+        '--bundle_include',
+        action = 'store',
+        default = ['*'],
+        type = _strs,
+        help = 'Comma separated glob patterns of the Artifacts to put in the CI .tar.gz bundle'
+    )
+    parser.addoption(
+        '--bundle_exclude',
+        action = 'store',
+        default = [],
+        type = _strs,
+        help = 'Comma separated glob patterns of the Artifacts to leave out of the CI .tar.gz bundle'
+    )
+    parser.addoption(
+        '--bundle_compressed',
+        action = 'store',
+        default = 'store',
+        choices = ['deflate', 'store', 'skip'],
+        help = 'Deflate already compressed Artifacts again, store them as they are or skip them in the bundle'
+    )
+    parser.addoption(
+        '--bundle_workers',
+        action = 'store',
+        default = 0,
+        type = int,
+        help = 'Number of threads compressing the bundle (0 for one per CPU)'
+    )
+    parser.addoption(
+        '--log_mode',
+        action = 'store',
+        default = 'sync',
+        choices = ['sync', 'queue'],
+        help = 'Write the log file from the logging thread, or in batches from a background thread'
+    )
+    parser.addoption(
+        '--log_json',
+        action = 'store_true',
+        default = False,
+        help = 'Write the log file as one JSON object per line'
+    )
+    parser.addoption(
+        '--log_rate',
+        action = 'store',
+        default = 0,
+        type = int,
+        help = 'Records per second written per logger below WARNING, the rest counted as suppressed (0 for all)'
+    )
+    parser.addoption(
+        '--profile',
+        action = 'store',
+        default = TIME,
+        choices = LEVELS,
+        help = 'Time the session phases (wall, CPU, peak RSS), also trace their peak Python memory, or also dump a '
+               'cProfile of each to the Artifacts directory'
+    )
+    parser.addoption(
+        '--profile_fixtures',
+        action = 'store',
+        default = list(FIXTURES),
+        type = _strs,
+        help = 'Comma separated fixtures whose setup and teardown are profiled'
+    )
+    parser.addoption(
+        '--telemetry_interval',
+        action = 'store',
+        default = 1.0,
+        type = float,
+        help = 'Seconds between the samples of the Splitter and Target stats recorded while the Agent runs (0 for none)'
+    )
+    parser.addoption(
+        '--tee_events',
+        action = 'store_true',
+        default = False,
+        help = 'Copy the Target events.log files to the Artifacts directory while they are streamed for verification'
+    )
+    parser.addoption(
+        '--verify_workers',
+        action = 'store',
+        default = 1,
+        type = int,
+        help = 'Number of processes to verify the Target events on (0 for one per CPU)'
+    )
+    parser.addoption(
+        '--event_pattern',
+        action = 'store',
+        default = PATTERN.decode(),
+        help = 'Regex of the events with the sequence number as its only group, enables the sequence number fast path '
+               'when every master event matches (empty to disable)'
+    )
+    parser.addoption(
+        '--stand_in',
+        action = 'store_true',
+        default = False,
+        help = 'Run the app roles in process on localhost (src/tools/standin.py) instead of in Docker containers'
+    )
+    parser.addoption(
+        '--namespace',
+        action = 'store',
+        default = '',
+        help = 'Prefix of the compose project, network and containers, so several sessions run side by side (each '
+               'pytest-xdist worker adds its own id)'
+    )
+    parser.addoption(
+        '--targets',
+        action = 'store',
+        default = 2,
+        type = int,
+        help = 'Number of Targets in the compose stack (or the stand-in)'
+    )
+    parser.addoption(
+        '--splitters',
+        action = 'store',
+        default = 1,
+        type = int,
+        help = 'Number of Splitters in the compose stack, each feeding its own group of Targets from its own Agent run'
+    )
+    parser.addoption(
+        '--impair',
+        action = 'append',
+        default = [],
+        help = 'Put a throttling proxy in front of the Targets, or of one with <target>:<spec>, e.g. '
+               'target_2:bandwidth=1M,latency=5ms,jitter=2ms,stall=500ms,stall_every=2s,segment=100 (repeatable)'
+    )
+    parser.addoption(
+        '--splitter_filter',
+        action = 'store',
+        default = 'off',
+        choices = ['drop', 'keep', 'off'],
+        help = 'Expect the splitter to drop the events matching its filter.json, to keep only those, or ignore the '
+               'filter (the default, neither app.ts nor the stand-in applies it)'
+    )
+    parser.addoption(
+        '--distribution',
+        action = 'store_true',
+        default = False,
+        help = 'Analyse how the events were spread over the Targets while verifying them, which keeps the master line '
+               'number of each event (8 bytes per event) when the events are not sequence numbered'
+    )
+    parser.addoption(
+        '--online',
+        action = 'store_true',
+        default = False,
+        help = 'Verify the Target events while the agent is sending them, instead of pulling them afterwards'
+    )
+    parser.addoption(
+        '--approximate',
+        action = 'store_true',
+        default = False,
+        help = 'Pre-check the Target events with sketches and only run the exact verification when '
+               'they find a discrepancy'
+    )
+    parser.addoption(
+        '--approximate_error',
+        action = 'store',
+        default = 0.001,
+        type = float,
+        help = 'False positive rate of the Bloom filter and relative error of the count-min sketch of --approximate'
+    )
+    parser.addoption(
+        '--approximate_precision',
+        action = 'store',
+        default = 14,
+        type = int,
+        help = 'HyperLogLog precision of --approximate, 2^N registers with a standard error of 1.04/sqrt(2^N)'
+    )
+    parser.addoption(
+        '--approximate_capacity',
+        action = 'store',
+        default = 0,
+        type = int,
+        help = 'Master events the Bloom filter of --approximate is sized for, which bounds its memory (about 3 bytes '
+               'per event at the default error); by default estimated from the size of the master'
+    )
+    parser.addoption(
+        '--latency',
+        action = 'store_true',
+        default = False,
+        help = 'Measure the end to end latency of each event: the --stand_in agent sends a latency stamped '
+               '--corpus_events corpus and the events are verified --online'
+    )
+    parser.addoption(
+        '--latency_window',
+        action = 'store',
+        default = 5.0,
+        type = float,
+        help = 'Seconds per time window of the latency percentiles'
+    )
+    parser.addoption(
+        '--latency_budget',
+        action = 'store',
+        default = None,
+        type = float,
+        help = 'Fail when the p99.9 event latency of any Target is above this many milliseconds'
+    )
+    parser.addoption(
+        '--benchmark',
+        action = 'store_true',
+        default = False,
+        help = 'Run the throughput benchmarks in src/tests/benchmark'
+    )
+    parser.addoption(
+        '--bench_events',
+        action = 'store',
+        default = [100000, 1000000],
+        type = _ints,
+        help = 'Comma separated event counts to benchmark'
+    )
+    parser.addoption(
+        '--bench_line_sizes',
+        action = 'store',
+        default = [32, 256],
+        type = _ints,
+        help = 'Comma separated event sizes in bytes to benchmark'
+    )
+    parser.addoption(
+        '--bench_targets',
+        action = 'store',
+        default = [2],
+        type = _ints,
+        help = 'Comma separated Target counts to benchmark, the compose stack only runs 2'
+    )
+    parser.addoption(
+        '--corpus_events',
+        action = 'store',
+        default = None,
+        type = int,
+        help = 'Send a generated corpus of this many events instead of the agent monitor file'
+    )
+    parser.addoption(
+        '--corpus_distribution',
+        action = 'store',
+        default = LineLength.FIXED.value,
+        choices = [length.value for length in LineLength],
+        help = 'Distribution of the generated event lengths'
+    )
+    parser.addoption(
+        '--corpus_line_size',
+        action = 'store',
+        default = 0,
+        type = int,
+        help = 'Mean generated event length in bytes, 0 for the bare event heads'
+    )
+    parser.addoption(
+        '--corpus_stamp',
+        action = 'store',
+        default = Stamp.SEQUENCE.value,
+        choices = [stamp.value for stamp in Stamp],
+        help = 'What each generated event starts with'
+    )
+    parser.addoption(
+        '--corpus_seed',
+        action = 'store',
+        default = 0,
+        type = int,
+        help = 'Random seed of the generated corpus'
+    )
 
 
 def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: throughput benchmarks, only run with --benchmark')
+
     # Set ENVs
     if (image := config.getoption('image_tag')) is not None:
         os.environ['IMAGE_BASE_TAG'] = image
-    if os.getenv('NETWORK') is None:
-        os.environ['NETWORK'] = 'timbernet'
     if os.getenv('WORKING_DIR') is None:
         os.environ['WORKING_DIR'] = '/app'
 
+    # Each pytest-xdist worker brings up its own compose stack
+    name = '_'.join(part for part in [config.getoption('namespace'), os.getenv('PYTEST_XDIST_WORKER')] if part)
+    namespace = Namespace(name)
+    try:
+        topology = Topology(config.getoption('targets'), config.getoption('splitters'), namespace)
+        topology.impairments = impairments(config.getoption('impair'), topology.targets)
+    except ValueError as error:
+        raise pytest.UsageError(str(error))
+    if config.getoption('stand_in') and len(topology.splitters) > 1:
+        raise pytest.UsageError('The stand-in runs a single Splitter')
+
+    # The latency is measured on the stamped corpus as the Targets receive it
+    if config.getoption('latency'):
+        if config.getoption('corpus_events') is None:
+            raise pytest.UsageError('--latency sends a generated corpus, give --corpus_events')
+        # The Node agent writes its whole monitor file at once, it cannot stamp the events as they are sent
+        if not config.getoption('stand_in'):
+            raise pytest.UsageError('--latency needs the stand-in agent, which stamps the events as it sends them, '
+                                    'give --stand_in')
+        config.option.corpus_stamp = Stamp.LATENCY.value
+        config.option.online = True
+        if config.getoption('event_pattern') == PATTERN.decode():
+            config.option.event_pattern = LATENCY_PATTERN.decode()
+
+    # The compose stack is rendered from the topology, in place of the --docker-compose file
+    cache = getattr(config, 'cache', None)
+    compose = topology.render(
+        cache.mkdir(f'topology_{name or "default"}') if cache else tempfile.mkdtemp(prefix = 'timberbrook_'),
+        os.environ['WORKING_DIR']
+    )
+    if hasattr(config.option, 'docker_compose'):
+        config.option.docker_compose = str(compose)
+
+    environ = {**namespace.environ(), 'TOPOLOGY': str(topology.directory)}
+    if not namespace and os.getenv('NETWORK') is not None:
+        environ.pop('NETWORK')
+    os.environ.update(environ)
+
     artifact_dir = config.getoption('artifacts')
     Path(artifact_dir).mkdir(exist_ok = True)
 
     init_config(
         Path(
             artifact_dir,
-            'timberbrook.log'
+            f'timberbrook_{name}.log' if namespace else 'timberbrook.log'
+        ),
+        mode = config.getoption('log_mode'),
+        fmt  = 'json' if config.getoption('log_json') else 'text',
+        rate = config.getoption('log_rate')
+    )
+
+    if (level := config.getoption('profile')) != OFF:
+        profiler = PhaseProfiler(
+            level    = level,
+            output   = Path(artifact_dir, f'profile_{name}.json' if namespace else 'profile.json'),
+            dump_dir = Path(artifact_dir, f'profile_{name}' if namespace else 'profile'),
+            fixtures = config.getoption('profile_fixtures')
         )
+        profiler.install()
+        config.pluginmanager.register(profiler, 'timberbrook_profiler')
+
+
+def pytest_sessionfinish(session):
+    config = session.config
+    if not os.getenv('CI') or hasattr(config, 'workerinput') or not getattr(config.option, 'numprocesses', None):
+        return
+
+    # The pytest-xdist controller bundles the Artifacts of all the workers, see fixture_targz
+    artifacts_dir = Path(config.rootpath, config.getoption('artifacts'))
+    bundle(
+        directory  = artifacts_dir,
+        output     = Path(config.rootpath, 'src', 'reports', f'{artifacts_dir.name}.tar.gz'),
+        include    = config.getoption('bundle_include'),
+        exclude    = config.getoption('bundle_exclude'),
+        compressed = config.getoption('bundle_compressed'),
+        workers    = config.getoption('bundle_workers') or None
     )
 
+
+def pytest_unconfigure(config):
+    if (profiler := config.pluginmanager.get_plugin('timberbrook_profiler')) is not None:
+        profiler.uninstall()
+    shutdown()
+
@@ -0,0 +1,45 @@
+import pytest
+import logging
+
+from pathlib import Path
+from _pytest.config import Config
+from typing import Callable
+from src.tools.enums import LineLength, Stamp
+
+
+_logger = logging.getLogger(__name__)
+
+
+def pytest_generate_tests(metafunc):
+    """
+    Parametrize the benchmarks over the ``--bench_events``, ``--bench_line_sizes`` and ``--bench_targets`` options
+    """
+    for name, option in [('events', 'bench_events'), ('line_size', 'bench_line_sizes'), ('targets', 'bench_targets')]:
+        if name in metafunc.fixturenames:
+            values = metafunc.config.getoption(option)
+            metafunc.parametrize(name, values, ids = [f'{name}={value}' for value in values])
+
+
+def pytest_collection_modifyitems(config: Config, items: list):
+    """
+    The benchmarks are only run with ``--benchmark``, skipped before any session fixture (image build, client) is set up
+    """
+    if config.getoption('benchmark'):
+        return
+    skip = pytest.mark.skip(reason = 'Benchmarks run with --benchmark')
+    for item in items:
+        if item.get_closest_marker('benchmark'):
+            item.add_marker(skip)
+
+
+@pytest.fixture(name = 'bench_input')
+def fixture_bench_input(corpus: Callable[..., Path], events: int, line_size: int) -> Path:
+    """
+    Yield the agent input for a benchmark, sequence numbered events of ``line_size`` bytes from the corpus cache
+
+    :param corpus:      Callable returning a generated corpus
+    :param events:      The number of events
+    :param line_size:   The bytes per event
+    :return:
+    """
+    yield corpus(events = events, distribution = LineLength.FIXED, line_size = line_size, stamp = Stamp.SEQUENCE)
@@ -0,0 +1,141 @@
+import json
+import pytest
+import logging
+
+from pathlib import Path
+from typing import Callable, List
+from docker import DockerClient
+from concurrent.futures import ThreadPoolExecutor
+from src.tools.benchmark import measure
+from src.tools.namespace import Namespace
+from src.tools.topology import Topology
+from src.tools.standin import LocalApp, LocalClient
+from src.tools.proxy import Impairment, impairments
+
+
+_logger = logging.getLogger(__name__)
+
+
+@pytest.mark.benchmark
+class TestBenchmark:
+    """
+    **Test Flow** :
+        **Setup**:
+            - Write the agent input for each event count and line size
+            - Start the Splitter and Target containers with the ``class_scoped_container_getter`` fixture, or with
+                ``--stand_in`` a stand-in app with the benchmarked number of Targets, behind proxies with ``--impair``
+
+        **Tests**:
+            - test_pipeline_throughput
+
+        **Teardown**:
+            - Store a JSON result per benchmark to the artifacts directory
+    """
+    @pytest.fixture(name = 'pipeline')
+    def fixture_pipeline(self, request, pytestconfig, stand_in, client: DockerClient, namespace: Namespace,
+                         topology: Topology, run_agent_cmd: Callable, tmp_path: Path, targets: int) -> tuple:
+        """
+        Yield the client, the agent runner, the Target names, the number of Splitters of the pipeline under test and a
+        Callable returning its backpressure counters.
+            - The compose stack runs the ``--targets`` and ``--splitters`` of the session topology, other Target counts
+                are only run by the stand-in. With several Splitters an Agent sends to each at once
+            - The backpressure counters are the stand-in Splitter pauses and the proxy counters, the proxies of the
+                compose stack log theirs
+
+        :param request:         The pytest request, to use ``class_scoped_container_getter`` only with Docker
+        :param pytestconfig:    The pytest Config
+        :param stand_in:        The stand-in app, if any
+        :param client:          A DockerClient
+        :param namespace:       The namespace of the compose stack
+        :param topology:        The Splitters and Targets of the compose stack
+        :param run_agent_cmd:   A Callable to run the Agent node command/container
+        :param tmp_path:        Where the stand-in Targets write
+        :param targets:         The number of Targets
+        :return:
+        """
+        if stand_in is None:
+            if len(topology.targets) != targets:
+                pytest.skip(f'The compose stack runs {len(topology.targets)} Targets, see --targets')
+            request.getfixturevalue('class_scoped_container_getter')
+
+            def _run_agents(monitor: Path) -> List:
+                with ThreadPoolExecutor(max_workers = len(topology.splitters)) as pool:
+                    return list(pool.map(
+                        lambda splitter: run_agent_cmd(monitor = monitor, splitter = splitter), topology.splitters
+                    ))
+
+            names = [namespace(target) for target in topology.targets]
+            yield client, _run_agents, names, len(topology.splitters), lambda: {}
+            return
+
+        names = [f'target_{idx}' for idx in range(1, targets + 1)]
+        app = LocalApp(
+            config_dir  = stand_in.config_dir,
+            workdir     = tmp_path,
+            targets     = names,
+            impairments = {
+                target: Impairment.parse(spec)
+                for target, spec in impairments(pytestconfig.getoption('impair'), names).items()
+            }
+        )
+
+        def _backpressure() -> dict:
+            return {
+                'splitter_pauses': app.splitter.pauses,
+                'splitter_paused': app.splitter.paused,
+                'proxies':         [proxy.proxy.counters() for proxy in app.proxies]
+            }
+
+        app.start()
+        yield LocalClient(app), lambda monitor: [app.run_agent(monitor)], names, 1, _backpressure
+        app.stop()
+
+    def test_pipeline_throughput(self, pytestconfig, stand_in, pipeline: tuple, bench_input: Path, rx_events: Path,
+                                 write_to_artifacts: Callable, events: int, line_size: int, targets: int):
+        """
+        Send the benchmark input through agent -> splitter -> targets and record events/sec, MB/sec,
+        time-to-last-byte, the per Target byte share and the backpressure counters
+
+        :param pytestconfig:        The pytest Config
+        :param stand_in:            The stand-in app, if any
+        :param pipeline:            The client, agent runner, Target names, number of Splitters and backpressure
+        :param bench_input:         The agent input
+        :param rx_events:           The location of the events.log in the Target containers
+        :param write_to_artifacts:  Callable to write to the Artifact directory
+        :param events:              The number of events
+        :param line_size:           The bytes per event
+        :param targets:             The number of Targets
+        :return:
+        """
+        client, run_agents, names, splitters, backpressure = pipeline
+        backend = 'compose' if stand_in is None else 'stand_in'
+
+        agents = []
+
+        def _run():
+            agents.extend(run_agents(bench_input))
+
+        result = measure(
+            run_agent = _run,
+            client    = client,
+            targets   = names,
+            name      = rx_events.name,
+            size      = bench_input.stat().st_size * splitters,
+            events    = events * splitters
+        )
+        for agent in agents:
+            agent.remove()
+        result.update(
+            backend      = backend,
+            node_version = pytestconfig.getoption('node_version'),
+            line_size    = line_size,
+            splitters    = splitters,
+            impair       = pytestconfig.getoption('impair'),
+            **backpressure()
+        )
+        write_to_artifacts(
+            name       = f'{backend}_{events}x{line_size}_{targets}t{f"_{splitters}s" if splitters > 1 else ""}.json',
+            data       = json.dumps(result, indent = 4).encode(),
+            extra_path = self.__class__.__name__
+        )
+        assert result['received'] == result['bytes'], f'{result["received"]} of {result["bytes"]} bytes received'
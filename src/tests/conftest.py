@@ -2,19 +2,34 @@ import os
 import json
 import types
 import pytest
-import tarfile
 import logging
 
 from pathlib import Path
 from datetime import datetime
 from functools import partial
+from contextlib import contextmanager
 from docker import DockerClient
+from docker.errors import ContainerError
 from docker.models.images import Image
+from docker.models.containers import Container
 from docker.models.volumes import Volume
 from docker.models.networks import Network
-from typing import Callable, Generator, Union, Optional, List
+from typing import IO, Callable, Dict, Generator, Iterator, Union, Optional, List
 from _pytest.config import Config
-from src.tools.enums import ServiceType
+from src.tools.enums import LineLength, ServiceType, Stamp
+from src.tools.corpus import cached_corpus
+from src.tools.logs import LogMatcher
+from src.tools.build_cache import BuildCache, build_key
+from src.tools.artifacts import collect
+from src.tools.compress import bundle
+from src.tools.filter import EventFilter, filter_terms
+from src.tools.index_cache import IndexCache
+from src.tools.namespace import Namespace
+from src.tools.topology import Topology
+from src.tools.telemetry import StatsSampler
+from src.tools.latency import LatencyAnalyzer
+from src.tools.proxy import Impairment
+from src.tools.standin import LocalApp, LocalClient
 
 
 _logger = logging.getLogger(__name__)
@@ -25,43 +40,119 @@ def fixture_log(request):
     _logger.info(f'====== Running: {request.node.name} ======')
 
 
+@pytest.fixture(name = 'topology', scope = 'session')
+def fixture_topology() -> Topology:
+    """
+    Yield the :py:class:`Topology` rendered by ``pytest_configure`` from ``--targets`` and ``--splitters``
+
+    :return:
+    """
+    yield Topology.load(os.getenv('TOPOLOGY'))
+
+
+@pytest.fixture(name = 'stand_in', scope = 'session')
+def fixture_stand_in(pytestconfig: Config, tmp_path_factory, topology: Topology) -> Optional[LocalApp]:
+    """
+    Yield the in process :py:class:`LocalApp` when running with ``--stand_in``, otherwise ``None``.
+    The app is started and stopped by the test classes, as the containers are.
+
+    :param pytestconfig:
+    :param tmp_path_factory:
+    :param topology:            The Targets to stand in for, and their impairments
+    :return:
+    """
+    if not pytestconfig.getoption('stand_in'):
+        yield None
+        return
+
+    yield LocalApp(
+        config_dir  = Path(pytestconfig.rootpath, 'src', 'app'),
+        workdir     = tmp_path_factory.mktemp('stand_in'),
+        targets     = topology.targets,
+        impairments = {target: Impairment.parse(spec) for target, spec in topology.impairments.items()}
+    )
+
+
+@pytest.fixture(name = 'namespace', scope = 'session')
+def fixture_namespace(stand_in: Optional[LocalApp]) -> Namespace:
+    """
+    Yield the :py:class:`Namespace` of the compose stack of this session (or pytest-xdist worker), which resolves the
+    service names to container names. The stand-in runs its own processes and is never namespaced.
+
+    :param stand_in:    The stand-in app, if any
+    :return:
+    """
+    yield Namespace.from_env() if stand_in is None else Namespace()
+
+
 @pytest.fixture(name = 'client', scope = 'session')
-def fixture_client() -> DockerClient:
+def fixture_client(stand_in: Optional[LocalApp]) -> Union[DockerClient, LocalClient]:
     """
-    Yield a :py:class:`DockerClient`
+    Yield a :py:class:`DockerClient`, or a :py:class:`LocalClient` for the stand-in
 
     :return:    DockerClient
     """
-    yield DockerClient()
+    yield DockerClient() if stand_in is None else LocalClient(stand_in)
 
 
 @pytest.fixture(name = 'build', scope = 'session', autouse = True)
 def fixture_build(pytestconfig, client: DockerClient) -> None:
     """
-    Build the app image if we aren't in a CI
+    Build the app image if we aren't in a CI. Nothing is built for the stand-in.
+
+    Unless ``--build_cache=0``, local builds go through a :py:class:`BuildCache`: the image is labelled with a digest of
+    ``src/app``, the Dockerfile and the ``node_version``, reused while they are unchanged and kept after the session.
 
     :param pytestconfig:
     :param client:
     :return:
     """
+    if pytestconfig.getoption('stand_in'):
+        yield
+        return
+
     image_tag = pytestconfig.getoption("image_tag")
+    keep = pytestconfig.getoption('build_cache')
+    cached = False
     if os.getenv('CI') is None:
-        _logger.info(f'No CI detected. Building {image_tag}...')
-        image, logs = client.images.build(
-            path = '.',
-            dockerfile = Path(pytestconfig.rootpath, 'src', 'docker', 'app.Dockerfile'),
-            tag = image_tag,
-            nocache = True,
-            rm = True,
-            buildargs = {
-                'node_version': pytestconfig.getoption('node_version')
-            }
-        )
-        for log in logs:
-            if stream := log.get('stream'):
-                _logger.info(stream)
+        dockerfile = Path(pytestconfig.rootpath, 'src', 'docker', 'app.Dockerfile')
+        buildargs = {
+            'node_version': pytestconfig.getoption('node_version')
+        }
+
+        def _build(labels: Optional[Dict[str, str]] = None) -> Image:
+            _logger.info(f'No CI detected. Building {image_tag}...')
+            image, logs = client.images.build(
+                path = '.',
+                dockerfile = dockerfile,
+                tag = image_tag,
+                # From scratch only without the build cache, a cache miss still reuses the unchanged layers
+                nocache = labels is None,
+                rm = True,
+                buildargs = buildargs,
+                labels = labels
+            )
+            for log in logs:
+                if stream := log.get('stream'):
+                    _logger.info(stream)
+            return image
+
+        if keep:
+            cache = BuildCache(client, Path(pytestconfig.cache.mkdir('build_cache'), 'lru.json'), keep)
+            key = build_key([Path(pytestconfig.rootpath, 'src', 'app')], dockerfile, buildargs)
+            cache.build(key, image_tag, _build)
+            cached = True
+        else:
+            _build()
     yield
 
+    if cached:
+        _logger.info(f'Keeping image {image_tag} in the build cache')
+        return
+    if os.getenv('PYTEST_XDIST_WORKER'):
+        # The other workers may still run containers of the image
+        _logger.info(f'Keeping image {image_tag} used by the other workers')
+        return
     _logger.info(f'Removing image {image_tag}')
     client.images.remove(
         image = pytestconfig.getoption("image_tag")
@@ -130,13 +221,82 @@ def fixture_rx_events(pytestconfig: Config, working_dir: str) -> Path:
     yield Path(working_dir, inputs.get('file'))
 
 
+@pytest.fixture(name = 'event_filter', scope = 'session')
+def fixture_event_filter(pytestconfig: Config) -> Optional[EventFilter]:
+    """
+    Yield the Splitter filter from its filter.json as an :py:class:`EventFilter`, or ``None`` without a filter or
+    with ``--splitter_filter=off``
+
+    :return:
+    """
+    yield EventFilter.load(
+        Path(pytestconfig.rootpath, 'src', 'app', ServiceType.SPLITTER.value, 'filter.json'),
+        pytestconfig.getoption('splitter_filter')
+    )
+
+
+@pytest.fixture(name = 'index_cache', scope = 'session')
+def fixture_index_cache(pytestconfig: Config) -> Optional[IndexCache]:
+    """
+    Yield the :py:class:`IndexCache` of master indexes in the pytest cache, ``None`` with ``--index_cache=0``
+
+    :return:
+    """
+    limit = pytestconfig.getoption('index_cache')
+    yield IndexCache(pytestconfig.cache.mkdir('index_cache'), limit) if limit else None
+
+
+@pytest.fixture(name = 'corpus', scope = 'session')
+def fixture_corpus(pytestconfig: Config, tmp_path_factory) -> Callable[..., Path]:
+    """
+    Yield a Callable returning a generated event corpus, see :py:func:`cached_corpus`.
+
+    The corpora are kept in the pytest cache so later sessions reuse them. Their random filler never holds the
+    Splitter filter terms, so events are only filtered when a corpus is made to hold them.
+
+    :param pytestconfig:
+    :param tmp_path_factory:
+    :return:
+    """
+    cache = getattr(pytestconfig, 'cache', None)
+    avoid = filter_terms(Path(pytestconfig.rootpath, 'src', 'app', ServiceType.SPLITTER.value, 'filter.json'))
+    yield partial(cached_corpus, cache.mkdir('corpus') if cache else tmp_path_factory.mktemp('corpus'), avoid = avoid)
+
+
+@pytest.fixture(name = 'monitor', scope = 'session')
+def fixture_monitor(pytestconfig: Config, corpus: Callable[..., Path]) -> Optional[Path]:
+    """
+    Yield the generated corpus the agent sends instead of its monitor file when ``--corpus_events`` is given,
+    otherwise ``None``.
+
+    :param pytestconfig:
+    :param corpus:      Callable returning a generated corpus
+    :return:
+    """
+    if (events := pytestconfig.getoption('corpus_events')) is None:
+        yield None
+        return
+
+    yield corpus(
+        events       = events,
+        distribution = LineLength(pytestconfig.getoption('corpus_distribution')),
+        line_size    = pytestconfig.getoption('corpus_line_size'),
+        stamp        = Stamp(pytestconfig.getoption('corpus_stamp')),
+        seed         = pytestconfig.getoption('corpus_seed')
+    )
+
+
 @pytest.fixture(name = 'tx_events', scope = 'session')
-def fixture_tx_events(pytestconfig: Config) -> Path:
+def fixture_tx_events(pytestconfig: Config, monitor: Optional[Path]) -> Path:
     """
-    Yield the local location of the agent event source file.
+    Yield the local location of the agent event source file, the generated corpus if there is one.
 
     :return:
     """
+    if monitor is not None:
+        yield monitor
+        return
+
     path = Path(pytestconfig.rootpath, 'src', 'app', ServiceType.AGENT.value)
     with Path(path, 'inputs.json').open() as file:
         inputs = json.load(file)
@@ -157,20 +317,30 @@ def fixture_reports(pytestconfig: Config) -> Path:
 
 
 @pytest.fixture(name = 'targz', scope = 'session', autouse = True)
-def fixture_targz(reports: Path, artifacts_dir: Path) -> None:
+def fixture_targz(pytestconfig: Config, reports: Path, artifacts_dir: Path) -> None:
     """
-    During teardown, collect all items in the Artifacts folder and compress them
+    During teardown, collect the items in the Artifacts folder selected by the ``--bundle_*`` options and compress
+    them on a thread pool, identical files stored once. Under pytest-xdist the controller bundles once all the workers
+    are done (see ``pytest_sessionfinish``).
 
+    :param pytestconfig:
     :param reports:
     :param artifacts_dir:
     :return:
     """
     yield
 
-    if os.getenv('CI'):
-        with tarfile.open(name = str(Path(reports, f'{artifacts_dir.name}.tar.gz')), mode = 'w|gz') as tar:
-            tar.add(str(artifacts_dir), artifacts_dir.name)
-            _logger.info(f'Add {artifacts_dir.name} to {tar.name}')
+    if os.getenv('CI') and not os.getenv('PYTEST_XDIST_WORKER'):
+        output = Path(reports, f'{artifacts_dir.name}.tar.gz')
+        bundle(
+            directory  = artifacts_dir,
+            output     = output,
+            include    = pytestconfig.getoption('bundle_include'),
+            exclude    = pytestconfig.getoption('bundle_exclude'),
+            compressed = pytestconfig.getoption('bundle_compressed'),
+            workers    = pytestconfig.getoption('bundle_workers') or None
+        )
+        _logger.info(f'Add {artifacts_dir.name} to {output}')
 
 
 @pytest.fixture(name = 'write_to_artifacts', scope = 'session')
@@ -208,54 +378,251 @@ def fixture_write_to_artifacts(artifacts_dir: Path) -> Callable:
     yield _func
 
 
+@pytest.fixture(name = 'artifact_file', scope = 'session')
+def fixture_artifact_file(artifacts_dir: Path) -> Callable:
+    """
+    Yield a Callable to open a writable file in the Artifacts directory, e.g. as the sink for streamed data.
+
+    :param artifacts_dir:   The location of the Artifacts directory
+    :return:
+    """
+    @contextmanager
+    def _func(name: str, extra_path: Path = '') -> Iterator[IO[bytes]]:
+        """
+        Creates a new file and yields it opened for binary writing. The file is closed when the context exits.
+
+        :param name:        The name of the file
+        :param extra_path:  Additional folders to create before opening the file
+        :return:
+        """
+        path = Path(artifacts_dir, extra_path)
+        path.mkdir(parents = True, exist_ok = True)
+
+        with Path(path, name).open(mode = 'wb') as file:
+            yield file
+            _logger.info(f'Created {name} at {path}')
+
+    yield _func
+
+
+@pytest.fixture(name = 'collect_artifacts', scope = 'session')
+def fixture_collect_artifacts(pytestconfig: Config, artifacts_dir: Path) -> Callable:
+    """
+    Yield a Callable to stream several artifacts to the Artifacts directory concurrently, e.g. container logs.
+
+    Each artifact is capped to ``--artifact_cap`` bytes, keeping its head and tail (see :py:func:`collect`).
+
+    :param pytestconfig:
+    :param artifacts_dir:   The location of the Artifacts directory
+    :return:
+    """
+    def _func(sources: Dict[str, Callable[[], Union[bytes, Iterator[bytes]]]],
+              extra_path: Path = '') -> Dict[str, Path]:
+        """
+        :param sources:     Callables returning the content (bytes or chunks) by file name
+        :param extra_path:  Additional folders to create before writing the files to them
+        :return:            The paths by file name
+        """
+        return collect(sources, Path(artifacts_dir, extra_path), pytestconfig.getoption('artifact_cap'))
+
+    yield _func
+
+
+@pytest.fixture(name = 'latency', scope = 'session')
+def fixture_latency(pytestconfig: Config) -> Optional[LatencyAnalyzer]:
+    """
+    Yield the :py:class:`LatencyAnalyzer` the online verification feeds with ``--latency``, otherwise ``None``.
+
+    :param pytestconfig:
+    :return:
+    """
+    if not pytestconfig.getoption('latency'):
+        yield None
+        return
+
+    yield LatencyAnalyzer(window = pytestconfig.getoption('latency_window'))
+
+
 @pytest.fixture(name = 'run_agent_cmd', scope = 'session')
-def fixture_run_agent(client: DockerClient, image: Callable, network: Callable) -> Callable:
+def fixture_run_agent(pytestconfig: Config, client: DockerClient, image: Callable, network: Callable,
+                      stand_in: Optional[LocalApp], monitor: Optional[Path], topology: Topology) -> Callable:
     """
     Yield a :py:class:`Callable`.
 
-    When called will run the agent container and the ``node app.js agent`` command
+    When called will run the agent container and the ``node app.js agent`` command, or the stand-in agent, sending to
+    the first Splitter of the topology or to a given one.
+
+    With ``--latency`` the stand-in agent stamps the events as it sends them (only the stand-in takes it).
 
     :param client:      The DockerClient
     :param image:       The Image instance
     :param network:     The Network instance
+    :param stand_in:    The stand-in app, if any
+    :param monitor:     The generated corpus to send by default, if any
+    :param topology:    The topology, the agent is pointed at its Splitter with the rendered ``outputs.json``
     :return:            Callable
     """
-    def _func(_client: DockerClient) -> List[str]:
-        """
-        Call :py:method:`DockerClient.containers.run` on the image and run the app command
+    stamp = pytestconfig.getoption('latency')
+    if stand_in is not None:
+        def _local(monitor: Optional[Path] = monitor, splitter: Optional[str] = None) -> Container:
+            # The stand-in runs the single Splitter
+            return stand_in.run_agent(monitor = monitor, stamp = stamp)
 
-        :param _client: The DockerClient
-        :return:        Generator
+        yield _local
+        return
+
+    def _func(_client: DockerClient, monitor: Optional[Path] = None, splitter: Optional[str] = None) -> Container:
+        """
+        Call :py:method:`DockerClient.containers.run` on the image and run the app command. The container is run
+        detached and waited for, so its output can be streamed from its logs; the caller removes it. As with an
+        attached run, a non-zero exit raises a :py:class:`ContainerError`, and the container is removed first.
+
+        :param _client:     The DockerClient
+        :param monitor:     A local file to send instead of the monitor file in the image. It is mounted into the
+                            container along with an ``inputs.json`` pointing the agent at it
+        :param splitter:    The Splitter service to send to, the first one by default
+        :return:            The exited Agent container
+        :raises ContainerError: When the Agent exits with a non-zero status
         """
         params = dict(
             image = image().short_id,
             command = ['node', 'app.js', ServiceType.AGENT.value],
             network = network().name,
-            remove = True
+            detach = True,
+            volumes = {}
         )
+        agent_dir = Path(os.getenv('WORKING_DIR'), ServiceType.AGENT.value)
+        outputs = topology.agent_outputs(splitter or topology.splitters[0])
+        params['volumes'][str(outputs.resolve())] = {'bind': str(Path(agent_dir, 'outputs.json')), 'mode': 'ro'}
+        if monitor is not None:
+            inputs = Path(monitor.parent, f'{monitor.stem}_inputs.json')
+            inputs.write_text(json.dumps({'monitor': f'inputs/{monitor.name}'}))
+            params['volumes'].update({
+                str(monitor.resolve()): {'bind': str(Path(agent_dir, 'inputs', monitor.name)), 'mode': 'ro'},
+                str(inputs.resolve()):  {'bind': str(Path(agent_dir, 'inputs.json')), 'mode': 'ro'}
+            })
 
         _logger.info('Running Agent Container...')
         _logger.info(f'\n{json.dumps(params, indent = 4, sort_keys = True)}')
-        return _client.containers.run(**params)
+        container = _client.containers.run(**params)
+        try:
+            status = container.wait().get('StatusCode')
+            if status != 0:
+                stderr = container.logs(stdout = False, stderr = True)
+                _logger.error(f'Agent Container exited with {status}')
+                raise ContainerError(container, status, params['command'], params['image'], stderr)
+        except Exception:
+            container.remove(force = True)
+            raise
+        return container
+
+    yield partial(_func, client, monitor = monitor)
+
+
+@pytest.fixture(name = 'telemetry', scope = 'session')
+def fixture_telemetry(pytestconfig: Config, client: DockerClient, namespace: Namespace, stand_in: Optional[LocalApp],
+                      artifacts_dir: Path) -> Callable[..., Callable[[], Optional[Dict]]]:
+    """
+    Yield a :py:class:`Callable`.
+
+    When called, will sample the Docker stats of the Splitter and Target containers on background threads (see
+    :py:class:`StatsSampler`) and return a Callable to stop. Stopping writes the ``telemetry.npz`` series and the
+    ``telemetry.json`` summary to the Artifacts directory and returns the summary. Nothing is sampled for the
+    stand-in or with ``--telemetry_interval=0``.
+
+    :param pytestconfig:
+    :param client:          A DockerClient
+    :param namespace:       The namespace of the compose stack
+    :param stand_in:        The stand-in app, if any
+    :param artifacts_dir:   The location of the Artifacts directory
+    :return:
+    """
+    interval = pytestconfig.getoption('telemetry_interval')
+
+    def _func(extra_path: Path = '') -> Callable[[], Optional[Dict]]:
+        """
+        :param extra_path:  Additional folders to write the telemetry to
+        :return:            The Callable stopping the sampling, only the first call writes
+        """
+        if stand_in is not None or not interval:
+            return lambda: None
+
+        containers = namespace.containers(client, ServiceType.SPLITTER, ServiceType.TARGET)
+        sampler = StatsSampler(
+            {container.name: container.stats(stream = True, decode = True) for container in containers},
+            interval = interval,
+            relays   = [
+                container.name for container in containers
+                if container.labels.get('operation-mode') == ServiceType.SPLITTER
+            ]
+        ).start()
+        summary = []
+
+        def _stop() -> Optional[Dict]:
+            if not summary:
+                sampler.stop()
+                summary.append(sampler.save(Path(artifacts_dir, extra_path)))
+            return summary[0]
+
+        return _stop
+
+    yield _func
 
-    yield partial(_func, client)
+
+@pytest.fixture(name = 'checkpoints', scope = 'class')
+def fixture_checkpoints() -> Dict[str, float]:
+    """
+    Yield the checkpoints of a test class: the time each phase (e.g. ``start``, ``run``) began, as a UNIX timestamp.
+    Log searches pass them as ``since`` to skip the logs of earlier phases.
+
+    :return:
+    """
+    yield {}
 
 
 @pytest.fixture(name = 'logs', scope = 'session')
-def fixture_logs(client: DockerClient) -> Callable[[str, Optional[datetime]], List[str]]:
+def fixture_logs(client: DockerClient,
+                 namespace: Namespace) -> Callable[[str, Union[datetime, float, None]], Iterator[bytes]]:
     """
     Yield a :py:class:`Callable`.
 
-    When called, will return the logs of a container from start or from a given timestamp.
+    When called, will stream the logs of a service container (in the session namespace) from start or from a given
+    timestamp.
 
-    :param client:  A DockerClient
+    :param client:      A DockerClient
+    :param namespace:   The namespace of the compose stack
     :return:
     """
-    def _func(_client: DockerClient, service: str, since: Optional[datetime] = None) -> List[str]:
-        return _client.containers.get(service).logs(
-            timestamps = True,
-            since = since
+    def _func(_client: DockerClient, service: str, since: Union[datetime, float, None] = None) -> Iterator[bytes]:
+        # No timestamps, they would come before every line and keep ``^`` anchored patterns from matching
+        return _client.containers.get(namespace(service)).logs(
+            since = since,
+            stream = True,
+            follow = False
         )
 
     yield partial(_func, client)
 
+
+@pytest.fixture(name = 'match_logs', scope = 'session')
+def fixture_match_logs(logs: Callable) -> Callable[..., Dict[str, Optional[bytes]]]:
+    """
+    Yield a :py:class:`Callable`.
+
+    When called, will stream the logs of a container and match them against several patterns in one pass, reading
+    only until every pattern has matched (see :py:class:`LogMatcher`).
+
+    :param logs:    Callable streaming the logs of a container
+    :return:
+    """
+    def _func(service: str, patterns: Dict[str, Union[bytes, str]],
+              since: Union[datetime, float, None] = None) -> Dict[str, Optional[bytes]]:
+        """
+        :param service:     The container name
+        :param patterns:    Regexes by name
+        :param since:       A checkpoint to search from
+        :return:            The first line matching each pattern, ``None`` for the ones never matched
+        """
+        return LogMatcher(patterns).match(logs(service, since))
+
+    yield _func
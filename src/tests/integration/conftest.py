@@ -1,4 +1,21 @@
+import os
+import pytest
 
+from src.tools.topology import Topology
 
 
-
+def pytest_generate_tests(metafunc):
+    """
+    Parametrize the ``target``, ``splitter`` and ``src``/``dst`` tests over the services of the rendered
+    :py:class:`Topology`
+    """
+    topology = Topology.load(os.getenv('TOPOLOGY'))
+    if 'target' in metafunc.fixturenames:
+        metafunc.parametrize('target', topology.targets, ids = topology.targets)
+    if 'splitter' in metafunc.fixturenames:
+        metafunc.parametrize('splitter', topology.splitters, ids = topology.splitters)
+    if 'src' in metafunc.fixturenames:
+        metafunc.parametrize(
+            ('src', 'dst'),
+            [pytest.param(src, dst, id = f'{src} -> {dst}') for src, dst in topology.links()]
+        )
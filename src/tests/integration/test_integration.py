@@ -1,13 +1,25 @@
+import os
+import json
+import time
 import pytest
-import tarfile
 import logging
 
 from pathlib import Path
-from typing import Callable
+from functools import partial
+from typing import IO, Callable, Dict, List, Optional
 from docker import DockerClient
-from itertools import permutations
+from contextlib import ExitStack
+from concurrent.futures import Future, ThreadPoolExecutor
 from src.tools.enums import ServiceType
-from src.tools.utils import event_check
+from src.tools.utils import approximate_check, assert_results, event_check
+from src.tools.filter import EventFilter
+from src.tools.index_cache import IndexCache
+from src.tools.namespace import Namespace
+from src.tools.topology import Topology
+from src.tools.online import OnlineCheck, OnlineVerifier, follow
+from src.tools.latency import LatencyAnalyzer
+from src.tools.archive import stream_member
+from src.tools.scanner import scan
 
 
 _logger = logging.getLogger(__name__)
@@ -18,7 +30,7 @@ class TestApp:
     **Test Flow** :
         **Setup**:
             - Start the Splitter and Target containers with the ``class_scoped_container_getter`` fixture
-            - Run the Agent container (``node app.js agent``)
+            - Run the Agent container (``node app.js agent``), one per Splitter
                 - Store the output for later records
 
         **Tests**:
@@ -26,193 +38,398 @@ class TestApp:
             - test_splitter_container_up_and_stable
             - test_target_received_agent_events
             - test_events_stored_and_correct_at_target
+            - test_event_latency_within_budget
 
         **Teardown**:
             - Store the Agent logs to the artifact directory
             - Store the Splitter and Target Logs to the artifacts directory
     """
     @pytest.fixture(name = 'start', scope = 'class', autouse = True)
-    def fixture_start(self, class_scoped_container_getter, write_to_artifacts: Callable) -> None:
+    def fixture_start(self, request, stand_in, checkpoints: Dict[str, float], collect_artifacts: Callable) -> None:
         """
         Start the Splitter/Target containers as defined in the docker-compose yaml.
             - The ``class_scoped_container_getter`` will use docker-compose up to start the container and
                 wait for them to be up
             - Once this fixture goes out of scope, the containers will be torn down and removed along with the
                 Network and Volumes
+            - With ``--stand_in`` the in process stand-in is started and stopped instead
 
-        :param class_scoped_container_getter:   pytest-docker-compose fixture
-        :param write_to_artifacts:              Callable to write to the Artifact directory
+        :param request:             The pytest request, to use ``class_scoped_container_getter`` only with Docker
+        :param stand_in:            The stand-in app, if any
+        :param checkpoints:         The start time of each phase, ``start`` is recorded
+        :param collect_artifacts:   Callable to stream the container logs to the Artifact directory
 
         :return:
         """
+        checkpoints['start'] = time.time()
+        if stand_in is None:
+            containers = request.getfixturevalue('class_scoped_container_getter').docker_project.containers
+        else:
+            stand_in.start()
+            containers = stand_in.containers
+
         _logger.info(f'App is UP and Running...')
         yield
-        for container in class_scoped_container_getter.docker_project.containers():
-            write_to_artifacts(
-                name       = f'{container.name}.log',
-                data       = container.logs(),
-                extra_path = self.__class__.__name__
-            )
+        collect_artifacts(
+            sources    = {
+                f'{container.name}.log': partial(container.logs, stream = True, follow = False)
+                for container in containers()
+            },
+            extra_path = self.__class__.__name__
+        )
+
+        if stand_in is not None:
+            stand_in.stop()
 
     @pytest.fixture(name = 'run', scope = 'class')
-    def fixture_run(self, start, client: DockerClient, run_agent_cmd: Callable, write_to_artifacts: Callable) -> None:
+    def fixture_run(self, start, pytestconfig, client: DockerClient, namespace: Namespace, topology: Topology,
+                    run_agent_cmd: Callable, telemetry: Callable, checkpoints: Dict[str, float],
+                    collect_artifacts: Callable, artifacts_dir: Path, rx_events: Path, tx_events: Path,
+                    event_filter: Optional[EventFilter], index_cache: Optional[IndexCache],
+                    latency: Optional[LatencyAnalyzer]) -> Optional[List[OnlineVerifier]]:
         """
-        Uses the ``run_agent_cmd`` fixture to run the Agent container.
-            - Ensures that the Agent container is run before any tests in this class are executed
+        Uses the ``run_agent_cmd`` fixture to run the Agent container, one per Splitter of the topology at once.
+            - Ensures that the Agent container is run before any tests in this class are executed, and raises if
+                an Agent exits with a non-zero status
+            - The Splitter and Target container stats are sampled while the Agents run
+            - With ``--online`` the Target events.log files are followed and verified while the Agent runs, each
+                Splitter's group of Targets on its own. The fixture returns once the verifications are decided and the
+                Agents are done
+            - With ``--latency`` the followed events are also fed to the latency analyzer, and its percentiles are
+                written to ``latency.json`` in the Artifact directory once the verifications are decided
 
         :param start:               The start fixture (placement ensures it is called before this fixture)
+        :param pytestconfig:        The pytest Config
         :param client:              A DockerClient
+        :param namespace:           The namespace of the compose stack
+        :param topology:            The Splitters and their Targets
         :param run_agent_cmd:       A Callable to run the Agent node command/container
-        :param write_to_artifacts:  Callable to write to the Artifact directory
-        :return:
+        :param telemetry:           A Callable to sample the container stats
+        :param checkpoints:         The start time of each phase, ``run`` is recorded
+        :param collect_artifacts:   Callable to stream the Agent logs to the Artifact directory
+        :param artifacts_dir:       The location of the Artifacts directory
+        :param rx_events:           The location of the events.log in the Target containers
+        :param tx_events:           The location of the local monitor file
+        :param event_filter:        The Splitter filter, events it drops must not reach the Targets
+        :param index_cache:         The cache of master indexes
+        :param latency:             The latency analyzer, if any
+        :return:                    The online verification of each Splitter, if any
         """
-        output = run_agent_cmd()
-        yield
-        write_to_artifacts(
-            name = 'agent.log',
-            data = output,
+        checkpoints['run'] = time.time()
+        pool = ThreadPoolExecutor(max_workers = len(topology.splitters))
+        stop_telemetry = telemetry(extra_path = self.__class__.__name__)
+        if not pytestconfig.getoption('online'):
+            futures = [pool.submit(run_agent_cmd, splitter = splitter) for splitter in topology.splitters]
+            pool.shutdown(wait = True)
+            self._raise_failed_agent(futures, stop_telemetry)
+            stop_telemetry()
+            yield None
+        else:
+            verifiers = []
+            for group in topology.groups.values():
+                targets = [client.containers.get(namespace(target)) for target in group]
+                online = OnlineVerifier(
+                    OnlineCheck(
+                        tx_events,
+                        [target.name for target in targets],
+                        pattern      = pytestconfig.getoption('event_pattern').encode() or None,
+                        cache        = index_cache,
+                        event_filter = event_filter
+                    ),
+                    {target.name: follow(target, rx_events) for target in targets},
+                    latency = latency
+                )
+                online.start()
+                verifiers.append(online)
+            futures = [pool.submit(run_agent_cmd, splitter = splitter) for splitter in topology.splitters]
+            pool.shutdown(wait = False)
+            for online, future in zip(verifiers, futures):
+                online.wait(future)
+            self._raise_failed_agent(futures, stop_telemetry)
+            if latency is not None:
+                latency.save(Path(artifacts_dir, self.__class__.__name__))
+            yield verifiers
+
+        agents = {splitter: future.result() for splitter, future in zip(topology.splitters, futures)}
+        stop_telemetry()
+        collect_artifacts(
+            sources    = {
+                'agent.log' if len(agents) == 1 else f'agent_{splitter}.log':
+                    partial(agent.logs, stream = True, follow = False)
+                for splitter, agent in agents.items()
+            },
             extra_path = self.__class__.__name__
         )
+        for agent in agents.values():
+            agent.remove()
+
+    @staticmethod
+    def _raise_failed_agent(futures: List[Future], stop_telemetry: Callable) -> None:
+        """
+        Wait for the Agent runs and raise the error of the first one that failed, so it fails the run rather than
+        showing up as missing events. The telemetry is stopped and the Agents that did not fail are removed first.
+        """
+        if errors := [future.exception() for future in futures if future.exception() is not None]:
+            stop_telemetry()
+            for future in futures:
+                if future.exception() is None:
+                    future.result().remove()
+            raise errors[0]
 
     @staticmethod
-    @pytest.mark.parametrize(
-        'target',
-        [
-            'target_1', 'target_2'
-        ]
-    )
-    def test_target_container_up_and_stable(client: DockerClient, target: str):
+    def test_target_container_up_and_stable(client: DockerClient, namespace: Namespace, target: str):
         """
         Verify the target containers are running the node command
 
-        :param client:  A DockerClient
-        :param target:  The hostname of the Target container
+        :param client:      A DockerClient
+        :param namespace:   The namespace of the compose stack
+        :param target:      The service name of the Target container
         :return:
         """
-        container = client.containers.get(target)
+        container = client.containers.get(namespace(target))
         result = container.exec_run('pidof node app.js target')
         assert result.exit_code == 0, f'Startup command was not detected on {target}'
 
     @staticmethod
-    def test_splitter_container_up_and_stable(client: DockerClient):
+    def test_splitter_container_up_and_stable(client: DockerClient, namespace: Namespace, splitter: str):
         """
-        Verify the splitter container is running the node command
+        Verify the splitter containers are running the node command
 
-        :param client:  A DockerClient
+        :param client:      A DockerClient
+        :param namespace:   The namespace of the compose stack
+        :param splitter:    The service name of the Splitter container
         :return:
         """
-        splitter = client.containers.get(ServiceType.SPLITTER)
-        result = splitter.exec_run('pidof node app.js splitter')
-        assert result.exit_code == 0, f'Startup command was not detected on splitter'
+        container = client.containers.get(namespace(splitter))
+        result = container.exec_run('pidof node app.js splitter')
+        assert result.exit_code == 0, f'Startup command was not detected on {splitter}'
 
     @staticmethod
-    @pytest.mark.parametrize(
-        ('src', 'dst'),
-        [
-            pytest.param(src, dst, id = f'{src} -> {dst}') for src, dst in permutations(
-                ['splitter', 'target_1', 'target_2'], r = 2
-            )
-        ]
-    )
-    def test_services_reachable_by_service(client: DockerClient, src: str, dst: str, ):
+    def test_services_reachable_by_service(client: DockerClient, namespace: Namespace, src: str, dst: str, ):
         """
         Verify each container is reachable by its Hostname
 
-        :param client:  A DockerClient
-        :param src:     The Source container hostname
-        :param dst:     The Destination container hostname
+        :param client:      A DockerClient
+        :param namespace:   The namespace of the compose stack
+        :param src:         The Source service name
+        :param dst:         The Destination service name
         :return:
         """
-        response = client.containers.get(src).exec_run(f'ping -c 5 -i .2 {dst}')
+        response = client.containers.get(namespace(src)).exec_run(f'ping -c 5 -i .2 {namespace(dst)}')
         _logger.info(f'{src} -> {dst}:\n{response.output.decode()}')
         assert response.exit_code == 0, f'Failed to reach {dst} from {src}'
 
     @staticmethod
-    @pytest.mark.parametrize(
-        'target',
-        [
-            'target_1', 'target_2'
-        ]
-    )
     @pytest.mark.usefixtures('run')
-    def test_agent_connection_registered_at_target(client: DockerClient, target: str):
+    def test_agent_connection_registered_at_target(match_logs: Callable, checkpoints: Dict[str, float], target: str):
         """
         Verify the Target container logged the client connection
 
-        :param client:  A DockerClient
-        :param target:  The hostname of the Target container
+        The logs are streamed from the start of the run and only read until the entry is found.
+
+        :param match_logs:  Callable to match the logs of a container
+        :param checkpoints: The start time of each phase
+        :param target:      The hostname of the Target container
         :return:
         """
-        container = client.containers.get(target)
-
-        # TODO: Could be going through a TON of logs. Should use fixture and 'since' option
         _logger.info(f"Looking for 'client connected' in {target} logs...")
-        for log in container.logs().decode().split('\n'):
-            if 'client connected' in log:
-                _logger.info('  ...entry found.')
-                break
-        else:
-            _logger.info('   ..entry not found')
-            raise AssertionError(f'Unable to determine if the client connected to {target}')
+        found = match_logs(target, {'connected': rb'^client connected'}, since = checkpoints['run'])
+        assert found['connected'] is not None, f'Unable to determine if the client connected to {target}'
+        _logger.info(f'  ...entry found: {found["connected"].decode(errors = "replace")}')
 
     @staticmethod
-    @pytest.mark.parametrize(
-        'target',
-        [
-            'target_1', 'target_2'
-        ]
-    )
     @pytest.mark.usefixtures('run')
-    def test_target_events_log_created(client: DockerClient, target: str, rx_events: Path):
+    def test_target_events_log_created(client: DockerClient, namespace: Namespace, target: str, rx_events: Path):
         """
         Verify the Target container logged the client events
 
-        :param client:  A DockerClient
-        :param target:  The hostname of the Target container
+        :param client:      A DockerClient
+        :param namespace:   The namespace of the compose stack
+        :param target:      The service name of the Target container
         :return:
         """
         # Basic check for existence
         _logger.info(f'Searching for {rx_events} file...')
-        result = client.containers.get(target).exec_run(f'test -f {rx_events.name}')
+        result = client.containers.get(namespace(target)).exec_run(f'test -f {rx_events.name}')
         assert result.exit_code == 0, f'The {rx_events.name} log was not found on {target}.'
 
-    @pytest.mark.usefixtures('run')
-    def test_events_stored_and_correct_at_targets(self, request, client: DockerClient, write_to_artifacts: Callable,
-                                                  rx_events: Path, tx_events: Path):
+    def test_events_stored_and_correct_at_targets(self, pytestconfig, run: Optional[List[OnlineVerifier]],
+                                                  client: DockerClient, namespace: Namespace, topology: Topology,
+                                                  artifact_file: Callable,
+                                                  write_to_artifacts: Callable, rx_events: Path, tx_events: Path,
+                                                  event_filter: Optional[EventFilter],
+                                                  index_cache: Optional[IndexCache]):
         """
-        Verify the Events received at the Target containers match the events in the monitor file
+        Verify the Events received at the Target containers match the events in the monitor file, each Splitter's
+        group of Targets holding the monitor file once
+
+        The archives are parsed as they stream from the Target containers and fed straight into the verifier. With
+        ``--tee_events`` the events.log files are copied to the Artifact directory on the way through and scanned for
+        torn lines afterwards, with a JSON report next to each copy.
+
+        The time the verification took and whether it passed are written to ``verification.json``
+        (``verification_<splitter>.json`` with several Splitters) in the Artifact directory, on a failed run too. With
+        ``--distribution`` the spread of the events over the Targets is analysed in the same pass, appended to the
+        report and, when the verification passes, written to ``distribution.json``
+        (``distribution_<splitter>.json``).
+
+        With ``--approximate`` the events are first streamed through :py:func:`approximate_check`, its report is
+        written to ``approximate.json`` (``approximate_<splitter>.json``) and the archives are only streamed again for
+        the exact verification when it finds a discrepancy.
+
+        With ``--online`` the events were already verified while the Agent ran, and only the outcome is checked.
 
+        :param pytestconfig:        The pytest Config
+        :param run:                 The online verification of each Splitter, if any
         :param client:              A DockerClient
+        :param namespace:           The namespace of the compose stack
+        :param topology:            The Splitters and their Targets
+        :param artifact_file:       Callable to open a file in the Artifact directory
         :param write_to_artifacts:  Callable to write to the Artifact directory
         :param rx_events:           The location of the events.log in the Target containers
         :param tx_events:           The location of the local monitor file
+        :param event_filter:        The Splitter filter, events it drops must not reach the Targets
+        :param index_cache:         The cache of master indexes
         :return:
         """
-        targets = [
-            container for container in client.containers.list()
-            if container.labels.get('operation-mode') in [ServiceType.TARGET]
-        ]
+        if run is not None:
+            for online in run:
+                if online.error is not None:
+                    raise online.error
+                assert_results(online.results)
+            return
 
-        logs = []
-        for target in targets:
-            # Grab the events.log from each Target
-            _logger.info(f'Get Archive {rx_events.name} from {target.name}')
-            result = target.exec_run(f'test -f {rx_events.name}')
-            if result.exit_code == 0:
-                stream, stats = client.api.get_archive(target.name, rx_events, encode_stream = True)
-                log_name = f'{target.name}_events.tar'
-                logs.append(
-                    write_to_artifacts(
-                        name = log_name,
-                        data = stream,
-                        extra_path = self.__class__.__name__
+        pattern = pytestconfig.getoption('event_pattern').encode() or None
+        for splitter, group in topology.groups.items():
+            targets = [client.containers.get(namespace(target)) for target in group]
+            suffix = '' if len(topology.splitters) == 1 else f'_{splitter}'
+
+            if pytestconfig.getoption('approximate'):
+                with ExitStack() as stack:
+                    started = time.monotonic()
+                    sketch = approximate_check(
+                        tx_events,
+                        *self._streams(stack, client, targets, rx_events),
+                        error        = pytestconfig.getoption('approximate_error'),
+                        precision    = pytestconfig.getoption('approximate_precision'),
+                        capacity     = pytestconfig.getoption('approximate_capacity'),
+                        event_filter = event_filter
                     )
+                    sketch['seconds'] = time.monotonic() - started
+                write_to_artifacts(
+                    name       = f'approximate{suffix}.json',
+                    data       = json.dumps(sketch, indent = 4).encode(),
+                    extra_path = self.__class__.__name__
                 )
+                if sketch['clean']:
+                    _logger.info(f'The approximate check of the {splitter} Targets is clean, skipping the exact one')
+                    continue
+                _logger.warning(f'The approximate check of the {splitter} Targets found a discrepancy, running the '
+                                f'exact one')
+
+            copies = []
+            try:
+                with ExitStack() as stack:
+                    partials = []
+                    for target in targets:
+                        # Stream the events.log from each Target
+                        _logger.info(f'Get Archive {rx_events.name} from {target.name}')
+                        result = target.exec_run(f'test -f {rx_events.name}')
+                        if result.exit_code == 0:
+                            stream, stats = client.api.get_archive(target.name, rx_events)
+                            sink = None
+                            if pytestconfig.getoption('tee_events'):
+                                sink = stack.enter_context(
+                                    artifact_file(
+                                        name = f'{target.name}_{rx_events.name}',
+                                        extra_path = self.__class__.__name__
+                                    )
+                                )
+                                copies.append(Path(sink.name))
+                            partials.append(
+                                stack.enter_context(
+                                    stream_member(stream, rx_events.name, sink = sink, name = target.name)
+                                )
+                            )
+
+                    _logger.info(f'Determine if aggregate events in {rx_events.name} of the {splitter} Targets '
+                                 f'match {tx_events.name}')
+                    verification, distribution = {'targets': len(targets), 'passed': False}, None
+                    started = time.monotonic()
+                    try:
+                        distribution = event_check(
+                            tx_events,
+                            *partials,
+                            workers      = pytestconfig.getoption('verify_workers') or os.cpu_count(),
+                            pattern      = pattern,
+                            distribution = pytestconfig.getoption('distribution'),
+                            event_filter = event_filter,
+                            cache        = index_cache
+                        )
+                        verification['passed'] = True
+                    finally:
+                        # Written on a failed verification too, which raises before returning any analysis
+                        verification['seconds'] = time.monotonic() - started
+                        _logger.info(f'Verified the {len(targets)} Targets of {splitter} in '
+                                     f'{verification["seconds"]:.3f}s')
+                        write_to_artifacts(
+                            name       = f'verification{suffix}.json',
+                            data       = json.dumps(verification, indent = 4).encode(),
+                            extra_path = self.__class__.__name__
+                        )
+                        if distribution is not None:
+                            write_to_artifacts(
+                                name       = f'distribution{suffix}.json',
+                                data       = json.dumps(distribution, indent = 4).encode(),
+                                extra_path = self.__class__.__name__
+                            )
+            finally:
+                # The copies are complete once their streams are closed. A failing scan is only logged, so it never
+                # hides the verdict of the verification
+                for copy in copies if pattern else []:
+                    try:
+                        write_to_artifacts(
+                            name = f'{copy.stem}_scan.json',
+                            data = json.dumps(scan(copy, pattern)).encode(),
+                            extra_path = self.__class__.__name__
+                        )
+                    except Exception as error:
+                        _logger.exception(f'Could not scan {copy.name} for torn lines: {error}')
+
+    @staticmethod
+    def _streams(stack: ExitStack, client: DockerClient, targets: List, rx_events: Path) -> List[IO[bytes]]:
+        """
+        Stream the events.log of each Target that has one, closed with ``stack``
+        """
+        streams = []
+        for target in targets:
+            if target.exec_run(f'test -f {rx_events.name}').exit_code == 0:
+                stream, _ = client.api.get_archive(target.name, rx_events)
+                streams.append(stack.enter_context(stream_member(stream, rx_events.name, name = target.name)))
+        return streams
+
+    @staticmethod
+    @pytest.mark.usefixtures('run')
+    def test_event_latency_within_budget(pytestconfig, latency: Optional[LatencyAnalyzer], topology: Topology):
+        """
+        Verify every Target received stamped events and, with ``--latency_budget``, that their p99.9 latency is
+        within it
 
-        files = [tarfile.open(log, mode = 'r') for log in logs]
-        for file in files:
-            request.addfinalizer(file.close)
+        :param pytestconfig:    The pytest Config
+        :param latency:         The latency analyzer, if any
+        :param topology:        The Splitters and their Targets
+        :return:
+        """
+        if latency is None:
+            pytest.skip('Run with --latency to measure the event latency')
 
-        partials = [file.extractfile(rx_events.name) for file in files]
-        _logger.info(f'Determine if aggregate events in {rx_events.name} match {tx_events.name}')
-        event_check(tx_events, *partials)
+        results = latency.results()
+        assert not results['unstamped'], f'{results["unstamped"]} events reached the Targets without a send time'
+        assert len(results['targets']) == len(topology.targets), \
+            f'Only {", ".join(results["targets"]) or "no Target"} received stamped events'
+        if (budget := pytestconfig.getoption('latency_budget')) is not None:
+            over = {
+                name: summary['p99.9'] / 1000 for name, summary in results['targets'].items()
+                if summary['p99.9'] / 1000 > budget
+            }
+            assert not over, f'p99.9 latency above {budget}ms: {json.dumps(over)}'
@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.fixture(name = 'build', scope = 'session', autouse = True)
+def fixture_build() -> None:
+    """
+    The unit tests exercise the tools only, no App Image is needed
+
+    :return:
+    """
+    yield
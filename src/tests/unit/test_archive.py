@@ -0,0 +1,84 @@
+import io
+import tarfile
+import pytest
+
+from typing import Iterator, List
+from src.tools.archive import ChunkStream, TeeStream, stream_member
+
+
+def _tar(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj = buffer, mode = 'w') as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def _chunks(data: bytes, sizes: List[int]) -> Iterator[bytes]:
+    """
+    Cut ``data`` in chunks cycling through ``sizes``, as get_archive hands them over
+    """
+    offset, idx = 0, 0
+    while offset < len(data):
+        size = sizes[idx % len(sizes)]
+        yield data[offset:offset + size]
+        offset, idx = offset + size, idx + 1
+
+
+@pytest.fixture(name = 'events')
+def fixture_events() -> bytes:
+    """
+    Yield an events.log larger than the read buffer, not a multiple of the tar block size
+
+    :return:
+    """
+    yield b''.join(b'This is event number %d\n' % idx for idx in range(100000))
+
+
+def test_chunk_stream_reads_across_odd_chunks():
+    stream = io.BufferedReader(ChunkStream(_chunks(bytes(range(256)) * 40, [1, 0, 7, 513, 4096])), buffer_size = 100)
+    assert stream.read(3) == bytes([0, 1, 2])
+    assert stream.read() == (bytes(range(256)) * 40)[3:]
+    assert stream.read() == b''
+
+
+def test_tee_stream_copies_what_is_read():
+    sink = io.BytesIO()
+    tee = io.BufferedReader(TeeStream(io.BytesIO(b'abcdefgh'), sink, name = 'tee'), buffer_size = 3)
+    assert tee.read(4) == b'abcd' and tee.name == 'tee'
+    assert tee.read() == b'efgh' and sink.getvalue() == b'abcdefgh'
+
+
+@pytest.mark.parametrize('sizes', [[1, 511, 10000], [37], [1 << 20]], ids = ['mixed', 'small', 'whole'])
+def test_stream_member_extracts_and_tees(events: bytes, sizes: List[int]):
+    archive = _tar({'other.log': b'not the events\n', 'events.log': events, 'after.log': b'x' * 600})
+    sink = io.BytesIO()
+    with stream_member(_chunks(archive, sizes), 'events.log', sink = sink, name = 'target_1') as reader:
+        assert reader.name == 'target_1'
+        assert b''.join(iter(lambda: reader.read(777), b'')) == events
+    assert sink.getvalue() == events
+
+
+def test_stream_member_missing(events: bytes):
+    with pytest.raises(AssertionError, match = 'events.log was not found'):
+        with stream_member(_chunks(_tar({'other.log': events}), [100]), 'events.log'):
+            pass
+
+
+def test_stream_member_closed_early(events: bytes):
+    consumed = []
+    archive = _tar({'events.log': events})
+
+    def _source() -> Iterator[bytes]:
+        for chunk in _chunks(archive, [512]):
+            consumed.append(len(chunk))
+            yield chunk
+
+    sink = io.BytesIO()
+    with stream_member(_source(), 'events.log', sink = sink) as reader:
+        assert reader.readline() == b'This is event number 0\n'
+    # Only what was read is teed, and the rest of the archive is left unread
+    assert events.startswith(sink.getvalue()) and len(sink.getvalue()) < len(events)
+    assert sum(consumed) < len(archive)
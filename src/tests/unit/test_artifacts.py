@@ -0,0 +1,30 @@
+import io
+
+from pathlib import Path
+from src.tools.artifacts import SKIPPED, CappedWriter, collect
+
+
+def test_capped_writer_keeps_head_and_tail():
+    data = bytes(range(256)) * 40
+    file = io.BytesIO()
+    writer = CappedWriter(file, cap = 1000)
+    for start in range(0, len(data), 333):
+        writer.write(data[start:start + 333])
+    writer.close()
+
+    assert file.getvalue() == data[:500] + SKIPPED % (len(data) - 1000) + data[-500:]
+    assert (writer.written, writer.skipped) == (1000, len(data) - 1000)
+
+
+def test_collect_streams_every_source(tmp_path: Path):
+    paths = collect(
+        sources = {
+            'chunks.log': lambda: iter([b'a' * 10, b'b' * 10]),
+            'bytes.log':  lambda: b'whole output'
+        },
+        directory = tmp_path,
+        cap = 0
+    )
+
+    assert paths['chunks.log'].read_bytes() == b'a' * 10 + b'b' * 10
+    assert paths['bytes.log'].read_bytes() == b'whole output'
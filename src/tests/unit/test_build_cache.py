@@ -0,0 +1,137 @@
+import pytest
+
+from pathlib import Path
+from itertools import count
+from typing import Dict, List, Optional
+from src.tools.build_cache import LABEL, BuildCache, build_key
+
+
+class FakeImage:
+    def __init__(self, images: 'FakeImages', image_id: str, labels: Dict[str, str]):
+        self.images   = images
+        self.id       = image_id
+        self.short_id = image_id[:10]
+        self.labels   = labels
+        self.tags     = []
+
+    def tag(self, repository: str, tag: Optional[str] = None) -> bool:
+        # A tag names one image, tagging another moves it
+        name = f'{repository}:{tag}' if tag else repository
+        for image in self.images.images:
+            if name in image.tags:
+                image.tags.remove(name)
+        self.tags.append(name)
+        return True
+
+
+class FakeImages:
+    def __init__(self):
+        self.images: List[FakeImage] = []
+        self.built = 0
+        self._ids = count()
+
+    def build(self, tag: str, labels: Dict[str, str], **kwargs) -> FakeImage:
+        self.built += 1
+        image = FakeImage(self, f'sha256:{next(self._ids):064}', labels)
+        self.images.append(image)
+        image.tag(tag)
+        return image
+
+    def list(self, filters: Dict[str, str]) -> List[FakeImage]:
+        name, _, value = filters['label'].partition('=')
+        return [image for image in self.images if name in image.labels and value in ('', image.labels[name])]
+
+    def remove(self, image: str, force: bool = False) -> None:
+        # Removing a tag untags the image, which is only deleted with its last tag
+        for item in self.images:
+            if image in item.tags:
+                item.tags.remove(image)
+                image = item.id if not item.tags else None
+        self.images = [item for item in self.images if item.id != image]
+
+
+class FakeContainer:
+    def __init__(self, image: FakeImage):
+        self.attrs = {'Image': image.id}
+
+
+class FakeContainers:
+    def __init__(self):
+        self.containers: List[FakeContainer] = []
+
+    def list(self, all: bool = False) -> List[FakeContainer]:
+        return self.containers
+
+
+class FakeDockerClient:
+    def __init__(self):
+        self.images     = FakeImages()
+        self.containers = FakeContainers()
+
+
+@pytest.fixture(name = 'app')
+def fixture_app(tmp_path: Path) -> Path:
+    """
+    Yield a build context holding an app and a Dockerfile
+
+    :return:
+    """
+    path = Path(tmp_path, 'src', 'app')
+    path.mkdir(parents = True)
+    Path(path, 'app.js').write_text('console.log("v1")')
+    Path(tmp_path, 'app.Dockerfile').write_text('FROM node:current-alpine3.15')
+    yield path
+
+
+def test_build_cache_reuses_image_until_the_app_changes(app: Path, tmp_path: Path):
+    client = FakeDockerClient()
+    cache = BuildCache(client, Path(tmp_path, 'lru.json'))
+    dockerfile = Path(tmp_path, 'app.Dockerfile')
+
+    def build(labels: Dict[str, str]) -> FakeImage:
+        return client.images.build(tag = 'cribl/app-image', labels = labels)
+
+    key = build_key([app], dockerfile, {'node_version': '17'})
+    first, hit = cache.build(key, 'cribl/app-image', build)
+    assert not hit and first.labels == {LABEL: key}
+
+    image, hit = cache.build(key, 'cribl/app-image', build)
+    assert hit and image is first and client.images.built == 1
+
+    assert build_key([app], dockerfile, {'node_version': '18'}) != key
+    Path(app, 'app.js').write_text('console.log("v2")')
+    changed = build_key([app], dockerfile, {'node_version': '17'})
+    assert changed != key
+
+    _, hit = cache.build(changed, 'cribl/app-image', build)
+    assert not hit and client.images.built == 2
+
+
+def test_build_cache_prunes_least_recently_used(tmp_path: Path):
+    client = FakeDockerClient()
+    cache = BuildCache(client, Path(tmp_path, 'lru.json'), keep = 2)
+
+    def build(labels: Dict[str, str]) -> FakeImage:
+        return client.images.build(tag = 'cribl/app-image', labels = labels)
+
+    for key in ['a', 'b', 'a', 'c']:
+        cache.build(key, 'cribl/app-image', build)
+
+    assert sorted(image.labels[LABEL] for image in client.images.images) == ['a', 'c']
+
+
+def test_build_cache_keeps_images_used_by_containers(tmp_path: Path):
+    client = FakeDockerClient()
+    cache = BuildCache(client, Path(tmp_path, 'lru.json'), keep = 1)
+
+    def build(labels: Dict[str, str]) -> FakeImage:
+        return client.images.build(tag = 'cribl/app-image', labels = labels)
+
+    first, _ = cache.build('a', 'cribl/app-image', build)
+    client.containers.containers.append(FakeContainer(first))
+    cache.build('b', 'cribl/app-image', build)
+    assert sorted(image.labels[LABEL] for image in client.images.images) == ['a', 'b']
+
+    client.containers.containers.clear()
+    cache.build('c', 'cribl/app-image', build)
+    assert [image.labels[LABEL] for image in client.images.images] == ['c']
@@ -0,0 +1,35 @@
+import gzip
+import tarfile
+
+from src.tools.compress import ParallelGzip, bundle
+
+
+def test_parallel_gzip_blocks_decompress_as_one_stream(tmp_path):
+    data = b''.join(b'This is event number %d\n' % idx for idx in range(50000))
+    path = tmp_path / 'out.gz'
+    with path.open(mode = 'wb') as file:
+        stream = ParallelGzip(file, workers = 3, block_size = 64 * 1024)
+        stream.write(data[:100000])
+        stream.level = 0
+        stream.write(data[100000:])
+        stream.close()
+
+    assert gzip.decompress(path.read_bytes()) == data
+
+
+def test_bundle_selects_and_dedupes(tmp_path):
+    artifacts = tmp_path / 'v1'
+    (artifacts / 'sub').mkdir(parents = True)
+    (artifacts / 'events.log').write_bytes(b'event\n' * 10000)
+    (artifacts / 'sub' / 'copy.log').write_bytes(b'event\n' * 10000)
+    (artifacts / 'sub' / 'old.tar.gz').write_bytes(gzip.compress(b'old'))
+    (artifacts / 'debug.txt').write_bytes(b'debug')
+
+    stats = bundle(artifacts, tmp_path / 'v1.tar.gz', exclude = ['*.txt'], compressed = 'store', workers = 2)
+
+    with tarfile.open(tmp_path / 'v1.tar.gz') as tar:
+        members = {member.name: member for member in tar.getmembers()}
+        assert sorted(members) == ['v1', 'v1/events.log', 'v1/sub', 'v1/sub/copy.log', 'v1/sub/old.tar.gz']
+        assert members['v1/sub/copy.log'].islnk() and members['v1/sub/copy.log'].linkname == 'v1/events.log'
+        assert tar.extractfile('v1/sub/old.tar.gz').read() == gzip.compress(b'old')
+    assert (stats['files'], stats['linked'], stats['skipped']) == (2, 1, 1)
@@ -0,0 +1,50 @@
+import re
+import json
+import pytest
+import numpy as np
+
+from pathlib import Path
+from src.tools import corpus
+from src.tools.enums import LineLength, Stamp
+from src.tools.corpus import cached_corpus, generate
+
+
+def test_filler_never_holds_the_terms_to_avoid(tmp_path: Path):
+    for stamp in (Stamp.SEQUENCE, Stamp.TIMESTAMP, Stamp.NONE):
+        plain = generate(Path(tmp_path, 'plain.log'), 20000, LineLength.UNIFORM, 256, stamp = stamp, seed = 3)
+        scrubbed = generate(Path(tmp_path, 'scrubbed.log'), 20000, LineLength.UNIFORM, 256, stamp = stamp, seed = 3,
+                            avoid = [b'error', 'ab'])
+        before, after = (np.frombuffer(path.read_bytes(), dtype = np.uint8) for path in (plain, scrubbed))
+        assert re.search(b'error|ab', before.tobytes()) and not re.search(b'error|ab', after.tobytes())
+        # Only filler letters changed, to a letter no term holds, so the events keep their heads and lengths
+        changed = np.flatnonzero(before != after)
+        assert len(before) == len(after) and len(changed) and np.all(after[changed] == ord('c'))
+        assert np.all((before[changed] >= ord('a')) & (before[changed] <= ord('z')))
+
+
+def test_cached_corpus_is_generated_once_per_parameters(tmp_path: Path):
+    cache = Path(tmp_path, 'cache')
+    first = cached_corpus(cache, 1000, LineLength.NORMAL, 64, seed = 1)
+    data, mtime = first.read_bytes(), first.stat().st_mtime_ns
+
+    again = cached_corpus(cache, 1000, LineLength.NORMAL, 64, seed = 1)
+    assert again == first and again.read_bytes() == data and again.stat().st_mtime_ns == mtime
+    assert json.loads(first.with_suffix('.json').read_text())['bytes'] == len(data)
+
+    reseeded = cached_corpus(cache, 1000, LineLength.NORMAL, 64, seed = 2)
+    larger = cached_corpus(cache, 2000, LineLength.NORMAL, 64, seed = 1)
+    assert len({first, reseeded, larger}) == 3 and reseeded.read_bytes() != data
+    assert larger.read_bytes().startswith(b'This is event number 0 ') and larger.stat().st_size > len(data)
+    # Generated under a temporary name and renamed into place, nothing else is left behind
+    assert sorted(path.suffix for path in cache.iterdir()) == ['.json'] * 3 + ['.log'] * 3
+
+
+def test_cached_corpus_leaves_nothing_behind_on_failure(tmp_path: Path, monkeypatch):
+    def _fail(path: Path, **params):
+        Path(path).write_bytes(b'This is event')
+        raise OSError('disk full')
+
+    monkeypatch.setattr(corpus, 'generate', _fail)
+    with pytest.raises(OSError, match = 'disk full'):
+        cached_corpus(tmp_path, 1000)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,40 @@
+import io
+import numpy as np
+
+from src.tools.distribution import Distribution, chi_square_p
+from src.tools.utils import event_check
+
+
+def test_distribution_runs_and_round_robin_order():
+    spread = Distribution(['a', 'b'], 10)
+    spread.update(0, np.array([0, 1, 2]), 30)
+    spread.update(1, np.array([3, 4, 5, 6]), 40)
+    spread.update(0, np.array([7]), 10)
+    spread.update(0, np.array([9]), 10)
+    spread.update(1, np.array([8]), 10)
+
+    report = spread.results()
+
+    assert report['targets']['a']['events'] == 5 and report['targets']['a']['byte_share'] == 0.5
+    assert report['targets']['b']['max_run'] == 4
+    assert report['runs'] == {'1': {'a': 2, 'b': 1}, '2-3': {'a': 1, 'b': 0}, '4-7': {'a': 0, 'b': 1}}
+    assert report['fairness']['switches'] == 4 and report['fairness']['in_order'] == 1.0
+    assert report['fairness']['chi2'] == 0.0 and report['fairness']['score'] == 1.0
+
+
+def test_chi_square_p_matches_known_quantiles():
+    assert abs(chi_square_p(3.841, 1) - 0.05) < 0.005
+    assert abs(chi_square_p(18.307, 10) - 0.05) < 0.002
+
+
+def test_event_check_reports_the_distribution_in_the_same_pass(tmp_path):
+    master = tmp_path / 'master.log'
+    master.write_bytes(b''.join(b'This is event number %d\n' % idx for idx in range(6)))
+    first = io.BytesIO(b'This is event number 0\nThis is event number 1\nThis is event number 4\n')
+    second = io.BytesIO(b'This is event number 2\nThis is event number 3\nThis is event number 5\n')
+
+    for pattern in (rb'This is event number (\d+)', None):
+        first.seek(0), second.seek(0)
+        report = event_check(master, first, second, pattern = pattern, distribution = True)
+        assert [target['runs'] for target in report['targets'].values()] == [2, 2]
+        assert report['fairness']['in_order'] == 1.0
@@ -0,0 +1,45 @@
+import io
+import re
+import pytest
+
+from src.tools.filter import TRIE_TERMS, EventFilter, _trie
+from src.tools.utils import event_check
+
+
+def test_trie_matches_the_same_lines_as_the_alternation():
+    terms = [b'error', b'err', b'errno', b'warn', b'warning', b'fatal', b'a.b', b'x'] + [
+        b'term%d' % idx for idx in range(TRIE_TERMS)
+    ]
+    block = b'an error\nerrno 2\nwarn\nfatal!\naxb\na.b\nnothing\nterm12\nERROR\n'
+
+    trie = EventFilter(terms)
+    alternation = re.compile(b'|'.join(map(re.escape, terms)))
+
+    assert trie._search.pattern == _trie(terms)
+    assert trie.match(block).tolist() == [bool(alternation.search(line)) for line in block.splitlines()]
+    assert EventFilter(terms, mode = 'keep').dropped(block).tolist() == (~trie.match(block)).tolist()
+
+
+def test_filter_load(tmp_path):
+    path = tmp_path / 'filter.json'
+    path.write_text('{"filter": "error"}')
+
+    assert EventFilter.load(path).terms == [b'error']
+    assert EventFilter.load(path, mode = 'off') is None
+    assert EventFilter.load(tmp_path / 'missing.json') is None
+
+
+@pytest.mark.parametrize('pattern', [rb'event number (\d+)(?: error)?', None])
+def test_event_check_flags_leaked_events(tmp_path, pattern):
+    master = tmp_path / 'master.log'
+    master.write_bytes(b''.join(
+        b'event number %d%s\n' % (idx, b' error' if idx % 3 == 0 else b'') for idx in range(9)
+    ))
+    delivered = [b'event number %d\n' % idx for idx in range(9) if idx % 3]
+    event_filter = EventFilter(['error'])
+
+    event_check(master, io.BytesIO(b''.join(delivered)), pattern = pattern, event_filter = event_filter)
+
+    with pytest.raises(AssertionError, match = 'leaked'):
+        event_check(master, io.BytesIO(b''.join(delivered) + b'event number 3 error\n'), pattern = pattern,
+                    event_filter = event_filter)
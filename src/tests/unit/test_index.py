@@ -0,0 +1,70 @@
+import io
+import pytest
+
+from pathlib import Path
+from src.tools import index
+from src.tools.index import MasterIndex, interleave
+from src.tools.parallel import sharded_check
+
+
+@pytest.fixture(name = 'master')
+def fixture_master(tmp_path: Path) -> Path:
+    """
+    Yield a small master file with a repeated event and no trailing newline
+
+    :return:
+    """
+    path = Path(tmp_path, 'master.log')
+    path.write_bytes(b''.join(b'This is event number %d\n' % idx for idx in range(1000)) + b'repeat\nrepeat\nlast')
+    yield path
+
+
+def reference(master: Path, *files: bytes) -> dict:
+    """
+    The original dict based event count
+    """
+    with master.open(mode = 'rb') as source:
+        events = {event: 0 for event in source.readlines()}
+    results = {'valid': 0, 'duplicate': 0, 'missing': 0, 'invalid': 0}
+    for file in files:
+        for event in io.BytesIO(file).readlines():
+            if event in events:
+                events[event] += 1
+            else:
+                results['invalid'] += 1
+    for value in events.values():
+        results['missing' if value == 0 else 'valid' if value == 1 else 'duplicate'] += 1
+    return results
+
+
+@pytest.mark.parametrize('collide', [False, True], ids = ['blake2b', 'collisions'])
+def test_master_index_matches_reference(monkeypatch, master: Path, collide: bool):
+    if collide:
+        # Only three digests for all terminated lines, every lookup of those needs the exact comparison
+        monkeypatch.setattr(index, 'digest', lambda lines, terminated = True: index.np.array(
+            [len(line) % 3 if terminated else len(line) + 3 for line in lines], dtype = index.np.uint64
+        ))
+
+    events = master.read_bytes().split(b'\n')
+    files = [
+        b'\n'.join(events[:600:2] + [b'This is event This is event number 3', b'']),
+        b'\n'.join(events[1:600:2] + events[700:] + [b'This is event number 7'])
+    ]
+
+    result = MasterIndex.build(master, chunk_size = 1000)
+    for _, lines, terminated in interleave([io.BytesIO(file) for file in files], chunk_size = 333):
+        result.update(lines, terminated)
+
+    assert result.results() == reference(master, *files)
+
+
+def test_sharded_check_matches_reference(master: Path):
+    events = master.read_bytes().split(b'\n')
+    files = [
+        b'\n'.join(events[:600:2] + events[:10] + [b'This is event This is event number 3', b'']),
+        b'\n'.join(events[1:600:2] + events[700:])
+    ]
+
+    result = sharded_check(master, *[io.BytesIO(file) for file in files], workers = 3)
+
+    assert result == reference(master, *files)
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+
+from src.tools.index import MasterIndex
+from src.tools.index_cache import IndexCache
+from src.tools.sequence import PATTERN
+
+
+def _master(path, events):
+    path.write_bytes(b''.join(b'This is event number %d\n' % idx for idx in range(events)))
+    return path
+
+
+def test_index_cache_maps_the_index_back_in(tmp_path, monkeypatch):
+    master = _master(tmp_path / 'master.log', 1000)
+    cache = IndexCache(tmp_path / 'cache')
+    built = cache.master_index(master, positions = True)
+
+    monkeypatch.setattr(MasterIndex, 'build', None)
+    loaded = cache.master_index(master, positions = True)
+
+    assert isinstance(loaded.positions, np.memmap)
+    assert np.array_equal(loaded.positions, built.positions)
+    assert loaded.update([b'This is event number 7', b'not an event']).tolist() == \
+        built.lookup([b'This is event number 7', b'not an event']).tolist()
+    assert loaded.results() == {'valid': 1, 'duplicate': 0, 'missing': 999, 'invalid': 1}
+
+
+def test_index_cache_invalidates_on_content_change(tmp_path):
+    master = _master(tmp_path / 'master.log', 1000)
+    cache = IndexCache(tmp_path / 'cache')
+    assert cache.sequence_check(master, PATTERN).size == 1000
+
+    _master(master, 2000)
+    assert cache.sequence_check(master, PATTERN).size == 2000
+
+    # Touching the master without changing it costs a hash, not a rebuild
+    before = len(list(cache.directory.glob('*/meta.json')))
+    os.utime(master, ns = (1, 1))
+    assert cache.sequence_check(master, PATTERN).size == 2000
+    assert len(list(cache.directory.glob('*/meta.json'))) == before
+
+
+def test_index_cache_evicts_the_least_recently_used(tmp_path):
+    cache = IndexCache(tmp_path / 'cache', limit = 30 * 1024)
+    cache.master_index(_master(tmp_path / 'first.log', 1000))
+    cache.master_index(_master(tmp_path / 'second.log', 2000))
+    third = cache.master_index(_master(tmp_path / 'third.log', 3000))
+
+    assert [path.parent.name for path in cache.directory.glob('*/meta.json')] == [
+        cache.key(tmp_path / 'third.log', kind = 'master_index', positions = False, filter = None)
+    ]
+    assert len(third) == 3000
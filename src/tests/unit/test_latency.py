@@ -0,0 +1,64 @@
+import json
+import numpy as np
+
+from pathlib import Path
+from itertools import count
+from src.tools.enums import Stamp
+from src.tools.corpus import generate
+from src.tools.sequence import SequenceCheck
+from src.tools.latency import PATTERN, LatencyAnalyzer, LatencyHistogram, parse_stamps, stamped
+
+
+def _chunks(data: bytes, size: int):
+    return [data[offset:offset + size] for offset in range(0, len(data), size)]
+
+
+def test_stamped_corpus_keeps_the_sequence_fast_path(tmp_path: Path):
+    master = generate(Path(tmp_path, 'master.log'), 1000, stamp = Stamp.LATENCY)
+    data = master.read_bytes()
+    assert data.splitlines()[7] == b'This is event number 7 @' + b'0' * 19
+
+    clock = count(10 ** 18, 1000)
+    sent = b''.join(stamped(_chunks(data, 333), clock = lambda: next(clock)))
+    assert len(sent) == len(data) and b'@' + b'0' * 19 not in sent
+    # Every chunk is stamped on its own, in order
+    assert np.all(np.diff(parse_stamps(sent)) >= 0) and parse_stamps(sent)[0] == 10 ** 18
+
+    check = SequenceCheck.build(master, PATTERN)
+    check.update(sent)
+    assert check.results()['missing'] == [] and check.invalid == 0
+
+
+def test_histogram_error_is_bounded():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(np.log(2000), 1.5, 100000).astype(np.int64)
+    histogram = LatencyHistogram()
+    histogram.record(values[:50000])
+    histogram.merge(LatencyHistogram()).record(values[50000:])
+
+    assert histogram.count == len(values) and histogram.max == values.max()
+    for percentile in (50, 99, 99.9):
+        exact = np.percentile(values, percentile, method = 'inverted_cdf')
+        assert exact <= histogram.percentile(percentile) <= exact * (1 + 1 / 64)
+    # Small values are exact
+    exact = LatencyHistogram()
+    exact.record(np.array([3, 5, 7]))
+    assert [exact.percentile(value) for value in (1, 50, 100)] == [3, 5, 7]
+
+
+def test_analyzer_reports_per_target_and_window(tmp_path: Path):
+    lines = [b'This is event number %d @%019d\n' % (number, 10 ** 18 + number * 10 ** 6) for number in range(100)]
+    analyzer = LatencyAnalyzer(window = 1.0)
+    # target_1 receives each event 2ms after it was sent, split mid stamp; target_2 a second later, 5ms after
+    for number, line in enumerate(lines[:50]):
+        analyzer.feed('target_1', line[:30], 10 ** 18)
+        analyzer.feed('target_1', line[30:], 10 ** 18 + number * 10 ** 6 + 2 * 10 ** 6)
+    analyzer.feed('target_2', b''.join(lines[50:]), 10 ** 18 + 99 * 10 ** 6 + 5 * 10 ** 6 + 10 ** 9)
+    analyzer.feed('target_2', b'This is event number 100 @' + b'0' * 19 + b'\n')
+
+    results = analyzer.save(tmp_path)
+    assert json.loads(Path(tmp_path, 'latency.json').read_text()) == results
+    assert results['targets']['target_1'] == {'count': 50, 'p50': 2000, 'p99': 2000, 'p99.9': 2000, 'max': 2000}
+    assert results['targets']['target_2']['p50'] >= 1000000 and results['targets']['target_2']['max'] == 1054000
+    assert [(window['start'], window['count']) for window in results['windows']] == [(0.0, 50), (1.0, 50)]
+    assert results['all']['count'] == 100 and results['unstamped'] == 1 and results['negative'] == 0
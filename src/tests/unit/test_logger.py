@@ -0,0 +1,55 @@
+import json
+import queue
+import logging
+
+from src.tools.logger import BatchFileHandler, BatchListener, JsonFormatter, RateLimitFilter, init_config, shutdown
+
+
+def _record(name: str, msg: str, created: float, level: int = logging.INFO) -> logging.LogRecord:
+    record = logging.LogRecord(name, level, __file__, 1, msg, None, None)
+    record.created = created
+    return record
+
+
+def test_rate_limit_filter_counts_suppressed_records():
+    limit = RateLimitFilter(rate = 2)
+    passed = [
+        limit.filter(_record('hot', f'event {idx}', created = 100 + idx * 0.1)) for idx in range(5)
+    ]
+    later = _record('hot', 'event 5', created = 101.5)
+
+    assert passed == [True, True, False, False, False]
+    assert limit.filter(_record('hot', 'warning', created = 100.5, level = logging.WARNING))
+    assert limit.filter(_record('cold', 'other logger', created = 100.5))
+    assert limit.filter(later) and later.getMessage() == 'event 5 [3 records suppressed]'
+
+
+def test_batch_listener_writes_json_lines_when_idle(tmp_path):
+    handler = BatchFileHandler(tmp_path / 'test.log', batch = 100)
+    handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    listener = BatchListener(records, handler)
+    listener.start()
+    for idx in range(3):
+        records.put(_record('test', f'event {idx}', created = 100))
+    listener.stop()
+    handler.close()
+
+    lines = [json.loads(line) for line in (tmp_path / 'test.log').read_text().splitlines()]
+    assert [line['message'] for line in lines] == ['event 0', 'event 1', 'event 2']
+
+
+def test_queue_mode_restores_the_caller_lookup(tmp_path):
+    root = logging.getLogger()
+    handlers, level, srcfile = root.handlers[:], root.level, logging._srcfile
+    try:
+        init_config(tmp_path / 'queue.log', mode = 'queue')
+        assert logging._srcfile is None
+        logging.getLogger('queued').info('event')
+        shutdown()
+        assert logging._srcfile == srcfile
+        assert 'event' in (tmp_path / 'queue.log').read_text()
+    finally:
+        shutdown()
+        root.handlers[:] = handlers
+        root.setLevel(level)
@@ -0,0 +1,31 @@
+from src.tools.logs import LogMatcher
+
+
+def test_log_matcher_matches_across_chunks_and_stops_early():
+    read = []
+
+    def chunks():
+        for chunk in [b'App list', b'ening on port 9997\nclient conn', b'ected\n', b'never read\n']:
+            read.append(chunk)
+            yield chunk
+
+    found = LogMatcher({'listening': rb'listening on port \d+', 'connected': 'client connected'}).match(chunks())
+
+    assert found == {'listening': b'App listening on port 9997', 'connected': b'client connected'}
+    assert len(read) == 3
+
+
+def test_log_matcher_matches_several_patterns_on_one_line():
+    found = LogMatcher({'event': rb'event', 'number': rb'number (\d+)', 'missing': rb'^number'}).match(
+        [b'This is event number 1']
+    )
+
+    assert found == {'event': b'This is event number 1', 'number': b'This is event number 1', 'missing': None}
+
+
+def test_log_matcher_anchors_patterns_to_each_line():
+    found = LogMatcher({'connected': rb'^client connected$', 'error': rb'^Error: (\w+)'}).match(
+        [b'App listening on port 9997\nclient conn', b'ected\nSome Error: none\nError: EPIPE\n']
+    )
+
+    assert found == {'connected': b'client connected', 'error': b'Error: EPIPE'}
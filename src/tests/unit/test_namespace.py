@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+from src.tools.enums import ServiceType
+from src.tools.namespace import LABEL, Namespace
+
+
+class FakeContainers:
+    def __init__(self, containers: list):
+        self.containers = containers
+
+    def list(self, filters: dict) -> list:
+        name, _, value = filters['label'].partition('=')
+        return [container for container in self.containers if container.labels.get(name) == value]
+
+
+def _container(name: str, namespace: str, mode: ServiceType) -> SimpleNamespace:
+    return SimpleNamespace(name = name, labels = {LABEL: namespace, 'operation-mode': mode.value})
+
+
+def test_default_namespace_keeps_the_plain_names():
+    namespace = Namespace()
+    environ = namespace.environ()
+
+    assert not namespace
+    assert namespace(ServiceType.SPLITTER) == 'splitter'
+    assert environ['NETWORK'] == 'timbernet' and environ['PREFIX'] == ''
+    assert environ['COMPOSE_PROJECT_NAME'] == 'timberbrook'
+
+
+def test_namespace_prefixes_the_stack():
+    namespace = Namespace('gw1')
+    environ = namespace.environ()
+
+    assert namespace('target_1') == 'gw1_target_1'
+    assert environ['NETWORK'] == 'timbernet_gw1' and environ['PREFIX'] == 'gw1_'
+    assert environ['COMPOSE_PROJECT_NAME'] == 'timberbrook_gw1'
+
+
+def test_containers_are_looked_up_in_the_namespace():
+    client = SimpleNamespace(containers = FakeContainers([
+        _container('target_1', '', ServiceType.TARGET),
+        _container('gw0_target_1', 'gw0', ServiceType.TARGET),
+        _container('gw0_splitter', 'gw0', ServiceType.SPLITTER),
+        _container('gw1_target_1', 'gw1', ServiceType.TARGET)
+    ]))
+
+    names = [container.name for container in Namespace('gw0').containers(client, ServiceType.TARGET)]
+    assert names == ['gw0_target_1']
+    assert [container.name for container in Namespace().containers(client, ServiceType.TARGET)] == ['target_1']
@@ -0,0 +1,68 @@
+import pytest
+
+from pathlib import Path
+from src.tools.filter import EventFilter
+from src.tools.online import OnlineCheck
+from src.tools.sequence import PATTERN
+
+
+@pytest.fixture(name = 'master')
+def fixture_master(tmp_path: Path) -> Path:
+    """
+    Yield a master file of sequence numbered events
+
+    :return:
+    """
+    path = Path(tmp_path, 'master.log')
+    path.write_bytes(b''.join(b'This is event number %d\n' % idx for idx in range(1000)))
+    yield path
+
+
+@pytest.mark.parametrize('pattern', [PATTERN, None], ids = ['sequence', 'generic'])
+def test_online_check_reassembles_lines_across_chunks(master: Path, pattern):
+    events = master.read_bytes().splitlines(keepends = True)
+    streams = {'target_1': b''.join(events[::2]), 'target_2': b''.join(events[1::2])}
+    check = OnlineCheck(master, list(streams), pattern)
+
+    # Chunks end mid-line and interleave between the targets
+    for start in range(0, max(map(len, streams.values())), 7):
+        for name, stream in streams.items():
+            if chunk := stream[start:start + 7]:
+                check.feed(name, chunk)
+
+    assert check.complete
+    result = check.close()
+    assert result['valid'] == 1000
+    assert not (result['duplicate'] or result['missing'] or result['invalid'])
+
+
+@pytest.mark.parametrize('pattern', [PATTERN, None], ids = ['sequence', 'generic'])
+@pytest.mark.parametrize(
+    ('line', 'error'),
+    [
+        (b'This is event number 5\n', 'Duplicate event'),
+        (b'This is event This is event number 7\n', 'nvalid event')
+    ],
+    ids = ['duplicate', 'invalid']
+)
+def test_online_check_fails_on_first_bad_event(master: Path, pattern, line: bytes, error: str):
+    events = master.read_bytes().splitlines(keepends = True)
+    check = OnlineCheck(master, ['target_1'], pattern)
+    check.feed('target_1', b''.join(events[:10]))
+
+    with pytest.raises(AssertionError, match = error):
+        check.feed('target_1', line)
+
+
+@pytest.mark.parametrize('pattern', [PATTERN, None], ids = ['sequence', 'generic'])
+def test_online_check_fails_on_leaked_event(master: Path, pattern):
+    events = master.read_bytes().splitlines(keepends = True)
+    event_filter = EventFilter(['number 7'])
+    check = OnlineCheck(master, ['target_1'], pattern, event_filter = event_filter)
+    kept = [event for event in events if b'number 7' not in event]
+    check.feed('target_1', b''.join(kept))
+
+    assert check.close()['valid'] == len(kept) == 1000 - 111
+    assert not check.close()['leaked']
+    with pytest.raises(AssertionError, match = 'Leaked event'):
+        check.feed('target_1', events[75])
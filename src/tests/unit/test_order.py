@@ -0,0 +1,65 @@
+import io
+import pytest
+
+from pathlib import Path
+from src.tools.utils import file_cmp
+from src.tools.order import OrderCheck
+from src.tools.index import MasterIndex, interleave
+
+
+@pytest.fixture(name = 'chunks')
+def fixture_chunks(tmp_path: Path) -> list:
+    """
+    Write a master file and yield its events in 100 line chunks, round-robin between two targets
+
+    :return:
+    """
+    events = [b'This is event number %d\n' % idx for idx in range(10000)]
+    Path(tmp_path, 'master.log').write_bytes(b''.join(events))
+    yield [
+        [b''.join(events[idx:idx + 100]) for idx in range(start, len(events), 200)] for start in (0, 100)
+    ]
+
+
+def test_file_cmp_passes_in_order(tmp_path: Path, chunks: list):
+    report = file_cmp(Path(tmp_path, 'master.log'), *[io.BytesIO(b''.join(target)) for target in chunks])
+
+    assert report['results'] == {'valid': 10000, 'duplicate': 0, 'missing': 0, 'invalid': 0}
+    assert report['displaced'] == []
+
+
+def test_order_check_reports_displaced_block(tmp_path: Path, chunks: list):
+    # A chunk lands late, after a torn line like the GitHub runner events.log
+    target = chunks[0]
+    block = target.pop(10)
+    target[19] = target[19][:-15]
+    target.insert(20, block)
+
+    index = MasterIndex.build(Path(tmp_path, 'master.log'), positions = True)
+    check = OrderCheck(index, ['target_1', 'target_2'])
+    for idx, lines, terminated in interleave([io.BytesIO(b''.join(target)) for target in chunks], chunk_size = 999):
+        check.update(idx, lines, terminated, index.update(lines, terminated))
+    report = check.report()
+
+    # The torn line swallowed the last event before it and the first event of the block
+    torn = sum(map(len, target[:20])) - len(b'This is eve')
+    assert report['results'] == {'valid': 9998, 'duplicate': 0, 'missing': 2, 'invalid': 1}
+    assert report['missing'] == [(2001, 2001), (4100, 4100)]
+    assert report['invalid']['target_1']['lines'] == [(torn, 'This is eveThis is event number 2000')]
+    assert report['displaced'] == [{
+        'target':          'target_1',
+        'offset':          sum(map(len, target[:20])) + 26,
+        'bytes':           len(block) - 26,
+        'events':          (2002, 2100),
+        'count':           99,
+        'head':            'This is event number 2001',
+        'expected_offset': sum(map(len, target[:10])),
+        'after_event':     1900
+    }]
+
+
+def test_file_cmp_raises_on_displaced_block(tmp_path: Path, chunks: list):
+    chunks[1].insert(3, chunks[1].pop(1))
+
+    with pytest.raises(AssertionError, match = '301-400'):
+        file_cmp(Path(tmp_path, 'master.log'), *[io.BytesIO(b''.join(target)) for target in chunks])
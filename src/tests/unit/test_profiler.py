@@ -0,0 +1,77 @@
+import json
+import pytest
+import tracemalloc
+
+from pathlib import Path
+from src.tools import profiler
+from src.tools.profiler import CPROFILE, MEMORY, TIME, PhaseProfiler, phase
+
+
+@pytest.fixture(name = 'installed')
+def fixture_installed(tmp_path: Path):
+    """
+    Yield a callable installing a :py:class:`PhaseProfiler` in place of the session one, restored afterwards
+    """
+    session = profiler._active
+    tracing = tracemalloc.is_tracing()
+    installed = []
+
+    def _func(level: str) -> PhaseProfiler:
+        instance = PhaseProfiler(level, Path(tmp_path, 'profile.json'))
+        instance.install()
+        installed.append(instance)
+        return instance
+
+    yield _func
+    for instance in installed:
+        instance.uninstall()
+    if tracing and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    profiler._active = session
+
+
+def test_phase_is_a_noop_without_a_profiler(installed):
+    profiler._active = None
+    with phase('verify'):
+        pass
+
+
+def test_nested_phases_are_recorded_inner_first(installed):
+    instance = installed(TIME)
+    with phase('run'):
+        with phase('index'):
+            pass
+        with phase('verify'):
+            sum(range(100000))
+
+    assert [record['phase'] for record in instance.records] == ['index', 'verify', 'run']
+    run = instance.records[-1]
+    assert run['wall'] >= sum(record['wall'] for record in instance.records[:2])
+    assert run['rss'] > 0 and 'traced_peak' not in run
+
+
+def test_memory_peak_is_charged_to_the_phase_and_its_parents(installed):
+    instance = installed(MEMORY)
+    with phase('run'):
+        with phase('index'):
+            block = bytearray(8 * 1024 * 1024)
+            del block
+        with phase('verify'):
+            pass
+
+    peaks = {record['phase']: record['traced_peak'] for record in instance.records}
+    assert peaks['index'] >= 8 * 1024 * 1024
+    assert peaks['run'] >= peaks['index']
+    assert peaks['verify'] < 1024 * 1024
+
+
+def test_summary_totals_and_dumps(installed, tmp_path: Path):
+    instance = installed(CPROFILE)
+    for _ in range(2):
+        with phase('verify'):
+            pass
+    instance.pytest_sessionfinish(session = None)
+
+    summary = json.loads(Path(tmp_path, 'profile.json').read_text())
+    assert summary['phases']['verify']['count'] == 2
+    assert all(Path(record['profile']).exists() for record in summary['records'])
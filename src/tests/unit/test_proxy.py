@@ -0,0 +1,90 @@
+import time
+import asyncio
+import pytest
+
+from pathlib import Path
+from src.tools.corpus import generate
+from src.tools.standin import LocalApp
+from src.tools.proxy import Impairment, ThrottlingProxy, impairments
+
+
+def _relay(impairment: Impairment, data: bytes) -> tuple:
+    """
+    Send ``data`` through a proxy to a sink, returning what the sink received, the seconds it took and the proxy
+    """
+    async def _run():
+        received = []
+
+        async def _sink(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            while chunk := await reader.read(65536):
+                received.append(chunk)
+            writer.close()
+
+        sink = await asyncio.start_server(_sink, '127.0.0.1', 0)
+        proxy = ThrottlingProxy(('127.0.0.1', sink.sockets[0].getsockname()[1]), impairment, 'proxy')
+        port = await proxy.start()
+        start = time.monotonic()
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(data)
+        await writer.drain()
+        writer.write_eof()
+        await reader.read()
+        elapsed = time.monotonic() - start
+        writer.close()
+        await proxy.stop()
+        sink.close()
+        return b''.join(received), elapsed, proxy
+
+    return asyncio.run(_run())
+
+
+def test_impairments_are_parsed_per_target():
+    assert Impairment.parse('bandwidth=1M,latency=5ms,jitter=500us,stall=0.5,stall_every=2s,segment=1k') == \
+        Impairment(bandwidth = 1 << 20, latency = 0.005, jitter = 0.0005, stall = 0.5, stall_every = 2.0,
+                   segment = 1024)
+    assert impairments(['latency=1ms', 'target_2:bandwidth=64K'], ['target_1', 'target_2']) == \
+        {'target_1': 'latency=1ms', 'target_2': 'bandwidth=64K'}
+    with pytest.raises(ValueError):
+        Impairment.parse('bandwith=1M')
+    with pytest.raises(ValueError):
+        impairments(['target_3:latency=1ms'], ['target_1', 'target_2'])
+
+
+def test_partial_writes_and_jitter_keep_the_stream_intact():
+    data = bytes(range(256)) * 2048
+    received, _, proxy = _relay(Impairment(jitter = 0.002, segment = 1000, seed = 1), data)
+
+    assert received == data
+    assert proxy.writes >= len(data) // 1000 and proxy.sent == proxy.received == len(data)
+    assert proxy.held == 0
+
+
+def test_bandwidth_and_stalls_slow_the_stream():
+    data = b'x' * 200 * 1024
+    received, elapsed, proxy = _relay(Impairment(bandwidth = 1 << 20, stall = 0.05, stall_every = 0.05), data)
+
+    assert received == data
+    # 0.19s at 1 MiB/s, plus the stalls
+    assert elapsed >= 0.19 + proxy.stalled and proxy.stalls >= 1
+
+
+def test_slow_target_pushes_back_on_the_splitter(tmp_path: Path):
+    master = generate(Path(tmp_path, 'master.log'), 200000, line_size = 64)
+    app = LocalApp(
+        config_dir  = Path(__file__).parents[2] / 'app',
+        workdir     = Path(tmp_path, 'stand_in'),
+        targets     = ['target_1', 'target_2'],
+        # Half the events, more than the kernel buffers of the Splitter socket hold, at 8 MiB/s
+        impairments = {'target_2': Impairment(bandwidth = 8 << 20, buffer = 16 * 1024)}
+    )
+    app.start()
+    try:
+        app.run_agent(master, timeout = 30)
+    finally:
+        app.stop()
+
+    proxy = app.proxies[0].proxy
+    assert app.splitter.pauses > 0 and app.splitter.paused > 0
+    assert proxy.pauses > 0 and proxy.held_peak <= 2 * 16 * 1024
+    assert sum(target.file.stat().st_size for target in app.targets) == master.stat().st_size
+    assert any(b'client disconnected' in line for line in app.proxies[0].logs())
@@ -0,0 +1,72 @@
+import mmap
+import pytest
+
+from pathlib import Path
+from src.tools.scanner import _Chunks, _Grammar, _block_end, scan
+from src.tools.sequence import PATTERN
+
+
+def _events(first: int, stop: int) -> bytes:
+    return b''.join(b'This is event number %d\n' % number for number in range(first, stop))
+
+
+def test_clean_file_has_no_corrupt_lines(tmp_path: Path):
+    path = Path(tmp_path, 'events.log')
+    path.write_bytes(_events(0, 1000))
+    report = scan(path)
+
+    assert report['bytes'] == path.stat().st_size
+    assert (report['corrupt'], report['torn'], report['lines']) == (0, 0, [])
+    assert 'chunks' not in report
+
+    path.write_bytes(b'')
+    assert scan(path)['corrupt'] == 0
+
+
+def test_torn_line_at_a_chunk_boundary(tmp_path: Path):
+    # The write of events 10-19 landed right after an interrupted one, whose head is left in front of event 10
+    path = Path(tmp_path, 'events.log')
+    head, chunk = _events(0, 10), _events(10, 20)
+    path.write_bytes(head + b'This is event ' + chunk + _events(50, 60))
+    report = scan(path)
+
+    assert (report['corrupt'], report['torn']) == (1, 1)
+    line = report['lines'][0]
+    assert line['offset'] == len(head) and line['tear'] == len(head) + len(b'This is event ')
+    assert line['fragment'] == 'This is event ' and line['terminated']
+    assert line['chunk_bytes'] == len(chunk)
+    assert report['chunks'] == {'count': 1, 'min': len(chunk), 'median': len(chunk), 'max': len(chunk)}
+
+
+def test_block_end_stops_at_the_first_break_in_the_sequence(tmp_path: Path):
+    path = Path(tmp_path, 'events.log')
+    data = _events(95, 120) + _events(7, 9)
+    path.write_bytes(data)
+    with path.open(mode = 'rb') as file, mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as view:
+        grammar = _Grammar(PATTERN)
+        assert _block_end(view, grammar, 0, len(data)) == len(_events(95, 120))
+        assert _block_end(view, grammar, len(_events(95, 120)), len(data)) == len(data)
+        assert _block_end(view, _Grammar(rb'This is event number \d+'), 0, len(data)) is None
+
+
+def test_unterminated_last_line(tmp_path: Path):
+    path = Path(tmp_path, 'events.log')
+    path.write_bytes(_events(0, 10) + b'This is event number 10')
+    assert scan(path)['corrupt'] == 0
+
+    path.write_bytes(_events(0, 10) + b'This is ev')
+    report = scan(path)
+    assert (report['corrupt'], report['torn']) == (1, 0)
+    assert report['lines'] == [{'offset': len(_events(0, 10)), 'length': 10, 'line': 'This is ev', 'terminated': False}]
+
+
+@pytest.mark.parametrize('values', [range(1, 8), range(1, 100001)], ids = ['exact', 'sampled'])
+def test_chunk_summary_is_bounded(values: range):
+    chunks = _Chunks(1000)
+    for value in values:
+        chunks.add(value)
+
+    summary = chunks.summary()
+    assert len(chunks.sample) <= 1000
+    assert (summary['count'], summary['min'], summary['max']) == (len(values), values[0], values[-1])
+    assert abs(summary['median'] - (values[0] + values[-1]) / 2) <= 0.1 * len(values)
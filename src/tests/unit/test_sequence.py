@@ -0,0 +1,52 @@
+import io
+import pytest
+
+from pathlib import Path
+from src.tools.sequence import MIN_SPAN, PATTERN, SequenceCheck, sequence_check
+from src.tools.utils import event_check
+
+
+@pytest.fixture(name = 'master')
+def fixture_master(tmp_path: Path) -> Path:
+    """
+    Yield a master file of sequence numbered events starting at 10
+
+    :return:
+    """
+    path = Path(tmp_path, 'master.log')
+    path.write_bytes(b''.join(b'This is event number %d\n' % idx for idx in range(10, 5010)))
+    yield path
+
+
+def test_sequence_check_reports_ranges(master: Path):
+    events = master.read_bytes().splitlines(keepends = True)
+    files = [
+        b''.join(events[:100] + events[228:2500] + [b'This is event This is event number 7\n', events[5]]),
+        b''.join(events[2500:4999] + events[5:7] + [b'This is event number 9000\n', b'This is event number 0011\n'])
+    ]
+
+    result = sequence_check(master, *[io.BytesIO(file) for file in files])
+
+    assert result == {
+        'valid':     4869,
+        'duplicate': [(15, 16)],
+        'missing':   [(110, 237), (5009, 5009)],
+        'invalid':   3
+    }
+
+
+def test_sequence_check_falls_back_on_unknown_shape(master: Path):
+    master.write_bytes(master.read_bytes() + b'error: not an event\n')
+
+    assert SequenceCheck.build(master) is None
+
+
+def test_sequence_check_falls_back_on_sparse_numbers(master: Path):
+    # Within MIN_SPAN the bitmaps stay small enough whatever the density
+    master.write_bytes(master.read_bytes() + b'This is event number %d\n' % MIN_SPAN)
+    assert SequenceCheck.build(master).size == MIN_SPAN - 10 + 1
+
+    master.write_bytes(master.read_bytes() + b'This is event number %d\n' % 10 ** 12)
+    assert SequenceCheck.build(master) is None
+    # Verified on the generic path instead
+    event_check(master, io.BytesIO(master.read_bytes()), pattern = PATTERN)
@@ -0,0 +1,101 @@
+import io
+import numpy as np
+
+from pathlib import Path
+from src.tools.corpus import generate
+from src.tools.filter import EventFilter
+from src.tools.index import split_lines
+from src.tools.sketch import HASH_SPAN, BloomFilter, CountMinSketch, HyperLogLog, line_hashes
+from src.tools.utils import approximate_check
+
+
+def _digests(size: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 2 ** 63, size, dtype = np.uint64)
+
+
+def _split(lines: list, parts: int) -> list:
+    return [io.BytesIO(b''.join(lines[part::parts])) for part in range(parts)]
+
+
+def test_bloom_filter_has_no_false_negatives():
+    members, others = _digests(100000), _digests(100000, seed = 1)
+    bloom = BloomFilter(len(members), 0.01)
+    bloom.add(members)
+
+    assert bloom.contains(members).all()
+    assert bloom.contains(others).mean() < 0.015
+    assert bloom.nbytes <= 1.5 * len(members) and bloom.false_positives(len(members)) <= 0.01
+
+    # Past its capacity the filter still holds every member, at a higher false positive rate
+    bloom.add(others)
+    assert bloom.contains(others).all() and bloom.false_positives(2 * len(members)) > 0.05
+
+
+def test_line_hashes_do_not_depend_on_the_block():
+    block = b''.join(b'event %d\n' % idx for idx in range(50000)) + b'x' * (HASH_SPAN + 10) + b'\n\nlast\n'
+    hashes = line_hashes(block)
+    lines = split_lines(block)
+
+    assert len(hashes) == len(lines) and len(set(hashes.tolist())) == len(lines)
+    assert [line_hashes(line + b'\n')[0] for line in lines[-4:]] == hashes[-4:].tolist()
+    assert line_hashes(b'last', terminated = False)[0] != hashes[-1]
+    assert line_hashes(b'').size == 0
+
+
+def test_count_min_sketch_tells_duplicates_from_missing_events():
+    digests = _digests(10000)
+    expected, received = CountMinSketch(), CountMinSketch()
+    expected.add(digests)
+    received.add(digests[::-1])
+    assert received.compare(expected) == {'excess': 0, 'deficit': 0, 'cells': 0}
+    assert received.estimate(digests[:10]).min() >= 1
+
+    received.add(digests[:3])
+    compared = CountMinSketch()
+    compared.add(digests[1:])
+    assert received.compare(expected) == {'excess': 3, 'deficit': 0, 'cells': 3 * expected.depth}
+    assert compared.compare(expected)['deficit'] == 1
+
+
+def test_hyperloglog_estimate_is_within_its_error():
+    digests = _digests(200000)
+    first, second = HyperLogLog(), HyperLogLog()
+    first.add(digests[:120000])
+    second.add(digests[80000:])
+
+    assert abs(first.merge(second).estimate() / len(digests) - 1) < 3 * first.error
+    small = HyperLogLog()
+    small.add(digests[:100])
+    assert abs(small.estimate() - 100) < 3
+
+
+def test_approximate_check_is_clean_only_for_a_clean_split(tmp_path: Path):
+    master = generate(Path(tmp_path, 'master.log'), 20000, line_size = 48)
+    lines = master.read_bytes().splitlines(keepends = True)
+
+    report = approximate_check(master, *_split(lines, 3))
+    assert report['clean'] and report['received'] == report['expected'] == len(lines)
+    assert report['bounds']['capacity'] >= len(lines) and report['bounds']['bloom_error'] <= 0.001
+    assert abs(report['distinct']['received'] / len(lines) - 1) < 0.05
+
+    duplicated = approximate_check(master, *_split(lines + lines[5:6], 3))
+    assert not duplicated['clean'] and duplicated['excess'] == 1 and duplicated['unknown'] == 0
+
+    # A missing event and a duplicate keep the count, the count-min sketch still tells
+    swapped = approximate_check(master, *_split(lines[:7] + lines[8:] + lines[5:6], 3))
+    assert not swapped['clean'] and (swapped['excess'], swapped['deficit']) == (1, 1)
+
+    invalid = approximate_check(master, *_split(lines[1:] + [b'This is not an event\n'], 3))
+    assert not invalid['clean'] and invalid['unknown'] == 1
+
+
+def test_approximate_check_leaves_out_the_filtered_events(tmp_path: Path):
+    lines = [b'event %d %s\n' % (idx, b'error' if idx % 4 == 0 else b'info') for idx in range(1000)]
+    master = Path(tmp_path, 'master.log')
+    master.write_bytes(b''.join(lines))
+    event_filter = EventFilter(['error'])
+    kept = [line for line in lines if b'error' not in line]
+
+    assert approximate_check(master, *_split(kept, 2), event_filter = event_filter)['clean']
+    leaked = approximate_check(master, *_split(kept + lines[:1], 2), event_filter = event_filter)
+    assert not leaked['clean'] and leaked['unknown'] == 1
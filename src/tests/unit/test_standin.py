@@ -0,0 +1,122 @@
+import io
+import time
+import socket
+import asyncio
+import tarfile
+import pytest
+
+from pathlib import Path
+from src.tools.corpus import generate
+from src.tools.standin import LOCALHOST, POLL_INTERVAL, READ_SIZE, LocalApp, LocalClient, Target
+
+
+@pytest.fixture(name = 'master')
+def fixture_master(tmp_path: Path) -> Path:
+    """
+    Yield a corpus of several agent reads
+
+    :return:
+    """
+    yield generate(Path(tmp_path, 'master.log'), 50000, line_size = 64)
+
+
+def _app(tmp_path: Path, targets: list) -> LocalApp:
+    return LocalApp(Path(__file__).parents[2] / 'app', Path(tmp_path, 'stand_in'), targets = targets)
+
+
+def test_splitter_forwards_whole_events_round_robin(tmp_path: Path, master: Path):
+    app = _app(tmp_path, ['target_1', 'target_2', 'target_3'])
+    app.start()
+    try:
+        app.run_agent(master, timeout = 30)
+    finally:
+        app.stop()
+
+    events = master.read_bytes().splitlines(keepends = True)
+    received = [target.file.read_bytes() for target in app.targets]
+    assert app.splitter.received == app.splitter.forwarded == sum(map(len, received)) == master.stat().st_size
+    # Each chunk switches to the next Target after its first newline, so every Target gets whole events in order
+    for data in received:
+        numbers = [int(line.split()[4]) for line in data.splitlines()]
+        assert numbers and data.endswith(b'\n') and numbers == sorted(numbers)
+    assert sorted(line for data in received for line in data.splitlines(keepends = True)) == sorted(events)
+    assert all(b'client connected' in line for line in [b''.join(target.logs()) for target in app.targets])
+
+
+def test_splitter_round_robin_carries_over_to_the_next_connection(tmp_path: Path):
+    master = Path(tmp_path, 'master.log')
+    master.write_bytes(b'This is event number 0\n')
+    app = _app(tmp_path, ['target_1', 'target_2'])
+    app.start()
+    try:
+        # Each run is one connection of one chunk, forwarded whole to the current Target, as sockIdx in app.ts
+        for _ in range(2):
+            app.run_agent(master, timeout = 30)
+    finally:
+        app.stop()
+
+    assert [target.file.read_bytes() for target in app.targets] == [master.read_bytes()] * 2
+    assert app.splitter.current == 0
+
+
+def test_splitter_pauses_for_a_slow_target(tmp_path: Path):
+    master = generate(Path(tmp_path, 'master.log'), 200000, line_size = 64)
+    app = _app(tmp_path, ['target_1', 'target_2'])
+    slow: Target = app.targets[1]
+
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # Reads nothing until the Splitter pauses for it, or for at most 5s
+        deadline = time.monotonic() + 5
+        while not app.splitter.pauses and time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+        with slow.file.open(mode = 'ab', buffering = 0) as file:
+            while data := await reader.read(READ_SIZE):
+                file.write(data)
+                slow.written += len(data)
+        writer.close()
+
+    async def _start() -> None:
+        # A small receive buffer, or the kernel would take in the whole corpus for the Target
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+        listener.bind((LOCALHOST, 0))
+        slow.dir.mkdir(parents = True, exist_ok = True)
+        slow._server = await asyncio.start_server(_handle, sock = listener)
+        app.register(slow.name, slow.config('inputs.json')['tcp'], slow._server.sockets[0].getsockname()[1])
+        slow.running = True
+
+    slow.start = _start
+    app.start()
+    try:
+        start = time.monotonic()
+        app.run_agent(master, timeout = 60)
+        elapsed = time.monotonic() - start
+    finally:
+        app.stop()
+
+    assert app.splitter.pauses > 0 and 0 < app.splitter.paused <= elapsed
+    assert sum(target.file.stat().st_size for target in app.targets) == master.stat().st_size
+
+
+def test_get_archive_streams_a_valid_tar(tmp_path: Path, master: Path):
+    app = _app(tmp_path, ['target_1', 'target_2'])
+    app.start()
+    try:
+        app.run_agent(master, timeout = 30)
+        client = LocalClient(app)
+        target = client.containers.get('target_1')
+        assert target.exec_run('test -f events.log').exit_code == 0
+        assert target.exec_run('test -f missing.log').exit_code == 1
+
+        stream, stat = client.api.get_archive('target_1', Path('/somewhere', 'events.log'), chunk_size = 1000)
+        chunks = list(stream)
+    finally:
+        app.stop()
+
+    data = app.targets[0].file.read_bytes()
+    assert stat['name'] == 'events.log' and stat['size'] == len(data)
+    archive = b''.join(chunks)
+    assert len(archive) % tarfile.BLOCKSIZE == 0
+    with tarfile.open(fileobj = io.BytesIO(archive), mode = 'r:') as tar:
+        assert tar.getnames() == ['events.log']
+        assert tar.extractfile('events.log').read() == data
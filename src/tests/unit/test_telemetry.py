@@ -0,0 +1,103 @@
+import json
+import time
+import numpy as np
+
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator
+from src.tools.telemetry import StatsSampler, decode
+
+START = datetime(2022, 3, 1, 12, 0, 0, tzinfo = timezone.utc)
+
+
+def _stats(second: float, cpu: int, rx: int, tx: int, memory: int = 64 << 20) -> Dict[str, Any]:
+    """
+    A reading shaped like the Docker stats stream, ``cpu`` being the total usage so far of a 2 core container
+    """
+    stamp = START + timedelta(seconds = second)
+    return {
+        'read':         stamp.strftime('%Y-%m-%dT%H:%M:%S.%f') + '123Z',
+        'cpu_stats':    {'cpu_usage': {'total_usage': cpu}, 'system_cpu_usage': (second + 1) * 1000, 'online_cpus': 2},
+        'precpu_stats': {'cpu_usage': {'total_usage': max(cpu - 250, 0)}, 'system_cpu_usage': second * 1000},
+        'memory_stats': {'usage': memory, 'stats': {'inactive_file': 4 << 20}},
+        'networks':     {'eth0': {'rx_bytes': rx, 'tx_bytes': tx}, 'eth1': {'rx_bytes': 10, 'tx_bytes': 0}},
+        'pids_stats':   {'current': 7}
+    }
+
+
+class FakeStats:
+    """
+    An endless stats stream, one reading every ``period`` seconds of wall time, recording when it is closed
+    """
+    def __init__(self, period: float = 0.01):
+        self.period = period
+        self.closed = False
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        second = 0
+        while not self.closed:
+            time.sleep(self.period)
+            yield _stats(second, cpu = 250 * (second + 1), rx = 1000 * second, tx = 900 * second)
+            second += 1
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_decode_matches_docker_stats():
+    stamp, cpu, memory, rx, tx, pids = decode(_stats(3, cpu = 1000, rx = 500, tx = 400))
+
+    assert stamp == START.timestamp() + 3.000000
+    assert cpu == 50.0
+    assert memory == 60 << 20
+    assert (rx, tx, pids) == (510, 400, 7)
+
+
+def test_series_share_a_fixed_grid():
+    sampler = StatsSampler({'splitter': [], 'target_1': []}, interval = 1.0, relays = ['splitter'])
+    # The splitter reports twice a second, the target misses a second and starts late
+    sampler.rows['splitter'] = [decode(_stats(second / 2, 250, 100 * second, 80 * second)) for second in range(9)]
+    sampler.rows['target_1'] = [decode(_stats(second, 250, 60 * second, 0)) for second in (1, 2, 4)]
+
+    series = sampler.series()
+    assert series['time'].tolist() == [0, 1, 2, 3, 4]
+    # The last reading in each second
+    assert series['splitter.rx_bytes'].tolist() == [110, 310, 510, 710, 810]
+    assert np.isnan(series['target_1.rx_bytes'][0])
+    assert series['target_1.rx_bytes'][1:].tolist() == [70, 130, 130, 250]
+    assert series['splitter.rx_bytes_rate'][1:].tolist() == [200, 200, 200, 100]
+
+    summary = sampler.summary(series)
+    assert summary['splitter']['rx_bytes'] == 700 and summary['splitter']['tx_bytes'] == 560
+    assert summary['splitter']['backlog_peak'] == 140
+    assert summary['target_1']['rx_bytes'] == 180 and 'backlog_peak' not in summary['target_1']
+    assert summary['target_1']['rx_rate_peak'] == 120
+
+
+def test_sampler_consumes_and_closes_the_streams(tmp_path: Path):
+    sources = {'splitter': FakeStats(), 'target_1': FakeStats()}
+    sampler = StatsSampler(sources, interval = 1.0, relays = ['splitter']).start()
+    time.sleep(0.2)
+    sampler.stop(timeout = 1)
+
+    assert all(source.closed for source in sources.values())
+    assert not sampler.errors
+    assert all(len(rows) > 5 for rows in sampler.rows.values())
+
+    summary = sampler.save(tmp_path)
+    series = np.load(Path(tmp_path, 'telemetry.npz'))
+    assert len(series['time']) == len(series['splitter.cpu']) == int(series['time'][-1]) + 1
+    assert json.loads(Path(tmp_path, 'telemetry.json').read_text())['containers'] == summary
+    assert summary['splitter']['backlog_peak'] > 0 and summary['target_1']['cpu_peak'] == 50.0
+
+
+def test_a_failing_stream_is_reported():
+    def _broken():
+        yield _stats(0, 250, 0, 0)
+        raise ConnectionError('stream lost')
+
+    sampler = StatsSampler({'target_1': _broken()}).start()
+    sampler.stop(timeout = 1)
+
+    assert len(sampler.rows['target_1']) == 1
+    assert isinstance(sampler.errors['target_1'], ConnectionError)
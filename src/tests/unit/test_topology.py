@@ -0,0 +1,66 @@
+import json
+import pytest
+
+from pathlib import Path
+from itertools import permutations
+from src.tools.namespace import Namespace
+from src.tools.topology import SPLITTER_LABEL, Topology
+
+
+def test_default_topology_matches_the_app_configs(tmp_path: Path):
+    topology = Topology()
+    topology.render(tmp_path)
+    app = Path(__file__).parents[2] / 'app'
+
+    assert topology.groups == {'splitter': ['target_1', 'target_2']}
+    assert set(topology.links()) == set(permutations(['splitter', 'target_1', 'target_2'], r = 2))
+    assert json.loads(topology.outputs('splitter').read_text()) == \
+        json.loads((app / 'splitter/outputs.json').read_text())
+    assert json.loads(topology.agent_outputs('splitter').read_text()) == \
+        json.loads((app / 'agent/outputs.json').read_text())
+
+
+@pytest.mark.parametrize(
+    ('targets', 'splitters', 'sizes'),
+    [(1, 1, [1]), (32, 1, [32]), (5, 2, [3, 2]), (4, 4, [1] * 4)]
+)
+def test_targets_are_split_in_contiguous_groups(targets: int, splitters: int, sizes: list):
+    topology = Topology(targets, splitters)
+
+    assert [len(group) for group in topology.groups.values()] == sizes
+    assert [target for group in topology.groups.values() for target in group] == topology.targets
+    assert topology.splitter_of(topology.targets[-1]) == topology.splitters[-1]
+
+
+def test_rendered_stack_is_namespaced(tmp_path: Path):
+    topology = Topology(5, 2, Namespace('gw0'))
+    compose = json.loads(topology.render(tmp_path).read_text())
+    loaded = Topology.load(tmp_path)
+
+    assert loaded.groups == topology.groups and loaded.namespace.name == 'gw0'
+    assert list(compose['services']) == ['target_1', 'target_2', 'target_3', 'splitter_1', 'target_4', 'target_5',
+                                         'splitter_2']
+    assert compose['services']['target_4']['container_name'] == 'gw0_target_4'
+    assert compose['services']['target_4']['labels'][SPLITTER_LABEL] == 'gw0_splitter_2'
+    assert compose['services']['splitter_2']['depends_on'] == ['target_4', 'target_5']
+    assert [host['host'] for host in json.loads(topology.outputs('splitter_2').read_text())['tcp']] == \
+        ['gw0_target_4', 'gw0_target_5']
+    assert json.loads(topology.agent_outputs('splitter_1').read_text())['tcp']['host'] == 'gw0_splitter_1'
+
+
+def test_splitters_need_a_target_each():
+    with pytest.raises(ValueError):
+        Topology(2, 3)
+
+
+def test_impaired_targets_are_fed_through_a_proxy(tmp_path: Path):
+    topology = Topology(2, 1, Namespace('gw0'), impairments = {'target_2': 'bandwidth=1M'})
+    compose = json.loads(topology.render(tmp_path).read_text())
+
+    assert Topology.load(tmp_path).impairments == {'target_2': 'bandwidth=1M'}
+    assert [host['host'] for host in json.loads(topology.outputs('splitter').read_text())['tcp']] == \
+        ['gw0_target_1', 'gw0_proxy_target_2']
+    proxy = compose['services']['proxy_target_2']
+    assert proxy['command'][-6:] == ['--upstream', 'gw0_target_2:9997', '--impair', 'bandwidth=1M', '--name',
+                                     'gw0_proxy_target_2']
+    assert compose['services']['splitter']['depends_on'] == ['target_1', 'proxy_target_2']
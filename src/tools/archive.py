@@ -0,0 +1,85 @@
+import io
+import tarfile
+import logging
+
+from contextlib import contextmanager
+from typing import IO, Iterable, Iterator, Optional
+
+_logger = logging.getLogger(__name__)
+
+# Read size used when handing archive members to the verifiers
+BUFFER_SIZE = 1024 * 1024
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Expose an iterable of ``bytes`` chunks (e.g. the generator returned by :py:meth:`APIClient.get_archive`) as a
+    readable, non-seekable raw stream so it can be parsed as it arrives.
+    """
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks  = iter(chunks)
+        self._pending = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class TeeStream(io.RawIOBase):
+    """
+    Raw stream that copies everything read from ``source`` to ``sink`` (when given) on the way through.
+    """
+    def __init__(self, source: IO[bytes], sink: Optional[IO[bytes]] = None, name: str = ''):
+        self._source = source
+        self._sink   = sink
+        self.name    = name
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._source.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        if self._sink is not None and size:
+            self._sink.write(data)
+        return size
+
+
+@contextmanager
+def stream_member(chunks: Iterable[bytes], member: str, sink: Optional[IO[bytes]] = None,
+                  name: str = '') -> Iterator[IO[bytes]]:
+    """
+    Parse a tar stream as it arrives (``r|``) and yield a buffered reader over ``member``.
+
+    Nothing is written to disk unless a ``sink`` is given, in which case the member bytes are teed into it as they
+    are consumed. The reader is only valid inside the context and must be read sequentially.
+
+    :param chunks:  The tar stream as an iterable of byte chunks
+    :param member:  The name of the member to extract
+    :param sink:    Optional writable file to tee the member bytes into
+    :param name:    The name reported by the reader (defaults to ``member``)
+    :return:
+    """
+    with tarfile.open(fileobj = ChunkStream(chunks), mode = 'r|') as tar:
+        for info in tar:
+            if info.name == member:
+                _logger.info(f'Streaming {member} ({info.size} bytes) from archive')
+                yield io.BufferedReader(
+                    TeeStream(tar.extractfile(info), sink, name or member),
+                    buffer_size = BUFFER_SIZE
+                )
+                break
+        else:
+            raise AssertionError(f'{member} was not found in the archive')
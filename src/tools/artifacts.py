@@ -0,0 +1,104 @@
+import time
+import logging
+
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Callable, Dict, Iterable, Optional, Union
+
+_logger = logging.getLogger(__name__)
+
+# Bytes kept of each artifact by default, half from its head and half from its tail
+CAP = 64 * 1024 * 1024
+
+# Written where the middle of an artifact was dropped
+SKIPPED = b'\n[... %d bytes skipped ...]\n'
+
+Source = Callable[[], Union[bytes, Iterable[bytes]]]
+
+
+class CappedWriter:
+    """
+    Write a stream to a file keeping at most ``cap`` bytes of it: the first half as it arrives and the last half
+    held back in memory until :py:meth:`close`, with a marker for the bytes dropped in between.
+
+    :param file:    The file to write to
+    :param cap:     The bytes to keep, 0 to keep everything
+    """
+    def __init__(self, file: IO[bytes], cap: int = CAP):
+        self.file    = file
+        self.head    = cap - cap // 2 if cap else None
+        self.tail    = cap // 2
+        self.written = 0
+        self.skipped = 0
+        self._held   = deque()
+        self._size   = 0
+
+    def write(self, chunk: bytes) -> None:
+        if self.head is None or self.written < self.head:
+            part = chunk if self.head is None else chunk[:self.head - self.written]
+            self.file.write(part)
+            self.written += len(part)
+            chunk = chunk[len(part):]
+        if not chunk:
+            return
+        if not self.tail:
+            self.skipped += len(chunk)
+            return
+
+        self._held.append(chunk)
+        self._size += len(chunk)
+        # Drop whole chunks that are no longer part of the tail
+        while self._size - len(self._held[0]) >= self.tail:
+            dropped = self._held.popleft()
+            self._size -= len(dropped)
+            self.skipped += len(dropped)
+
+    def close(self) -> None:
+        if self._size > self.tail:
+            excess = self._size - self.tail
+            self._held[0] = self._held[0][excess:]
+            self._size -= excess
+            self.skipped += excess
+        if self.skipped:
+            self.file.write(SKIPPED % self.skipped)
+        for chunk in self._held:
+            self.file.write(chunk)
+        self.written += self._size
+        self._held.clear()
+        self._size = 0
+
+
+def _collect(name: str, source: Source, directory: Path, cap: int) -> Path:
+    start = time.monotonic()
+    data = source()
+    path = Path(directory, name)
+    with path.open(mode = 'wb') as file:
+        writer = CappedWriter(file, cap)
+        for chunk in [data] if isinstance(data, bytes) else data:
+            writer.write(chunk)
+        writer.close()
+    _logger.info(
+        f'Collected {name} in {time.monotonic() - start:.3f}s: {writer.written} bytes'
+        + (f', {writer.skipped} skipped' if writer.skipped else '')
+    )
+    return path
+
+
+def collect(sources: Dict[str, Source], directory: Union[str, Path], cap: int = CAP,
+            workers: Optional[int] = None) -> Dict[str, Path]:
+    """
+    Stream every source into its own file in ``directory`` concurrently, each capped to ``cap`` bytes by a
+    :py:class:`CappedWriter`.
+
+    :param sources:     Callables returning the content (bytes or chunks, e.g. ``container.logs(stream = True)``)
+                        by file name
+    :param directory:   Where to write the files
+    :param cap:         The bytes kept per file, 0 to keep everything
+    :param workers:     The number of threads, one per source by default
+    :return:            The paths by file name
+    """
+    Path(directory).mkdir(parents = True, exist_ok = True)
+    with ThreadPoolExecutor(max_workers = workers or max(len(sources), 1)) as pool:
+        futures = {name: pool.submit(_collect, name, source, Path(directory), cap) for name, source in sources.items()}
+    return {name: future.result() for name, future in futures.items()}
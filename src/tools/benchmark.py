@@ -0,0 +1,78 @@
+import time
+import logging
+
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Sequence
+
+_logger = logging.getLogger(__name__)
+
+# Seconds between polls of the Target file sizes
+POLL_INTERVAL = 0.05
+
+
+def target_sizes(client, targets: Sequence[str], name: str) -> Dict[str, int]:
+    """
+    The size of the ``name`` output file in each Target container, 0 if not created yet.
+
+    :param client:  A DockerClient
+    :param targets: The Target container names
+    :param name:    The output file name in the Target working directory
+    :return:
+    """
+    sizes = {}
+    for target in targets:
+        result = client.containers.get(target).exec_run(f'stat -c %s {name}')
+        sizes[target] = int(result.output) if result.exit_code == 0 else 0
+    return sizes
+
+
+def measure(run_agent: Callable[[], Any], client, targets: Sequence[str], name: str, size: int, events: int,
+            timeout: float = 600) -> Dict[str, Any]:
+    """
+    Run the agent once and time the pipeline until every byte it sent has landed in the Targets.
+
+    The Target files may already hold events from earlier runs, so only their growth during this run is counted.
+
+    :param run_agent:   Runs the agent to completion
+    :param client:      A DockerClient
+    :param targets:     The Target container names
+    :param name:        The output file name in the Target working directory
+    :param size:        The bytes sent by the agent
+    :param events:      The events sent by the agent
+    :param timeout:     Seconds to wait for the last byte after the agent is done
+    :return:            ``seconds`` the agent ran, ``time_to_last_byte`` from its start, ``events_per_sec``,
+                        ``mb_per_sec`` and the ``share`` of the received bytes per Target
+    """
+    before = target_sizes(client, targets, name)
+    start = time.monotonic()
+    run_agent()
+    agent = time.monotonic() - start
+
+    deadline = time.monotonic() + timeout
+    while True:
+        sizes = target_sizes(client, targets, name)
+        received = {target: sizes[target] - before[target] for target in targets}
+        last_byte = time.monotonic() - start
+        if sum(received.values()) >= size:
+            break
+        assert time.monotonic() < deadline, f'{size - sum(received.values())} bytes did not land in {timeout}s'
+        time.sleep(POLL_INTERVAL)
+
+    total = sum(received.values())
+    result = {
+        'timestamp':         datetime.now(timezone.utc).isoformat(),
+        'events':            events,
+        'bytes':             size,
+        'received':          total,
+        'targets':           len(targets),
+        'seconds':           agent,
+        'time_to_last_byte': last_byte,
+        'events_per_sec':    events / last_byte,
+        'mb_per_sec':        size / last_byte / 1e6,
+        'share':             {target: received[target] / total if total else 0.0 for target in targets}
+    }
+    _logger.info(
+        f'{events} events ({size} bytes) in {last_byte:.3f}s: {result["events_per_sec"]:.0f} events/s, '
+        f'{result["mb_per_sec"]:.1f} MB/s'
+    )
+    return result
@@ -0,0 +1,134 @@
+import json
+import time
+import fcntl
+import hashlib
+import logging
+
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple, Union
+from docker.errors import APIError
+from docker.utils import parse_repository_tag
+
+_logger = logging.getLogger(__name__)
+
+# Image label holding the build key
+LABEL = 'timberbrook.build-key'
+
+# Cached images kept by default
+KEEP = 3
+
+
+def build_key(context: Sequence[Union[str, Path]], dockerfile: Union[str, Path], buildargs: Dict[str, Any]) -> str:
+    """
+    Digest everything that goes into the app image: the files under each ``context`` directory (path and contents),
+    the Dockerfile and the build args.
+
+    :param context:     The directories copied into the image
+    :param dockerfile:  The Dockerfile
+    :param buildargs:   The build args
+    :return:
+    """
+    digest = hashlib.sha256()
+    for directory in map(Path, context):
+        for path in sorted(path for path in directory.rglob('*') if path.is_file()):
+            digest.update(path.relative_to(directory.parent).as_posix().encode() + b'\0')
+            digest.update(hashlib.sha256(path.read_bytes()).digest())
+    digest.update(Path(dockerfile).read_bytes())
+    digest.update(json.dumps(buildargs, sort_keys = True).encode())
+    return digest.hexdigest()[:32]
+
+
+class BuildCache:
+    """
+    Reuse app images across sessions by labelling each build with its :py:func:`build_key`.
+
+    The last use of each key is kept in a JSON file (in the pytest cache), and once more than ``keep`` labelled images
+    exist the least recently used ones no container uses are removed. Sessions sharing the cache (e.g. pytest-xdist
+    workers) take turns, so an image missing from the cache is built once.
+
+    :param client:  A DockerClient
+    :param state:   The JSON file recording the last use of each key
+    :param keep:    The number of cached images to keep
+    """
+    def __init__(self, client, state: Union[str, Path], keep: int = KEEP):
+        self.client = client
+        self.state  = Path(state)
+        self.keep   = keep
+
+    def _load(self) -> Dict[str, float]:
+        try:
+            return json.loads(self.state.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _touch(self, key: str) -> None:
+        used = self._load()
+        # Strictly after every other use, however coarse the clock
+        used[key] = max(time.time(), max(used.values(), default = 0) + 1e-6)
+        self.state.parent.mkdir(parents = True, exist_ok = True)
+        self.state.write_text(json.dumps(used, indent = 4))
+
+    @contextmanager
+    def _lock(self):
+        self.state.parent.mkdir(parents = True, exist_ok = True)
+        with self.state.with_suffix('.lock').open(mode = 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        The cached image built for ``key``, if any
+        """
+        images = self.client.images.list(filters = {'label': f'{LABEL}={key}'})
+        return images[0] if images else None
+
+    def build(self, key: str, tag: str, build: Callable[..., Any]) -> Tuple[Any, bool]:
+        """
+        Tag the cached image for ``key`` as ``tag``, or build it on a miss.
+
+        :param key:     The build key
+        :param tag:     The tag the image is used under
+        :param build:   Builds the image, called with the ``labels`` to set on it
+        :return:        The image and whether it came from the cache
+        """
+        with self._lock():
+            image = self.get(key)
+            hit = image is not None
+            if hit:
+                _logger.info(f'Reusing image {image.short_id} for build key {key}')
+                image.tag(*parse_repository_tag(tag))
+            else:
+                _logger.info(f'No image for build key {key}, building {tag}...')
+                image = build(labels = {LABEL: key})
+            self._touch(key)
+            self.prune()
+        return image, hit
+
+    def prune(self) -> None:
+        """
+        Remove the least recently used cached images beyond ``keep``, but none a container (running or stopped) uses.
+        The images are removed without force, by untagging each of their tags, so one that is still in use is kept
+        """
+        used = self._load()
+        busy = {container.attrs.get('Image') for container in self.client.containers.list(all = True)}
+        images = self.client.images.list(filters = {'label': LABEL})
+        images.sort(key = lambda image: used.get(image.labels.get(LABEL), 0), reverse = True)
+        for image in images[self.keep:]:
+            key = image.labels.get(LABEL)
+            if image.id in busy:
+                _logger.info(f'Keeping cached image {image.short_id} (build key {key}) used by a container')
+                continue
+            _logger.info(f'Pruning cached image {image.short_id} (build key {key})')
+            try:
+                for reference in image.tags or [image.id]:
+                    self.client.images.remove(image = reference)
+            except APIError as error:
+                _logger.warning(f'Could not prune cached image {image.short_id}: {error}')
+                continue
+            used.pop(key, None)
+        self.state.parent.mkdir(parents = True, exist_ok = True)
+        self.state.write_text(json.dumps(used, indent = 4))
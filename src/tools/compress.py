@@ -0,0 +1,195 @@
+import io
+import os
+import zlib
+import time
+import struct
+import fnmatch
+import hashlib
+import logging
+import tarfile
+
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Dict, Optional, Sequence, Union
+
+_logger = logging.getLogger(__name__)
+
+# Uncompressed bytes deflated per block
+BLOCK_SIZE = 1024 * 1024
+
+# History each block is primed with, the deflate window
+WINDOW = 32 * 1024
+
+# Suffixes of files whose content is already compressed
+COMPRESSED = (
+    '.gz', '.tgz', '.bz2', '.xz', '.zst', '.zip', '.7z', '.lz4', '.br', '.png', '.jpg', '.jpeg', '.gif', '.webp'
+)
+
+# What to do with the files matching :py:data:`COMPRESSED`
+DEFLATE = 'deflate'
+STORE   = 'store'
+SKIP    = 'skip'
+
+
+def _deflate(block: bytes, history: bytes, level: int, last: bool) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict = history) if history else \
+        zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzip(io.RawIOBase):
+    """
+    Writable stream producing a single standard gzip member, deflating independent blocks on a thread pool the way
+    pigz does.
+
+    Each block is deflated on its own (zlib releases the GIL while compressing), primed with the last
+    :py:data:`WINDOW` bytes before it so the ratio stays close to a single stream, and ended with a sync flush so the
+    blocks concatenate into one valid deflate stream. Finished blocks are written in order as they complete, with at
+    most two per worker in flight. The CRC is computed on the writing thread, at a small fraction of the deflate cost.
+
+    :param file:        The file to write the gzip stream to
+    :param level:       The compression level
+    :param workers:     The number of threads, one per CPU by default
+    :param block_size:  The uncompressed bytes per block
+    """
+    def __init__(self, file: IO[bytes], level: int = 6, workers: Optional[int] = None, block_size: int = BLOCK_SIZE):
+        self.file        = file
+        self.block_size  = block_size
+        self.workers     = workers or os.cpu_count() or 1
+        self._level      = level
+        self._pool       = ThreadPoolExecutor(max_workers = self.workers)
+        self._pending    = deque()
+        self._block      = bytearray()
+        self._history    = b''
+        self._crc        = 0
+        self._size       = 0
+        self.written     = 0
+        self._write(b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + b'\x00\xff')
+
+    def writable(self) -> bool:
+        return True
+
+    @property
+    def level(self) -> int:
+        return self._level
+
+    @level.setter
+    def level(self, level: int) -> None:
+        """
+        Change the compression level from the next byte written on, ending the current block early if needed
+        """
+        if level != self._level and self._block:
+            self._submit(bytes(self._block))
+            self._block.clear()
+        self._level = level
+
+    def _submit(self, block: bytes, last: bool = False) -> None:
+        self._pending.append(self._pool.submit(_deflate, block, self._history, self._level, last))
+        self._history = (self._history + block)[-WINDOW:]
+        while len(self._pending) > 2 * self.workers:
+            self._drain()
+
+    def _write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.written += len(data)
+
+    def _drain(self) -> None:
+        self._write(self._pending.popleft().result())
+
+    def write(self, data) -> int:
+        size = len(data)
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += size
+        self._block += data
+        while len(self._block) >= self.block_size:
+            self._submit(bytes(self._block[:self.block_size]))
+            del self._block[:self.block_size]
+        return size
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self._submit(bytes(self._block), last = True)
+        self._block.clear()
+        while self._pending:
+            self._drain()
+        self._pool.shutdown()
+        self._write(struct.pack('<II', self._crc, self._size & 0xFFFFFFFF))
+        super().close()
+
+
+def _selected(name: str, include: Sequence[str], exclude: Sequence[str]) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in include) and \
+        not any(fnmatch.fnmatch(name, pattern) for pattern in exclude)
+
+
+def _digest(path: Path) -> bytes:
+    digest = hashlib.sha256()
+    with path.open(mode = 'rb') as file:
+        while chunk := file.read(BLOCK_SIZE):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def bundle(directory: Union[str, Path], output: Union[str, Path], include: Sequence[str] = ('*',),
+           exclude: Sequence[str] = (), compressed: str = STORE, dedupe: bool = True, level: int = 6,
+           workers: Optional[int] = None) -> Dict[str, int]:
+    """
+    Archive ``directory`` to a ``.tar.gz`` through :py:class:`ParallelGzip`.
+
+    :param directory:   The directory to archive, stored under its own name
+    :param output:      The ``.tar.gz`` to write
+    :param include:     Glob patterns of the paths (relative to ``directory``) to archive
+    :param exclude:     Glob patterns of the paths to leave out
+    :param compressed:  For already compressed files: ``deflate`` them again, ``store`` them without compression or
+                        ``skip`` them
+    :param dedupe:      Archive files with the same content once, the copies as hard links to the first
+    :param level:       The compression level
+    :param workers:     The number of compression threads, one per CPU by default
+    :return:            The count of files archived, linked and skipped and the bytes read and written
+    """
+    directory, output = Path(directory), Path(output)
+    stats = dict(files = 0, linked = 0, skipped = 0, read = 0, written = 0)
+    seen: Dict[tuple, str] = {}
+    start = time.monotonic()
+    with output.open(mode = 'wb') as file:
+        stream = ParallelGzip(file, level = level, workers = workers)
+        with tarfile.open(fileobj = stream, mode = 'w|') as tar:
+            tar.add(str(directory), directory.name, recursive = False)
+            for path in sorted(directory.rglob('*')):
+                relative = path.relative_to(directory).as_posix()
+                arcname = f'{directory.name}/{relative}'
+                if path.resolve() == output.resolve():
+                    continue
+                if path.is_dir():
+                    tar.add(str(path), arcname, recursive = False)
+                    continue
+                is_compressed = path.suffix.lower() in COMPRESSED
+                if not _selected(relative, include, exclude) or (is_compressed and compressed == SKIP):
+                    stats['skipped'] += 1
+                    continue
+
+                info = tar.gettarinfo(str(path), arcname)
+                if dedupe and info.isreg():
+                    key = (info.size, _digest(path))
+                    if key in seen:
+                        info.type, info.linkname, info.size = tarfile.LNKTYPE, seen[key], 0
+                        tar.addfile(info)
+                        stats['linked'] += 1
+                        continue
+                    seen[key] = arcname
+
+                if not info.isreg():
+                    tar.addfile(info)
+                    continue
+                stream.level = 0 if is_compressed and compressed == STORE else level
+                with path.open(mode = 'rb') as member:
+                    tar.addfile(info, member)
+                stream.level = level
+                stats['files'] += 1
+                stats['read'] += info.size
+        stream.close()
+        stats['written'] = stream.written
+    _logger.info(f'Bundled {directory} to {output} in {time.monotonic() - start:.3f}s: {stats}')
+    return stats
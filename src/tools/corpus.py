@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import numpy as np
+
+from pathlib import Path
+from typing import Any, Dict, Sequence, Union
+from src.tools.enums import LineLength, Stamp
+
+_logger = logging.getLogger(__name__)
+
+# Bumped whenever the generated content changes, so stale cache entries are never reused
+VERSION = 1
+
+# Events rendered per write
+BATCH = 1000000
+
+# The sequence numbered events follow the agent input, see src.tools.sequence.PATTERN
+PREFIX = b'This is event number '
+
+# Timestamped events start here and are STEP apart, rendered as 2022-01-01T00:00:00.000000Z
+EPOCH = np.datetime64('2022-01-01T00:00:00', 'us')
+STEP = np.timedelta64(1000, 'us')
+TIMESTAMP_SIZE = 27
+
+# Latency stamped events follow the sequence number with the send time in nanoseconds, zeros until it is sent
+LATENCY_HEAD = b' @' + b'0' * 19
+
+# Longest event generated, bounds the tail of the wider distributions
+MAX_LINE = 64 * 1024
+
+POWERS = 10 ** np.arange(1, 19, dtype = np.int64)
+
+FILLER = b'abcdefghijklmnopqrstuvwxyz'
+
+
+def corpus_key(events: int, distribution: LineLength, line_size: int, stamp: Stamp, seed: int,
+               avoid: Sequence[bytes] = ()) -> str:
+    """
+    The content address of a corpus: a digest of every parameter that shapes its bytes.
+
+    :return:
+    """
+    params = {
+        'version':      VERSION,
+        'events':       events,
+        'distribution': LineLength(distribution).value,
+        'line_size':    line_size,
+        'stamp':        Stamp(stamp).value,
+        'seed':         seed,
+        'avoid':        sorted(term.decode() for term in avoid)
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys = True).encode()).hexdigest()[:32]
+
+
+def _lengths(rng: np.random.Generator, distribution: LineLength, line_size: int, count: int) -> np.ndarray:
+    """
+    Draw event lengths (with the newline) averaging about ``line_size``.
+    """
+    if distribution == LineLength.FIXED or line_size <= 0:
+        lengths = np.full(count, line_size, dtype = np.float64)
+    elif distribution == LineLength.UNIFORM:
+        lengths = rng.uniform(line_size / 2, line_size * 3 / 2, count)
+    elif distribution == LineLength.NORMAL:
+        lengths = rng.normal(line_size, line_size / 4, count)
+    else:
+        lengths = rng.lognormal(np.log(line_size), 1, count)
+    return np.clip(np.rint(lengths), 2, MAX_LINE).astype(np.int64)
+
+
+def _scrub(buffer: np.ndarray, filler: np.ndarray, avoid: Sequence[bytes]) -> None:
+    """
+    Overwrite the terms to ``avoid`` found in the random filler of ``buffer``, in place.
+
+    The last filler byte of each match is replaced with a letter no term holds, which cannot start a new match, so
+    the search is only repeated for matches that overlapped one already replaced. Matches in the heads are left.
+    """
+    letters = [letter for letter in FILLER if not any(letter in term for term in avoid)]
+    if not letters:
+        raise ValueError(f'The filter terms {avoid!r} hold every filler letter')
+    search = re.compile(b'|'.join(map(re.escape, avoid)))
+    while hits := [
+        match.start() + int(np.flatnonzero(filler[match.start():match.end()])[-1])
+        for match in search.finditer(buffer.tobytes()) if filler[match.start():match.end()].any()
+    ]:
+        buffer[hits] = letters[0]
+
+
+def _render(rng: np.random.Generator, first: int, count: int, distribution: LineLength, line_size: int,
+            stamp: Stamp, avoid: Sequence[bytes] = ()) -> np.ndarray:
+    """
+    Render ``count`` events from event number ``first`` into one buffer.
+
+    Every byte starts out as a random lowercase letter, then the newlines, the separators and the sequence number or
+    timestamp heads are written over it column by column, so no event is formatted in Python. The terms to ``avoid``
+    are then scrubbed from the letters, see :py:func:`_scrub`.
+    """
+    numbers = np.arange(first, first + count, dtype = np.int64)
+    if stamp in (Stamp.SEQUENCE, Stamp.LATENCY):
+        digits = np.searchsorted(POWERS, numbers, side = 'right') + 1
+        head = len(PREFIX) + digits + (len(LATENCY_HEAD) if stamp == Stamp.LATENCY else 0)
+    else:
+        head = np.full(count, TIMESTAMP_SIZE if stamp == Stamp.TIMESTAMP else 0, dtype = np.int64)
+
+    lengths = np.maximum(_lengths(rng, distribution, line_size, count), head + 1)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    buffer = rng.integers(ord('a'), ord('z') + 1, size = int(ends[-1]) if count else 0, dtype = np.uint8)
+    buffer[ends - 1] = ord('\n')
+
+    padded = (head > 0) & (lengths > head + 1)
+    buffer[starts[padded] + head[padded]] = ord(' ')
+
+    if stamp in (Stamp.SEQUENCE, Stamp.LATENCY):
+        for column, value in enumerate(PREFIX):
+            buffer[starts + column] = value
+        for column in range(int(digits.max()) if count else 0):
+            rows = digits > column
+            power = 10 ** (digits[rows] - 1 - column)
+            buffer[starts[rows] + len(PREFIX) + column] = ord('0') + (numbers[rows] // power) % 10
+        if stamp == Stamp.LATENCY:
+            for column, value in enumerate(LATENCY_HEAD):
+                buffer[starts + len(PREFIX) + digits + column] = value
+    elif stamp == Stamp.TIMESTAMP:
+        text = np.datetime_as_string(EPOCH + numbers * STEP, unit = 'us').astype('S26')
+        columns = text.view(np.uint8).reshape(count, 26)
+        for column in range(26):
+            buffer[starts + column] = columns[:, column]
+        buffer[starts + 26] = ord('Z')
+
+    if avoid and count:
+        # The filler is what is left once the heads, separators and newlines are taken out
+        edges = np.zeros(len(buffer) + 1, dtype = np.int64)
+        np.add.at(edges, starts, 1)
+        np.add.at(edges, starts + np.minimum(head + padded, lengths), -1)
+        filler = np.cumsum(edges[:-1]) == 0
+        filler[ends - 1] = False
+        _scrub(buffer, filler, avoid)
+    return buffer
+
+
+def generate(path: Union[str, Path], events: int, distribution: LineLength = LineLength.FIXED, line_size: int = 0,
+             stamp: Stamp = Stamp.SEQUENCE, seed: int = 0, avoid: Sequence[bytes] = ()) -> Path:
+    """
+    Write a synthetic event corpus, :py:data:`BATCH` events per write.
+
+    Events start with ``This is event number <n>`` (:py:attr:`Stamp.SEQUENCE`), the same followed by `` @`` and 19
+    zeros the sender overwrites with the send time (:py:attr:`Stamp.LATENCY`), a ``<timestamp>Z``
+    (:py:attr:`Stamp.TIMESTAMP`) or nothing (:py:attr:`Stamp.NONE`), followed by a space and random lowercase letters
+    up to the drawn length. An event is never shorter than its head, so with the default ``line_size`` of 0 the
+    sequence numbered events are exactly the agent input format. The same parameters always produce the same bytes.
+
+    The random letters never spell one of the terms to ``avoid``, the splitter filter terms, so only a corpus made to
+    hold them is filtered.
+
+    :param path:            The file to create
+    :param events:          The number of events
+    :param distribution:    The distribution of the event lengths
+    :param line_size:       The mean event length in bytes with the newline, 0 for the heads only
+    :param stamp:           What each event starts with
+    :param seed:            The random seed
+    :param avoid:           Terms the random letters must not spell
+    :return:                The path
+    """
+    rng = np.random.default_rng(seed)
+    avoid = [term.encode() if isinstance(term, str) else term for term in avoid if term]
+    with Path(path).open(mode = 'wb') as file:
+        for first in range(0, events, BATCH):
+            count = min(BATCH, events - first)
+            file.write(memoryview(_render(rng, first, count, distribution, line_size, stamp, avoid)))
+    return Path(path)
+
+
+def cached_corpus(cache_dir: Union[str, Path], events: int, distribution: LineLength = LineLength.FIXED,
+                  line_size: int = 0, stamp: Stamp = Stamp.SEQUENCE, seed: int = 0,
+                  avoid: Sequence[bytes] = ()) -> Path:
+    """
+    Return the corpus for the parameters from ``cache_dir``, generating it on a miss.
+
+    The corpus is stored as ``<key>.log`` next to a ``<key>.json`` of its parameters. It is generated under a temporary
+    name and renamed into place, so an interrupted run never leaves a partial corpus behind to be reused.
+
+    :param cache_dir:   The corpus cache directory
+    :return:            The path to the corpus
+    """
+    avoid = [term.encode() if isinstance(term, str) else term for term in avoid if term]
+    key = corpus_key(events, distribution, line_size, stamp, seed, avoid)
+    path = Path(cache_dir, f'{key}.log')
+    if path.exists():
+        _logger.info(f'Reusing corpus {path}')
+        return path
+
+    params: Dict[str, Any] = {
+        'events':       events,
+        'distribution': LineLength(distribution).value,
+        'line_size':    line_size,
+        'stamp':        Stamp(stamp).value,
+        'seed':         seed
+    }
+    _logger.info(f'Generating corpus {path}: {params}')
+    Path(cache_dir).mkdir(parents = True, exist_ok = True)
+    partial = Path(cache_dir, f'{key}.{os.getpid()}.tmp')
+    try:
+        generate(partial, **params, avoid = avoid)
+        params['avoid'] = [term.decode() for term in avoid]
+        params['bytes'] = partial.stat().st_size
+        Path(cache_dir, f'{key}.json').write_text(json.dumps(params, indent = 4))
+        os.replace(partial, path)
+    finally:
+        partial.unlink(missing_ok = True)
+    return path
@@ -0,0 +1,163 @@
+import math
+import logging
+import numpy as np
+
+from typing import Any, Dict, List, Sequence
+from prettytable import PrettyTable
+
+_logger = logging.getLogger(__name__)
+
+# Run length buckets are powers of 2, up to 2 ** (BUCKETS - 1) and above
+BUCKETS = 21
+
+
+def _bucket_label(bucket: int) -> str:
+    low, high = 1 << bucket, (1 << (bucket + 1)) - 1
+    if bucket == BUCKETS - 1:
+        return f'{low}+'
+    return str(low) if low == high else f'{low}-{high}'
+
+
+def chi_square_p(chi2: float, df: int) -> float:
+    """
+    Upper tail probability of the chi-square distribution, by the Wilson–Hilferty cube root approximation.
+
+    :param chi2:    The statistic
+    :param df:      The degrees of freedom
+    :return:
+    """
+    if df <= 0:
+        return 1.0
+    scale = 2 / (9 * df)
+    z = ((chi2 / df) ** (1 / 3) - (1 - scale)) / math.sqrt(scale)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+class Distribution:
+    """
+    How the events were spread over the Targets, in master order.
+
+    Each verified batch records which Target received its events in an ``int8`` array with one entry per master
+    event, so the analysis needs no pass of its own and costs one vectorised assignment per batch. From that array
+    :py:meth:`results` derives, all with NumPy:
+
+        - The event and byte share of each Target and its deviation from an even split
+        - The runs of consecutive master events sent to the same Target and their lengths, the splitter switching
+          Target once per chunk it reads, with a histogram per Target in powers of 2
+        - How many Target switches follow the round-robin order of the Targets
+        - A chi-square test of the event counts against an even split, and a fairness score of 1 - Cramér's V
+
+    :param names:   The Target names, in the round-robin order
+    :param size:    The number of master events (the highest position + 1)
+    """
+    def __init__(self, names: Sequence[str], size: int):
+        self.names  = list(names)
+        self.owner  = np.full(size, -1, dtype = np.int8)
+        self.events = np.zeros(len(self.names), dtype = np.int64)
+        self.bytes  = np.zeros(len(self.names), dtype = np.int64)
+
+    def update(self, target: int, positions: np.ndarray, size: int) -> None:
+        """
+        Record a batch of events received by a Target.
+
+        :param target:      The index of the Target in :py:attr:`names`
+        :param positions:   The master positions of the valid events in the batch
+        :param size:        The bytes in the batch
+        :return:
+        """
+        positions = positions[(positions >= 0) & (positions < len(self.owner))]
+        self.owner[positions] = target
+        self.events[target] += len(positions)
+        self.bytes[target] += size
+
+    def results(self) -> Dict[str, Any]:
+        """
+        Analyse the spread recorded so far.
+
+        :return:    The ``targets`` (by name), ``runs`` (histogram buckets by name) and ``fairness`` results
+        """
+        targets = len(self.names)
+        owner = self.owner[self.owner >= 0]
+        starts = np.flatnonzero(np.concatenate(([True], owner[1:] != owner[:-1]))) if len(owner) else \
+            np.empty(0, dtype = np.intp)
+        lengths = np.diff(np.append(starts, len(owner)))
+        runs = owner[starts].astype(np.intp)
+
+        buckets = np.minimum(np.log2(np.maximum(lengths, 1)).astype(np.intp), BUCKETS - 1)
+        histogram = np.bincount(runs * BUCKETS + buckets, minlength = targets * BUCKETS).reshape(targets, BUCKETS)
+        used = np.flatnonzero(histogram.any(axis = 0))
+        count = np.bincount(runs, minlength = targets)
+        mean = np.bincount(runs, weights = lengths, minlength = targets) / np.maximum(count, 1)
+        longest = np.zeros(targets, dtype = np.int64)
+        np.maximum.at(longest, runs, lengths)
+
+        total, size = int(self.events.sum()), int(self.bytes.sum())
+        ideal = 1 / targets if targets else 0
+        report = {
+            'targets': {
+                name: {
+                    'events':      int(self.events[idx]),
+                    'event_share': self.events[idx] / total if total else 0.0,
+                    'bytes':       int(self.bytes[idx]),
+                    'byte_share':  self.bytes[idx] / size if size else 0.0,
+                    'deviation':   (self.events[idx] / total if total else 0.0) - ideal,
+                    'runs':        int(count[idx]),
+                    'mean_run':    float(mean[idx]),
+                    'max_run':     int(longest[idx])
+                }
+                for idx, name in enumerate(self.names)
+            },
+            'runs': {
+                _bucket_label(bucket): {name: int(histogram[idx, bucket]) for idx, name in enumerate(self.names)}
+                for bucket in used
+            }
+        }
+
+        # Round robin sends each run to the Target after the previous one
+        switches = len(runs) - 1
+        in_order = int(np.count_nonzero(runs[1:] == (runs[:-1] + 1) % targets)) if switches > 0 else 0
+        expected = total / targets if targets else 0
+        chi2 = float(((self.events - expected) ** 2).sum() / expected) if expected else 0.0
+        df = targets - 1
+        deviation = max((abs(target['deviation']) for target in report['targets'].values()), default = 0)
+        report['fairness'] = {
+            'switches':      max(switches, 0),
+            'in_order':      in_order / switches if switches > 0 else 1.0,
+            'max_deviation': float(deviation),
+            'chi2':          chi2,
+            'df':            df,
+            'p_value':       chi_square_p(chi2, df),
+            'score':         1 - math.sqrt(chi2 / (total * df)) if total and df else 1.0
+        }
+        return report
+
+    @staticmethod
+    def tables(report: Dict[str, Any]) -> List[PrettyTable]:
+        """
+        Lay the :py:meth:`results` out as tables: per Target, the run length histogram and the fairness summary.
+
+        :param report:  The results
+        :return:
+        """
+        targets = PrettyTable(field_names = [
+            'target', 'events', 'event share', 'bytes', 'byte share', 'deviation', 'runs', 'mean run', 'max run'
+        ])
+        for name, target in report['targets'].items():
+            targets.add_row([
+                name, target['events'], f'{target["event_share"]:.2%}', target['bytes'],
+                f'{target["byte_share"]:.2%}', f'{target["deviation"]:+.2%}', target['runs'],
+                f'{target["mean_run"]:.1f}', target['max_run']
+            ])
+
+        runs = PrettyTable(field_names = ['run length', *report['targets']])
+        for label, counts in report['runs'].items():
+            runs.add_row([label, *counts.values()])
+
+        fairness = report['fairness']
+        summary = PrettyTable(field_names = ['switches', 'round-robin order', 'max deviation', 'chi2', 'df', 'p',
+                                             'fairness'])
+        summary.add_row([
+            fairness['switches'], f'{fairness["in_order"]:.2%}', f'{fairness["max_deviation"]:.2%}',
+            f'{fairness["chi2"]:.2f}', fairness['df'], f'{fairness["p_value"]:.4f}', f'{fairness["score"]:.4f}'
+        ])
+        return [targets, runs, summary]
@@ -5,4 +5,18 @@ class ServiceType(str, Enum):
     TARGET   = 'target'
     SPLITTER = 'splitter'
     AGENT    = 'agent'
+    PROXY    = 'proxy'
 
+
+class LineLength(str, Enum):
+    FIXED     = 'fixed'
+    UNIFORM   = 'uniform'
+    NORMAL    = 'normal'
+    LOGNORMAL = 'lognormal'
+
+
+class Stamp(str, Enum):
+    NONE      = 'none'
+    SEQUENCE  = 'sequence'
+    TIMESTAMP = 'timestamp'
+    LATENCY   = 'latency'
@@ -0,0 +1,117 @@
+import re
+import json
+import logging
+import numpy as np
+
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+_logger = logging.getLogger(__name__)
+
+# From this many terms the alternation is compiled as a trie
+TRIE_TERMS = 16
+
+# What the splitter does with the events holding a filter term
+DROP = 'drop'
+KEEP = 'keep'
+OFF  = 'off'
+
+
+def _trie(terms: Sequence[bytes]) -> bytes:
+    """
+    Compile literal terms into one regex shaped like their prefix trie, e.g. ``err(?:or|no)``, so the regex engine
+    tries each byte of the input against one branch per distinct next byte rather than against every term.
+    """
+    root: Dict[bytes, dict] = {}
+    for term in terms:
+        node = root
+        for byte in term:
+            node = node.setdefault(bytes([byte]), {})
+        node[b''] = {}
+
+    def _pattern(node: Dict[bytes, dict]) -> bytes:
+        branches = [re.escape(byte) + _pattern(child) for byte, child in sorted(node.items()) if byte]
+        if not branches:
+            return b''
+        body = branches[0] if len(branches) == 1 else b'(?:' + b'|'.join(branches) + b')'
+        # A term ending here makes the rest of the branch optional, the shorter term already matched
+        return b'(?:' + body + b')?' if b'' in node else body
+
+    return _pattern(root)
+
+
+def filter_terms(path: Union[str, Path]) -> List[str]:
+    """
+    Read the ``filter`` of a splitter ``filter.json``, a term or a list of terms.
+
+    :param path:    The ``filter.json``
+    :return:        The terms, none when there is no file or no filter
+    """
+    path = Path(path)
+    if not path.exists():
+        return []
+    terms = json.loads(path.read_text()).get('filter') or []
+    return [terms] if isinstance(terms, str) else list(terms)
+
+
+class EventFilter:
+    """
+    The splitter filter as a single compiled matcher over blocks of lines.
+
+    The terms are literal substrings. A few terms are compiled as a plain alternation, from :py:data:`TRIE_TERMS`
+    on as a trie (see :py:func:`_trie`), which gives the one pass over the input of an Aho-Corasick automaton with
+    the standard ``re`` module. A whole block is searched at once and only the matches are mapped back to their
+    lines, so blocks without a match cost one regex scan.
+
+    :param terms:   The filter terms
+    :param mode:    ``drop`` when the events holding a term are expected to be dropped, ``keep`` when only those
+                    are expected to be delivered
+    """
+    def __init__(self, terms: Sequence[Union[str, bytes]], mode: str = DROP):
+        self.terms = [term.encode() if isinstance(term, str) else term for term in terms]
+        self.mode  = mode
+        if len(self.terms) < TRIE_TERMS:
+            pattern = b'|'.join(map(re.escape, self.terms))
+        else:
+            pattern = _trie(self.terms)
+        self._search = re.compile(pattern)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], mode: str = DROP) -> Optional['EventFilter']:
+        """
+        Load the filter of a splitter ``filter.json``, see :py:func:`filter_terms`.
+
+        :param path:    The ``filter.json``
+        :param mode:    ``drop``, ``keep`` or ``off``
+        :return:        ``None`` when the mode is ``off`` or there is no filter
+        """
+        if mode == OFF or not (terms := filter_terms(path)):
+            return None
+        _logger.info(f'Loaded the splitter filter {terms!r} from {path}, matching events are expected to {mode}')
+        return cls(terms, mode)
+
+    def match(self, block: bytes, terminated: bool = True) -> np.ndarray:
+        """
+        Find the lines of a block holding a filter term.
+
+        :param block:       A block of lines from :py:func:`read_chunks`
+        :param terminated:  Whether the block ends in a newline
+        :return:            A ``bool`` array with one entry per line
+        """
+        found = np.zeros(block.count(b'\n') + (0 if terminated else 1), dtype = bool)
+        starts: List[int] = [match.start() for match in self._search.finditer(block)]
+        if starts:
+            newlines = np.flatnonzero(np.frombuffer(block, dtype = np.uint8) == ord('\n'))
+            found[np.searchsorted(newlines, starts)] = True
+        return found
+
+    def dropped(self, block: bytes, terminated: bool = True) -> np.ndarray:
+        """
+        Find the lines of a block the splitter is expected to drop.
+
+        :param block:       A block of lines from :py:func:`read_chunks`
+        :param terminated:  Whether the block ends in a newline
+        :return:            A ``bool`` array with one entry per line
+        """
+        found = self.match(block, terminated)
+        return found if self.mode == DROP else ~found
@@ -0,0 +1,316 @@
+import logging
+import numpy as np
+
+from hashlib import blake2b
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+from src.tools.filter import EventFilter
+
+_logger = logging.getLogger(__name__)
+
+# Bytes read from a file per batch of lines
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Width of a line digest (bytes)
+DIGEST_SIZE = 8
+
+# Counters saturate here, anything above 1 is a duplicate anyway
+MAX_COUNT = np.iinfo(np.uint8).max
+
+# Personalisation used for a trailing line without a line terminator, so it never matches a terminated line
+PARTIAL = b'partial'
+
+
+def digest(lines: Sequence[bytes], terminated: bool = True) -> np.ndarray:
+    """
+    Hash each line (without its terminator) to a fixed width 64-bit digest.
+
+    :param lines:       The line contents
+    :param terminated:  Whether the lines ended in a newline
+    :return:            An ``uint64`` array with one digest per line
+    """
+    person = b'' if terminated else PARTIAL
+    return np.frombuffer(
+        b''.join(blake2b(line, digest_size = DIGEST_SIZE, person = person).digest() for line in lines),
+        dtype = '<u8'
+    )
+
+
+def read_chunks(file: IO[bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[bytes, bool]]:
+    """
+    Read a file in large chunks and yield blocks that end on a line boundary.
+
+    A trailing line without a terminator is yielded on its own with ``terminated`` set to ``False``.
+
+    :param file:        A binary file descriptor
+    :param chunk_size:  The number of bytes to read at a time
+    :return:            Generator of ``(block, terminated)``
+    """
+    remainder = b''
+    while chunk := file.read(chunk_size):
+        end = chunk.rfind(b'\n') + 1
+        if end:
+            yield remainder + chunk[:end], True
+            remainder = chunk[end:]
+        else:
+            remainder += chunk
+    if remainder:
+        yield remainder, False
+
+
+def split_lines(block: bytes, terminated: bool = True) -> List[bytes]:
+    """
+    Split a block from :py:func:`read_chunks` into line contents (without terminators).
+
+    :param block:       The block of lines
+    :param terminated:  Whether the block ends in a newline
+    :return:
+    """
+    lines = block.split(b'\n')
+    if terminated:
+        lines.pop()
+    return lines
+
+
+def read_lines(file: IO[bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[List[bytes], bool]]:
+    """
+    Read a file in large chunks and yield batches of complete lines (without terminators).
+
+    A trailing line without a terminator is yielded on its own with ``terminated`` set to ``False``.
+
+    :param file:        A binary file descriptor
+    :param chunk_size:  The number of bytes to read at a time
+    :return:            Generator of ``(lines, terminated)``
+    """
+    for block, terminated in read_chunks(file, chunk_size):
+        yield split_lines(block, terminated), terminated
+
+
+def interleave(files: Sequence[IO[bytes]], chunk_size: int = CHUNK_SIZE,
+               reader: Callable = read_lines) -> Iterator[Tuple[int, Any, bool]]:
+    """
+    Round-robin a reader (:py:func:`read_lines` or :py:func:`read_chunks`) across several files so every stream
+    keeps moving.
+
+    :param files:       Binary file descriptors
+    :param chunk_size:  The number of bytes to read at a time
+    :param reader:      The reader to apply to each file
+    :return:            Generator of ``(file index, lines or block, terminated)``
+    """
+    readers = {idx: reader(file, chunk_size) for idx, file in enumerate(files)}
+    while readers:
+        for idx, source in list(readers.items()):
+            batch = next(source, None)
+            if batch is None:
+                del readers[idx]
+            else:
+                yield (idx, *batch)
+
+
+class MasterIndex:
+    """
+    Compact index of the events in a master file.
+
+    Each distinct master line is stored as a sorted 64-bit digest with an ``uint8`` counter next to it. Lines are
+    only compared byte for byte when two distinct master lines share a digest; those few lines are kept in a side
+    table and get counter slots after the main ones.
+
+    Optionally the master line number of each slot is kept in :py:attr:`positions` for the order aware verifiers, and
+    the slots of the events the splitter filter drops are flagged in :py:attr:`dropped`.
+    """
+    def __init__(self, digests: np.ndarray, side: Dict[int, Dict[bytes, int]], positions: Optional[np.ndarray] = None,
+                 dropped: Optional[np.ndarray] = None):
+        self._digests = digests
+        self._side    = side
+        self._side_keys = np.fromiter(side.keys(), dtype = np.uint64, count = len(side))
+        self.counts    = np.zeros(len(digests) + sum(len(lines) for lines in side.values()), dtype = np.uint8)
+        self.positions = positions
+        self.dropped   = dropped
+        self.invalid   = 0
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    @property
+    def collisions(self) -> np.ndarray:
+        """
+        The digests shared by distinct master lines, lines with these digests must be compared byte for byte.
+        """
+        return self._side_keys
+
+    @classmethod
+    def build(cls, master: Union[str, Path], chunk_size: int = CHUNK_SIZE, positions: bool = False,
+              event_filter: Optional[EventFilter] = None) -> 'MasterIndex':
+        """
+        Read and index the master file.
+
+        :param master:          The location of the Master file
+        :param chunk_size:      The number of bytes to read at a time
+        :param positions:       Keep the master line number of each event
+        :param event_filter:    The splitter filter, flag the events it drops in the same pass
+        :return:
+        """
+        digests, lengths, dropped = [], [], []
+        with open(master, mode = 'rb') as source:
+            for block, terminated in read_chunks(source, chunk_size):
+                lines = split_lines(block, terminated)
+                digests.append(digest(lines, terminated))
+                lengths.append(np.fromiter(map(len, lines), dtype = np.uint32, count = len(lines)) + int(terminated))
+                if event_filter is not None:
+                    dropped.append(event_filter.dropped(block, terminated))
+
+        return cls.from_digests(
+            master,
+            np.concatenate(digests) if digests else np.empty(0, dtype = np.uint64),
+            np.concatenate(lengths) if lengths else np.empty(0, dtype = np.uint32),
+            positions = positions,
+            dropped   = (np.concatenate(dropped) if dropped else np.empty(0, dtype = bool)) if event_filter else None
+        )
+
+    @classmethod
+    def from_digests(cls, master: Union[str, Path], digests: np.ndarray, lengths: np.ndarray,
+                     offsets: Optional[np.ndarray] = None, positions: bool = False,
+                     dropped: Optional[np.ndarray] = None) -> 'MasterIndex':
+        """
+        Index precomputed master line digests.
+
+        :param master:      The location of the Master file, re-read only for repeated digests
+        :param digests:     The digest of each master line
+        :param lengths:     The length of each master line, including its terminator
+        :param offsets:     The offset of each master line, defaults to the lines being contiguous from the start
+        :param positions:   Keep the master line number (the index in ``digests``) of each event
+        :param dropped:     Whether the splitter filter drops each master line
+        :return:
+        """
+        order = np.argsort(digests, kind = 'stable')
+        digests = digests[order]
+
+        # Equal digests are either repeated master lines or true collisions
+        repeated = np.flatnonzero(digests[1:] == digests[:-1])
+        side, first = {}, []
+        if len(repeated):
+            if offsets is None:
+                offsets = np.concatenate((np.zeros(1, dtype = np.uint64), np.cumsum(lengths[:-1], dtype = np.uint64)))
+            side, first = cls._resolve(master, digests, order, offsets, lengths, repeated)
+
+        # The stable sort leaves the earliest line of a repeated digest first
+        unique = np.ones(len(digests), dtype = bool)
+        unique[repeated + 1] = False
+        if side:
+            unique &= ~np.isin(digests, np.fromiter(side.keys(), dtype = np.uint64, count = len(side)))
+        digests = digests[unique]
+        lines = None
+        if positions or dropped is not None:
+            lines = np.concatenate((order[unique], np.array(first, dtype = order.dtype))).astype(np.int64)
+        del order
+        if dropped is not None:
+            dropped = dropped[lines]
+            lines = lines if positions else None
+
+        index = cls(digests, side, lines, dropped)
+        _logger.info(f'Indexed {len(index)} distinct events from {master} ({len(side)} digest collisions)')
+        return index
+
+    @staticmethod
+    def _resolve(master: Union[str, Path], digests: np.ndarray, order: np.ndarray, offsets: np.ndarray,
+                 lengths: np.ndarray, repeated: np.ndarray) -> Tuple[Dict[int, Dict[bytes, int]], List[int]]:
+        """
+        Re-read the master lines behind repeated digests and keep the groups whose lines really differ.
+
+        :return:    ``{digest: {line: slot}}`` with slots numbered from 0, and the first master line number of each slot
+        """
+        groups = {}
+        for idx in repeated:
+            groups.setdefault(int(digests[idx]), {int(order[idx])}).add(int(order[idx + 1]))
+
+        side, first = {}, []
+        with open(master, mode = 'rb') as source:
+            for key, positions in groups.items():
+                lines = {}
+                for position in sorted(positions):
+                    source.seek(int(offsets[position]))
+                    lines.setdefault(source.read(int(lengths[position])), position)
+                if len(lines) > 1:
+                    side[key] = {}
+                    for line, position in lines.items():
+                        side[key][line] = len(first)
+                        first.append(position)
+        return side, first
+
+    def lookup(self, lines: Sequence[bytes], terminated: bool = True) -> np.ndarray:
+        """
+        Find the counter slot of each line.
+
+        :param lines:       The line contents (without terminators)
+        :param terminated:  Whether the lines ended in a newline
+        :return:            An ``int64`` array of slots, ``-1`` where the line is not a master event
+        """
+        return self.find(digest(lines, terminated), lines, terminated)
+
+    def find(self, keys: np.ndarray, lines: Union[Sequence[bytes], Mapping[int, bytes]] = (),
+             terminated: bool = True) -> np.ndarray:
+        """
+        Find the counter slot of each line digest.
+
+        :param keys:        The line digests
+        :param lines:       The line contents, only needed for the digests in :py:attr:`collisions`
+        :param terminated:  Whether the lines ended in a newline
+        :return:            An ``int64`` array of slots, ``-1`` where the line is not a master event
+        """
+        slots = np.searchsorted(self._digests, keys)
+        slots[slots == len(self._digests)] = 0
+        found = self._digests[slots] == keys if len(self._digests) else np.zeros(len(keys), dtype = bool)
+        slots = np.where(found, slots, -1)
+
+        if self._side:
+            # Exact comparison, only for the digests shared by several master lines
+            suffix = b'\n' if terminated else b''
+            for idx in np.flatnonzero(np.isin(keys, self._side_keys)):
+                slot = self._side[int(keys[idx])].get(lines[idx] + suffix)
+                if slot is not None:
+                    slots[idx] = len(self._digests) + slot
+        return slots
+
+    def count(self, slots: np.ndarray) -> None:
+        """
+        Count the slots found by :py:meth:`lookup` or :py:meth:`find`, ``-1`` counts as an invalid event.
+
+        :param slots:   The slots of the received lines
+        :return:
+        """
+        valid = slots[slots >= 0]
+        self.invalid += len(slots) - len(valid)
+
+        slot, seen = np.unique(valid, return_counts = True)
+        self.counts[slot] = np.minimum(self.counts[slot] + seen, MAX_COUNT)
+
+    def update(self, lines: Sequence[bytes], terminated: bool = True) -> np.ndarray:
+        """
+        Count a batch of received lines against the master events.
+
+        :param lines:       The line contents (without terminators)
+        :param terminated:  Whether the lines ended in a newline
+        :return:            The slots of the lines as returned by :py:meth:`lookup`
+        """
+        slots = self.lookup(lines, terminated)
+        self.count(slots)
+        return slots
+
+    def results(self) -> Dict[str, int]:
+        """
+        Summarise the counters in the ``valid``/``duplicate``/``missing``/``invalid`` form used by the reports, with
+        the events dropped by the splitter filter left out and the ``leaked`` ones counted when filtered.
+
+        :return:
+        """
+        counts = self.counts if self.dropped is None else self.counts[~self.dropped]
+        histogram = np.bincount(np.minimum(counts, 2), minlength = 3)
+        results = {
+            'valid':     int(histogram[1]),
+            'duplicate': int(histogram[2]),
+            'missing':   int(histogram[0])
+        }
+        if self.dropped is not None:
+            results['leaked'] = int(np.count_nonzero(self.counts[self.dropped]))
+        results['invalid'] = self.invalid
+        return results
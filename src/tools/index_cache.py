@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import base64
+import shutil
+import hashlib
+import logging
+import tempfile
+import numpy as np
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+from src.tools.index import CHUNK_SIZE, MasterIndex
+from src.tools.filter import EventFilter
+from src.tools.sequence import SequenceCheck
+
+_logger = logging.getLogger(__name__)
+
+# Bytes the cached entries may take in total by default
+LIMIT = 1024 * 1024 * 1024
+
+# Bumped whenever what an entry holds changes, so older entries are never loaded
+VERSION = 2
+
+# Maps each master path to its size, mtime and content hash
+MANIFEST = 'manifest.json'
+
+
+def _load(path: Path) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode = 'r')
+    except ValueError:
+        # An empty array can't be mapped
+        return np.load(path)
+
+
+class IndexCache:
+    """
+    Keep the verification structures built from a master file on disk, to map them back in on later sessions instead
+    of reading and hashing the master again.
+
+    Entries are keyed by the content hash of the master and the parameters they were built with (the kind, the event
+    pattern, the splitter filter, ...), and hold ``.npy`` arrays loaded memory mapped plus a JSON ``meta`` file. The
+    content hash of each master path is remembered with its size and mtime, so an unchanged master is recognised from
+    a ``stat`` alone; a changed one is hashed again (at disk speed, far below the cost of indexing) and a master whose
+    content did not really change still hits. Once the entries take more than ``limit`` bytes the least recently used
+    ones are removed.
+
+    :param directory:   Where the entries are kept
+    :param limit:       The bytes the entries may take
+    """
+    def __init__(self, directory: Union[str, Path], limit: int = LIMIT):
+        self.directory = Path(directory)
+        self.limit     = limit
+        self.directory.mkdir(parents = True, exist_ok = True)
+
+    def _manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            return json.loads(Path(self.directory, MANIFEST).read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def content_hash(self, master: Union[str, Path]) -> str:
+        """
+        The SHA-256 of the master content, from the manifest while its size and mtime are unchanged.
+
+        :param master:  The location of the Master file
+        :return:
+        """
+        path = Path(master).resolve()
+        stat = path.stat()
+        manifest = self._manifest()
+        entry = manifest.get(str(path))
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['sha256']
+
+        digest = hashlib.sha256()
+        with path.open(mode = 'rb') as source:
+            while chunk := source.read(CHUNK_SIZE):
+                digest.update(chunk)
+        manifest[str(path)] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+        self._write(Path(self.directory, MANIFEST), json.dumps(manifest, indent = 4))
+        return digest.hexdigest()
+
+    def _write(self, path: Path, text: str) -> None:
+        temp = path.with_name(f'.{path.name}.{os.getpid()}')
+        temp.write_text(text)
+        os.replace(temp, path)
+
+    def key(self, master: Union[str, Path], **params: Any) -> str:
+        """
+        The entry key for a master file and the parameters of what is built from it.
+
+        :param master:  The location of the Master file
+        :param params:  JSON serialisable parameters
+        :return:
+        """
+        digest = hashlib.sha256(f'{VERSION}:{self.content_hash(master)}'.encode())
+        digest.update(json.dumps(params, sort_keys = True, default = str).encode())
+        return digest.hexdigest()[:32]
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], Dict[str, np.ndarray]]]:
+        """
+        The meta and arrays of an entry, the arrays memory mapped read only.
+
+        :param key: The entry key
+        :return:    ``None`` on a miss
+        """
+        entry = Path(self.directory, key)
+        try:
+            meta = json.loads(Path(entry, 'meta.json').read_text())
+            arrays = {name: _load(Path(entry, f'{name}.npy')) for name in meta['arrays']}
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        meta['used'] = time.time()
+        self._write(Path(entry, 'meta.json'), json.dumps(meta))
+        return meta, arrays
+
+    def put(self, key: str, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+        """
+        Store an entry, written aside and moved in place so readers never see it half written, then evict.
+
+        :param key:     The entry key
+        :param meta:    JSON serialisable meta data, ``arrays``, ``bytes`` and ``used`` are set by the cache
+        :param arrays:  The arrays by name
+        :return:
+        """
+        temp = Path(tempfile.mkdtemp(prefix = f'.{key}.', dir = self.directory))
+        for name, array in arrays.items():
+            np.save(Path(temp, f'{name}.npy'), np.ascontiguousarray(array))
+        size = sum(path.stat().st_size for path in temp.iterdir())
+        Path(temp, 'meta.json').write_text(json.dumps({
+            **meta, 'arrays': list(arrays), 'bytes': size, 'used': time.time()
+        }))
+        try:
+            os.replace(temp, Path(self.directory, key))
+        except OSError:
+            # Stored meanwhile by another session
+            shutil.rmtree(temp, ignore_errors = True)
+        self.prune()
+
+    def prune(self) -> None:
+        """
+        Remove the least recently used entries until the rest fit in the limit
+        """
+        entries = []
+        for meta_path in self.directory.glob('*/meta.json'):
+            try:
+                meta = json.loads(meta_path.read_text())
+            except ValueError:
+                continue
+            entries.append((meta.get('used', 0), meta.get('bytes', 0), meta_path.parent))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key = lambda entry: entry[0]):
+            if total <= self.limit:
+                break
+            _logger.info(f'Evicting index cache entry {entry.name} ({size} bytes)')
+            shutil.rmtree(entry, ignore_errors = True)
+            total -= size
+
+    def _cached(self, kind: str, master: Union[str, Path], build: Callable[[], Any],
+                save: Callable[[Any], Tuple[Dict[str, Any], Dict[str, np.ndarray]]],
+                restore: Callable[[Dict[str, Any], Dict[str, np.ndarray]], Any], **params: Any) -> Any:
+        start = time.monotonic()
+        key = self.key(master, kind = kind, **params)
+        entry = self.get(key)
+        if entry is not None:
+            result = restore(*entry)
+            _logger.info(f'Loaded the {kind} of {master} from the index cache in {time.monotonic() - start:.3f}s')
+            return result
+
+        result = build()
+        if result is not None:
+            self.put(key, *save(result))
+        else:
+            self.put(key, {'none': True}, {})
+        _logger.info(f'Built and cached the {kind} of {master} in {time.monotonic() - start:.3f}s')
+        return result
+
+    @staticmethod
+    def _filter(event_filter: Optional[EventFilter]) -> Optional[Dict[str, Any]]:
+        if event_filter is None:
+            return None
+        return {'terms': [term.decode('latin-1') for term in event_filter.terms], 'mode': event_filter.mode}
+
+    def master_index(self, master: Union[str, Path], positions: bool = False,
+                     event_filter: Optional[EventFilter] = None) -> MasterIndex:
+        """
+        :py:meth:`MasterIndex.build`, through the cache.
+
+        :param master:          The location of the Master file
+        :param positions:       Keep the master line number of each event
+        :param event_filter:    The splitter filter
+        :return:
+        """
+        def _save(index: MasterIndex) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+            side = {
+                str(key): {base64.b64encode(line).decode(): slot for line, slot in lines.items()}
+                for key, lines in index._side.items()
+            }
+            arrays = {'digests': index._digests}
+            if index.positions is not None:
+                arrays['positions'] = index.positions
+            if index.dropped is not None:
+                arrays['dropped'] = index.dropped
+            return {'side': side}, arrays
+
+        def _restore(meta: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> MasterIndex:
+            side = {
+                int(key): {base64.b64decode(line): slot for line, slot in lines.items()}
+                for key, lines in meta['side'].items()
+            }
+            return MasterIndex(arrays['digests'], side, arrays.get('positions'), arrays.get('dropped'))
+
+        return self._cached(
+            'master_index', master,
+            build     = lambda: MasterIndex.build(master, positions = positions, event_filter = event_filter),
+            save      = _save,
+            restore   = _restore,
+            positions = positions,
+            filter    = self._filter(event_filter)
+        )
+
+    def sequence_check(self, master: Union[str, Path], pattern: bytes,
+                       event_filter: Optional[EventFilter] = None) -> Optional[SequenceCheck]:
+        """
+        :py:meth:`SequenceCheck.build`, through the cache. That the master does not follow ``pattern`` is cached too.
+
+        :param master:          The location of the Master file
+        :param pattern:         The event pattern, its only group being the sequence number
+        :param event_filter:    The splitter filter
+        :return:                ``None`` if the master file does not follow the pattern
+        """
+        def _save(check: SequenceCheck) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+            return {'low': check.low, 'size': check.size, 'filtered': check.filtered}, {
+                'expected': check.expected, 'dropped': check.dropped
+            }
+
+        def _restore(meta: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> Optional[SequenceCheck]:
+            if meta.get('none'):
+                return None
+            check = SequenceCheck(pattern, meta['low'], meta['size'])
+            check.expected, check.dropped, check.filtered = arrays['expected'], arrays['dropped'], meta['filtered']
+            return check
+
+        return self._cached(
+            'sequence_check', master,
+            build   = lambda: SequenceCheck.build(master, pattern, event_filter = event_filter),
+            save    = _save,
+            restore = _restore,
+            pattern = pattern.decode('latin-1'),
+            filter  = self._filter(event_filter)
+        )
@@ -0,0 +1,231 @@
+import json
+import time
+import logging
+import threading
+import numpy as np
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Union
+from prettytable import PrettyTable
+from src.tools.corpus import LATENCY_HEAD
+from src.tools.sequence import PATTERN as SEQUENCE_PATTERN
+
+_logger = logging.getLogger(__name__)
+
+# Shape of the latency stamped events, the sequence number is still the only group
+PATTERN = SEQUENCE_PATTERN + rb' @\d{19}'
+
+# Digits of a stamp, the send time in nanoseconds since the epoch
+DIGITS = len(LATENCY_HEAD) - 2
+
+# Sub-buckets per power of two, the relative error of a recorded value is below 1 / SUB_BUCKETS
+SUB_BITS    = 7
+SUB_BUCKETS = 1 << SUB_BITS
+
+# Highest power of two recorded, in microseconds (about 12 days), higher values land in the last bucket
+MAX_MAGNITUDE = 40
+
+# The percentiles reported
+PERCENTILES = {'p50': 50.0, 'p99': 99.0, 'p99.9': 99.9}
+
+_POWERS = 10 ** np.arange(DIGITS - 1, -1, -1, dtype = np.int64)
+
+
+def stamped(chunks: Iterable[bytes], clock: Callable[[], int] = time.time_ns) -> Iterator[bytes]:
+    """
+    Fill in the send time of the latency stamped events (see :py:attr:`Stamp.LATENCY`) as they are sent.
+
+    The chunks are re-cut at their last newline, so no stamp is split, and each is stamped with the ``clock`` reading
+    taken as it is handed on.
+
+    :param chunks:  The events to send
+    :param clock:   The send time in nanoseconds since the epoch
+    :return:        The stamped chunks, holding the same bytes but for the stamps
+    """
+    tail = b''
+    for chunk in chunks:
+        block = tail + chunk
+        end = block.rfind(b'\n') + 1
+        tail = block[end:]
+        if end:
+            yield block[:end].replace(LATENCY_HEAD, b' @%0*d' % (DIGITS, clock()))
+    if tail:
+        yield tail.replace(LATENCY_HEAD, b' @%0*d' % (DIGITS, clock()))
+
+
+def parse_stamps(block: bytes) -> np.ndarray:
+    """
+    The send times of the stamped events in ``block``, in nanoseconds, 0 for a stamp never filled in.
+
+    :param block:   Whole events
+    :return:
+    """
+    buffer = np.frombuffer(block, dtype = np.uint8)
+    marks = np.flatnonzero(buffer == ord('@'))
+    marks = marks[(marks > 0) & (marks + DIGITS < len(buffer))]
+    marks = marks[buffer[marks - 1] == ord(' ')]
+    digits = buffer[marks[:, None] + np.arange(1, DIGITS + 1)].astype(np.int64) - ord('0')
+    stamps = digits[((digits >= 0) & (digits <= 9)).all(axis = 1)]
+    return stamps @ _POWERS
+
+
+class LatencyHistogram:
+    """
+    A histogram of latencies in microseconds with a bounded relative error, in the manner of HdrHistogram.
+
+    Values below :py:data:`SUB_BUCKETS` are counted exactly, and every power of two above is split in
+    :py:data:`SUB_BUCKETS` linear sub-buckets, so a fixed array of a few thousand counters covers microseconds to days
+    however many values are recorded. Percentiles report the highest value of their bucket, capped to the exact
+    maximum.
+    """
+    SIZE = (MAX_MAGNITUDE - SUB_BITS + 2) * SUB_BUCKETS
+
+    def __init__(self):
+        self.counts = np.zeros(self.SIZE, dtype = np.int64)
+        self.max    = 0
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    @staticmethod
+    def index(values: np.ndarray) -> np.ndarray:
+        values = np.clip(values, 0, (1 << (MAX_MAGNITUDE + 1)) - 1).astype(np.int64)
+        # floor(log2(value)), exact as the values fit a double's mantissa
+        magnitude = np.frexp(np.maximum(values, 1).astype(np.float64))[1] - 1
+        shift = np.maximum(magnitude - SUB_BITS, 0)
+        return np.where(magnitude < SUB_BITS, values, (shift + 1) * SUB_BUCKETS + (values >> shift) - SUB_BUCKETS)
+
+    @staticmethod
+    def highest(index: int) -> int:
+        """
+        The highest value counted in bucket ``index``
+        """
+        if index < SUB_BUCKETS:
+            return index
+        shift = index // SUB_BUCKETS - 1
+        return ((SUB_BUCKETS + index % SUB_BUCKETS) << shift) + (1 << shift) - 1
+
+    def record(self, values: np.ndarray) -> None:
+        if not len(values):
+            return
+        self.counts += np.bincount(self.index(values), minlength = self.SIZE)
+        self.max = max(self.max, int(values.max()))
+
+    def merge(self, other: 'LatencyHistogram') -> 'LatencyHistogram':
+        self.counts += other.counts
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, percentile: float) -> int:
+        cumulative = np.cumsum(self.counts)
+        if not cumulative[-1]:
+            return 0
+        rank = max(int(np.ceil(percentile / 100 * cumulative[-1])), 1)
+        return min(self.highest(int(np.searchsorted(cumulative, rank))), self.max)
+
+    def summary(self) -> Dict[str, int]:
+        return {'count': self.count, **{name: self.percentile(value) for name, value in PERCENTILES.items()},
+                'max': self.max}
+
+
+class LatencyAnalyzer:
+    """
+    Streaming analysis of the end to end latency of the stamped events, from their send time to the time the chunk
+    completing them was received from the Target.
+
+    Chunks are fed per target in arrival order, from any thread, and only their stamps are parsed (see
+    :py:func:`parse_stamps`); the part of an event still in flight is held back until the rest of it lands. The
+    latencies are recorded in a :py:class:`LatencyHistogram` per target and per ``window`` seconds of the run, so the
+    memory held depends on the length of the run, not on the number of events.
+
+    :param window:  Seconds per time window
+    """
+    def __init__(self, window: float = 5.0):
+        self.window     = window
+        self.targets:   Dict[str, LatencyHistogram] = {}
+        self.windows:   Dict[int, LatencyHistogram] = {}
+        self.unstamped  = 0
+        self.negative   = 0
+        self._start:    Optional[int] = None
+        self._tails:    Dict[str, bytes] = {}
+        self._lock      = threading.Lock()
+
+    def feed(self, name: str, chunk: bytes, received: Optional[int] = None) -> None:
+        """
+        Record the latencies of the events ``chunk`` completes in the stream of target ``name``.
+
+        :param name:        The target
+        :param chunk:       The next bytes of its stream
+        :param received:    When the chunk was received, in nanoseconds since the epoch, now by default
+        :return:
+        """
+        received = received if received is not None else time.time_ns()
+        with self._lock:
+            block = self._tails.get(name, b'') + chunk
+            end = block.rfind(b'\n') + 1
+            self._tails[name] = block[end:]
+            if not end:
+                return
+            stamps = parse_stamps(block[:end])
+            sent = stamps[stamps > 0]
+            self.unstamped += len(stamps) - len(sent)
+            latencies = (received - sent) // 1000
+            self.negative += int((latencies < 0).sum())
+            latencies = np.maximum(latencies, 0)
+            if not len(latencies):
+                return
+
+            if self._start is None:
+                self._start = received
+            self.targets.setdefault(name, LatencyHistogram()).record(latencies)
+            window = int((received - self._start) // int(self.window * 1e9))
+            self.windows.setdefault(window, LatencyHistogram()).record(latencies)
+
+    def results(self) -> Dict[str, Any]:
+        """
+        The percentiles over all the targets, per target and per window, in microseconds
+        """
+        with self._lock:
+            total = LatencyHistogram()
+            for histogram in self.targets.values():
+                total.merge(histogram)
+            return {
+                'unit':      'us',
+                'window':    self.window,
+                'all':       total.summary(),
+                'targets':   {name: histogram.summary() for name, histogram in sorted(self.targets.items())},
+                'windows':   [
+                    {'start': window * self.window, **histogram.summary()}
+                    for window, histogram in sorted(self.windows.items())
+                ],
+                'unstamped': self.unstamped,
+                'negative':  self.negative
+            }
+
+    @staticmethod
+    def table(results: Dict[str, Any]) -> PrettyTable:
+        table = PrettyTable(field_names = ['events', 'count', *[f'{name} (ms)' for name in PERCENTILES], 'max (ms)'])
+        rows = [('all', results['all']), *results['targets'].items()]
+        rows += [(f'{window["start"]:.0f}s', window) for window in results['windows']]
+        for name, summary in rows:
+            table.add_row([
+                name, summary['count'], *[f'{summary[key] / 1000:.3f}' for key in PERCENTILES],
+                f'{summary["max"] / 1000:.3f}'
+            ])
+        return table
+
+    def save(self, directory: Union[str, Path], name: str = 'latency') -> Dict[str, Any]:
+        """
+        Write the :py:meth:`results` to ``<name>.json`` in ``directory`` and log them.
+
+        :param directory:   Where to write them
+        :param name:        The file name stem
+        :return:            The results
+        """
+        results = self.results()
+        directory = Path(directory)
+        directory.mkdir(parents = True, exist_ok = True)
+        Path(directory, f'{name}.json').write_text(json.dumps(results, indent = 4))
+        _logger.info(f'Event latency:\n{self.table(results)}')
+        return results
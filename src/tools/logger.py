@@ -1,30 +1,222 @@
+import json
+import queue
 import logging
 
+from typing import Any, Dict, List, Optional
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
 
+# Formatted records a BatchFileHandler holds before writing them
+BATCH = 1000
 
-def init_config(log_file, level = logging.INFO):
+# Seconds the rate limit of a logger is counted over
+WINDOW = 1.0
+
+_listener: Optional[QueueListener] = None
+
+# What logging._srcfile was before queue mode switched the caller lookup off, restored by shutdown()
+_UNSET = object()
+_srcfile: Any = _UNSET
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format each record as one JSON object per line
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time':    self.formatTime(record),
+            'created': record.created,
+            'logger':  record.name,
+            'level':   record.levelname,
+            'thread':  record.threadName,
+            'message': record.getMessage()
+        }
+        if record.lineno:
+            entry.update(function = record.funcName, line = record.lineno)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let at most ``rate`` records per :py:data:`WINDOW` through for each logger, counting the dropped ones into the
+    first record let through after them. Warnings and above always pass.
+
+    :param rate:    The records per window per logger
+    """
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self._windows: Dict[str, List[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        window = self._windows.setdefault(record.name, [0.0, 0, 0])
+        if record.created - window[0] >= WINDOW:
+            window[0], window[1] = record.created, 0
+        if window[1] >= self.rate:
+            window[2] += 1
+            return False
+        window[1] += 1
+        if window[2]:
+            record.msg = f'{record.msg} [{window[2]} records suppressed]'
+            window[2] = 0
+        return True
+
+
+class BatchFileHandler(logging.FileHandler):
+    """
+    File handler holding formatted records until :py:data:`BATCH` of them are pending or it is flushed, to write
+    them in one call.
+
+    :param filename:    The log file
+    :param batch:       The records written at once
+    """
+    def __init__(self, filename, batch: int = BATCH, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.batch = batch
+        self._pending: List[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self._pending.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self._pending) >= self.batch:
+            self.flush()
+
+    def flush(self) -> None:
+        self.acquire()
+        try:
+            if self._pending and self.stream is not None:
+                self.stream.write(''.join(self._pending))
+                self._pending.clear()
+            super().flush()
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        self.flush()
+        super().close()
+
+
+class BatchListener(QueueListener):
+    """
+    Queue listener flushing its handlers whenever the queue runs empty, so batches never wait for more records
+    """
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            for handler in self.handlers:
+                handler.flush()
+            return self.queue.get(block)
+
+    def stop(self) -> None:
+        super().stop()
+        for handler in self.handlers:
+            handler.flush()
+
+
+def init_config(log_file, level = logging.INFO, mode: str = 'sync', fmt: str = 'text', rate: int = 0):
+    """
+    Log to ``log_file``.
+
+    In ``queue`` mode records are put on a queue by the logging thread and written in batches by a background
+    :py:class:`BatchListener`, so no test thread waits for the disk. The caller's function and line are not
+    resolved in this mode, as walking the stack is the most expensive part of creating a record; the lookup is
+    switched off for the whole process until :py:func:`shutdown`.
+
+    :param log_file:    The log file
+    :param level:       The level written to the file
+    :param mode:        ``sync`` to write from the logging thread, ``queue`` to write from a background thread
+    :param fmt:         ``text`` or ``json`` for one JSON object per line
+    :param rate:        The records per second let through per logger below WARNING, 0 for no limit
+    :return:
+    """
+    global _listener, _srcfile
+
+    formatter = '%(asctime)s - %(name)-30s.%(funcName)-20s:%(lineno)-5d - %(levelname)-8s : %(message)s'
+    if mode == 'queue':
+        formatter = '%(asctime)s - %(name)-30s - %(threadName)-12s - %(levelname)-8s : %(message)s'
 
     # Init
     log_config = {
         "version":    1,
+        # Keep the loggers of modules imported by the conftest files before this runs
+        "disable_existing_loggers": False,
         "root":       {
             "handlers": ["file"],
             "level":    "DEBUG"
         },
         "handlers":   {
             "file":    {
-                "formatter": "std_out",
+                "formatter": fmt,
                 "class":     "logging.FileHandler",
                 "level":     level,
                 "filename":  log_file
             }
         },
         "formatters": {
-            "std_out": {
-                "format": '%(asctime)s - %(name)-30s.%(funcName)-20s:%(lineno)-5d - %(levelname)-8s : %(message)s'
+            "text": {
+                "format": formatter
+            },
+            "json": {
+                "()": JsonFormatter
             }
         },
     }
+    if rate:
+        log_config['filters'] = {'rate': {'()': RateLimitFilter, 'rate': rate}}
+        log_config['handlers']['file']['filters'] = ['rate']
+    if mode != 'queue':
+        dictConfig(log_config)
+        return
 
+    # The root logger only gets the QueueHandler, the file is written by the listener
+    log_config['root']['handlers'] = []
+    log_config['handlers'] = {}
+    log_config.pop('filters', None)
     dictConfig(log_config)
+
+    # Resolving the caller walks the stack for every record, skip it. The logging module only offers this switch
+    # process wide, so it is put back by shutdown()
+    if _srcfile is _UNSET:
+        _srcfile = logging._srcfile
+    logging._srcfile = None
+
+    handler = BatchFileHandler(log_file)
+    handler.setLevel(level)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(formatter))
+
+    # Filter on the logging thread, dropped records are never queued
+    records = queue.SimpleQueue()
+    sender = QueueHandler(records)
+    sender.setLevel(level)
+    if rate:
+        sender.addFilter(RateLimitFilter(rate))
+    logging.getLogger().addHandler(sender)
+
+    _listener = BatchListener(records, handler, respect_handler_level = True)
+    _listener.start()
+
+
+def shutdown() -> None:
+    """
+    Stop the background listener of ``queue`` mode, writing the records still queued, and switch the caller lookup
+    back on
+    """
+    global _listener, _srcfile
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _srcfile is not _UNSET:
+        logging._srcfile = _srcfile
+        _srcfile = _UNSET
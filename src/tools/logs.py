@@ -0,0 +1,85 @@
+import re
+import logging
+
+from typing import Dict, Iterable, Optional, Union
+
+_logger = logging.getLogger(__name__)
+
+# Bytes of a matched line kept
+PREVIEW = 200
+
+
+class LogMatcher:
+    """
+    Match several patterns against a stream of log chunks in one pass, reading no further than needed.
+
+    The patterns are combined into one alternation of named groups. Each match satisfies its pattern, which is then
+    dropped from the alternation, and the search resumes where the match started so a line can satisfy more than one
+    pattern. The stream is abandoned as soon as every pattern is satisfied. Only the unfinished line at the end of a
+    chunk is carried over, so memory is bounded by the chunk and line sizes however long the log is.
+
+    :param patterns:    Regexes by name
+    """
+    def __init__(self, patterns: Dict[str, Union[bytes, str]]):
+        self._patterns = {
+            name: pattern.encode() if isinstance(pattern, str) else pattern for name, pattern in patterns.items()
+        }
+        self._groups = {f'p{idx}': name for idx, name in enumerate(self._patterns)}
+        self.found: Dict[str, Optional[bytes]] = {name: None for name in self._patterns}
+        self._tail = b''
+        self._compile()
+
+    def _compile(self) -> None:
+        remaining = [
+            rb'(?P<' + group.encode() + rb'>' + self._patterns[name] + rb')'
+            for group, name in self._groups.items() if self.found[name] is None
+        ]
+        self._search = re.compile(b'|'.join(remaining), re.MULTILINE) if remaining else None
+
+    @property
+    def done(self) -> bool:
+        return self._search is None
+
+    def _scan(self, block: bytes) -> None:
+        position = 0
+        while self._search is not None and (match := self._search.search(block, position)):
+            start = block.rfind(b'\n', 0, match.start()) + 1
+            end = block.find(b'\n', match.end())
+            self.found[self._groups[match.lastgroup]] = block[start:end if end != -1 else len(block)][:PREVIEW]
+            self._compile()
+            position = match.start()
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Match the lines a chunk completes.
+
+        :param chunk:   The next bytes of the log
+        :return:
+        """
+        end = chunk.rfind(b'\n') + 1
+        if end:
+            self._scan(self._tail + chunk[:end])
+            self._tail = chunk[end:]
+        else:
+            self._tail += chunk
+
+    def match(self, chunks: Iterable[bytes]) -> Dict[str, Optional[bytes]]:
+        """
+        Feed chunks until every pattern is satisfied or the stream ends.
+
+        :param chunks:  The log stream
+        :return:        The first line matching each pattern, ``None`` for the ones never matched
+        """
+        for chunk in chunks:
+            self.feed(chunk)
+            if self.done:
+                break
+        else:
+            if self._tail:
+                self._scan(self._tail)
+                self._tail = b''
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+        _logger.info(f'Log matches: {self.found}')
+        return self.found
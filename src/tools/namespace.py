@@ -0,0 +1,79 @@
+import os
+import logging
+
+from typing import Dict, List, Union
+from src.tools.enums import ServiceType
+
+_logger = logging.getLogger(__name__)
+
+# Container label holding the namespace, set by the compose file
+LABEL = 'timberbrook.namespace'
+
+# The network of the un-namespaced stack
+NETWORK = 'timbernet'
+
+
+class Namespace:
+    """
+    Names of one compose stack, so several stacks (one per pytest-xdist worker, or per ``--namespace``) run side by
+    side: the compose project, the network, and the container names and hostnames, which all get the namespace as a
+    prefix. The default, empty namespace keeps the plain names.
+
+    The compose file is rendered with the namespaced names by :py:class:`~src.tools.topology.Topology`, along with the
+    ``outputs.json`` of the Splitters and the Agent pointing at the namespaced hostnames. The fixtures and compose read
+    the namespace from the environment (see :py:meth:`environ`).
+
+    :param name:    The namespace, empty for none
+    """
+    def __init__(self, name: str = ''):
+        self.name = name
+
+    @classmethod
+    def from_env(cls) -> 'Namespace':
+        """
+        The namespace set up by ``pytest_configure``
+        """
+        return cls(os.getenv('NAMESPACE', ''))
+
+    def __bool__(self) -> bool:
+        return bool(self.name)
+
+    def __call__(self, service: Union[str, ServiceType]) -> str:
+        """
+        The container name and hostname of a service, e.g. ``gw0_target_1``
+        """
+        service = getattr(service, 'value', service)
+        return f'{self.name}_{service}' if self.name else service
+
+    @property
+    def network(self) -> str:
+        return f'{NETWORK}_{self.name}' if self.name else NETWORK
+
+    @property
+    def project(self) -> str:
+        return f'timberbrook_{self.name}' if self.name else 'timberbrook'
+
+    def environ(self) -> Dict[str, str]:
+        """
+        The environment compose and the fixtures read the namespace from
+        """
+        return {
+            'NAMESPACE':            self.name,
+            'PREFIX':               self(''),
+            'NETWORK':              self.network,
+            'COMPOSE_PROJECT_NAME': self.project
+        }
+
+    def containers(self, client, *roles: ServiceType) -> List:
+        """
+        The containers of this namespace running one of ``roles``. The compose file always sets the namespace label,
+        empty for the default namespace, so the stacks running side by side are told apart from it as well.
+
+        :param client:  A DockerClient
+        :param roles:   The ``operation-mode`` labels
+        :return:
+        """
+        return [
+            container for container in client.containers.list(filters = {'label': f'{LABEL}={self.name}'})
+            if container.labels.get('operation-mode') in roles
+        ]
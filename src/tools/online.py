@@ -0,0 +1,209 @@
+import time
+import logging
+import threading
+import numpy as np
+
+from queue import Empty, Queue
+from pathlib import Path
+from concurrent.futures import Future
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Union
+from src.tools.index import CHUNK_SIZE, MasterIndex, split_lines
+from src.tools.filter import EventFilter
+from src.tools.order import ranges
+from src.tools.sequence import SequenceCheck, format_ranges
+from src.tools.index_cache import IndexCache
+from src.tools.profiler import phase
+from src.tools.latency import LatencyAnalyzer
+
+_logger = logging.getLogger(__name__)
+
+# Chunks waiting to be verified before the followers block, bounds the memory held when verification falls behind
+QUEUE_SIZE = 256
+
+# Seconds without a new chunk, once the agent is done, before the targets are taken to be complete
+IDLE = 5.0
+
+# Seconds between checks of the agent and the verifier
+POLL_INTERVAL = 0.1
+
+# Bytes of a line kept in an error
+PREVIEW = 80
+
+
+def follow(container, path: Union[str, Path]) -> Iterator[bytes]:
+    """
+    Stream a file in a container from its first byte as it grows (``tail -c +1 -F``), waiting for it to be created.
+
+    :param container:   A Container
+    :param path:        The location of the file in the container
+    :return:
+    """
+    result = container.exec_run(['tail', '-c', '+1', '-F', str(path)], stream = True, demux = True)
+    for stdout, _ in result.output:
+        if stdout:
+            yield stdout
+
+
+class OnlineCheck:
+    """
+    Incremental verification of target streams as they arrive.
+
+    Chunks are fed per target in arrival order; the lines they complete are counted in place against the
+    :py:class:`SequenceCheck` (when ``pattern`` fits the master) or the :py:class:`MasterIndex`, and the part of a
+    line still in flight is held back until the rest of it lands. The first chunk holding a duplicate or an invalid
+    event raises, so a failing run is decided without reading the rest of the targets. With an ``event_filter`` the
+    events it drops are split off the master as in :py:func:`event_check`, and the first one received raises too.
+    With a ``cache`` the master index comes from the :py:class:`IndexCache` when it was built before.
+    """
+    def __init__(self, master: Union[str, Path], names: Sequence[str], pattern: Optional[bytes] = None,
+                 chunk_size: int = CHUNK_SIZE, cache: Optional[IndexCache] = None,
+                 event_filter: Optional[EventFilter] = None):
+        with phase('index'):
+            if cache is not None:
+                self._sequence = cache.sequence_check(master, pattern, event_filter) if pattern else None
+                self._index = cache.master_index(master, event_filter = event_filter) \
+                    if self._sequence is None else None
+            else:
+                self._sequence = SequenceCheck.build(master, pattern, chunk_size, event_filter) if pattern else None
+                self._index = MasterIndex.build(master, chunk_size, event_filter = event_filter) \
+                    if self._sequence is None else None
+        self.size     = Path(master).stat().st_size
+        self.received = {name: 0 for name in names}
+        self._tails   = {name: b'' for name in names}
+
+    @property
+    def complete(self) -> bool:
+        """
+        Whether as many bytes as the master holds have been received
+        """
+        return sum(self.received.values()) >= self.size
+
+    def feed(self, name: str, chunk: bytes) -> None:
+        """
+        Verify the lines ``chunk`` completes in the stream of target ``name``.
+
+        :param name:    The target
+        :param chunk:   The next bytes of its stream
+        :return:
+        """
+        offset = self.received[name] - len(self._tails[name])
+        self.received[name] += len(chunk)
+        block = self._tails[name] + chunk
+        end = block.rfind(b'\n') + 1
+        self._tails[name] = block[end:]
+        if end:
+            self._check(name, offset, block[:end], True)
+
+    def _check(self, name: str, offset: int, block: bytes, terminated: bool) -> None:
+        where = f'{name} bytes {offset}-{offset + len(block)}'
+        if self._sequence is not None:
+            invalid = self._sequence.invalid
+            numbers = self._sequence.parse(block, terminated)
+            again = self._sequence.mark(numbers)
+            assert self._sequence.invalid == invalid, f'{self._sequence.invalid - invalid} invalid events in {where}'
+            leaked = self._sequence.leaks(numbers)
+            assert not len(leaked), f'Leaked events {format_ranges(ranges(np.unique(leaked)))} in {where}'
+            assert not len(again), f'Duplicate events {format_ranges(ranges(again))} in {where}'
+            return
+
+        lines = split_lines(block, terminated)
+        slots = self._index.update(lines, terminated)
+        found = np.flatnonzero(slots >= 0)
+        repeated = found[self._index.counts[slots[found]] > 1]
+        leaked = found[self._index.dropped[slots[found]]] if self._index.dropped is not None else found[:0]
+        for kind, bad in [('Invalid', np.flatnonzero(slots < 0)), ('Leaked', leaked), ('Duplicate', repeated)]:
+            if len(bad):
+                line = int(bad[0])
+                start = offset + sum(len(previous) + 1 for previous in lines[:line])
+                raise AssertionError(f'{kind} event at {name} offset {start}: {lines[line][:PREVIEW]!r}')
+
+    def close(self) -> Dict[str, Union[int, List]]:
+        """
+        Verify the unterminated line at the end of each stream, if any, and summarise.
+
+        :return:    The results, as :py:meth:`SequenceCheck.results` or :py:meth:`MasterIndex.results` return them
+        """
+        for name, tail in self._tails.items():
+            if tail:
+                self._check(name, self.received[name] - len(tail), tail, False)
+        return (self._sequence or self._index).results()
+
+
+class OnlineVerifier:
+    """
+    Run an :py:class:`OnlineCheck` over followed target streams in background threads.
+
+    A thread per target reads its stream into a bounded queue, and a single thread feeds the check. The check is
+    decided once the master's size has landed, on the first error, or once the agent is done and nothing has arrived
+    for :py:data:`IDLE` seconds. With a ``latency`` analyzer the chunks are also fed to it along with the time their
+    follower received them.
+    """
+    def __init__(self, check: OnlineCheck, sources: Dict[str, Iterable[bytes]],
+                 latency: Optional[LatencyAnalyzer] = None):
+        self.check   = check
+        self.latency = latency
+        self.results: Optional[Dict[str, Union[int, List]]] = None
+        self.error:   Optional[BaseException] = None
+        self._queue   = Queue(maxsize = QUEUE_SIZE)
+        self._stop    = threading.Event()
+        self._done    = threading.Event()
+        self._arrival = time.monotonic()
+        self._threads = [
+            threading.Thread(target = self._follow, args = (name, source), name = f'follow-{name}', daemon = True)
+            for name, source in sources.items()
+        ]
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+        threading.Thread(target = self._verify, name = 'online-verify', daemon = True).start()
+
+    def _follow(self, name: str, source: Iterable[bytes]) -> None:
+        try:
+            for chunk in source:
+                if self._done.is_set():
+                    break
+                self._queue.put((name, chunk, time.time_ns()))
+        except Exception as error:
+            # Hand the error to the verifying thread so it decides the run
+            self._queue.put((name, error, None))
+
+    def _verify(self) -> None:
+        start = time.monotonic()
+        try:
+            while not self.check.complete:
+                try:
+                    name, chunk, received = self._queue.get(timeout = POLL_INTERVAL)
+                except Empty:
+                    if self._stop.is_set():
+                        break
+                    continue
+                if isinstance(chunk, Exception):
+                    raise chunk
+                self._arrival = time.monotonic()
+                self.check.feed(name, chunk)
+                if self.latency is not None:
+                    self.latency.feed(name, chunk, received)
+            self.results = self.check.close()
+        except Exception as error:
+            self.error = error
+        finally:
+            self._done.set()
+            _logger.info(f'Online verification decided in {time.monotonic() - start:.3f}s: {self.error or self.results}')
+
+    def wait(self, agent: Future, idle: float = IDLE, timeout: Optional[float] = None) -> None:
+        """
+        Block until the verification is decided.
+
+        :param agent:   The agent run, the streams are only taken to be complete once it is done
+        :param idle:    Seconds without a new chunk after the agent is done before the targets are complete
+        :param timeout: Seconds to wait
+        :return:
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._done.wait(POLL_INTERVAL):
+            if agent.done() and time.monotonic() - self._arrival > idle:
+                self._stop.set()
+            if deadline is not None and time.monotonic() > deadline:
+                self.error = AssertionError(f'Online verification was not decided in {timeout}s')
+                self._done.set()
@@ -0,0 +1,215 @@
+import bisect
+import logging
+import numpy as np
+
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from src.tools.index import MasterIndex
+
+_logger = logging.getLogger(__name__)
+
+# Invalid lines kept per target for the report
+MAX_INVALID = 100
+
+# Bytes of a line kept in the report
+PREVIEW = 80
+
+
+class Run(NamedTuple):
+    """
+    A block of consecutive lines in a target holding consecutive master events
+    """
+    offset: int
+    end:    int
+    first:  int
+    last:   int
+    count:  int
+    head:   bytes
+
+
+def ranges(values: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Run-length encode integers into inclusive ``(start, end)`` ranges of consecutive values.
+
+    :param values:  The integers
+    :return:
+    """
+    values = np.unique(values)
+    if not len(values):
+        return []
+    breaks = np.flatnonzero(np.diff(values) != 1)
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [len(values) - 1]))
+    return [(int(values[start]), int(values[end])) for start, end in zip(starts, ends)]
+
+
+class _Target:
+    """
+    Order tracking state of a single target stream
+    """
+    def __init__(self, name: str):
+        self.name    = name
+        self.offset  = 0
+        self.runs: List[Run] = []
+        self.current: Optional[Run] = None
+        self.invalid = 0
+        self.torn: List[Tuple[int, bytes]] = []
+
+    def close(self) -> None:
+        if self.current is not None:
+            self.runs.append(self.current)
+            self.current = None
+
+
+class OrderCheck:
+    """
+    Order aware verification of several target streams against the master event order.
+
+    Each target is cut into *runs*, blocks of lines holding consecutive master events, as its lines are counted. A
+    target written in order is one run per chunk the splitter sent it, with master line numbers increasing from run
+    to run. Once all streams are read, the heaviest chain of runs that is in order forms the backbone of each target
+    and the runs outside of it are displaced. Each displaced block is reported with its byte offset, the events it
+    holds and the offset in the target where it belonged.
+    """
+    def __init__(self, index: MasterIndex, names: Sequence[str]):
+        assert index.positions is not None, 'The MasterIndex must be built with positions'
+        self._index   = index
+        self._targets = [_Target(name) for name in names]
+
+    def update(self, target: int, lines: Sequence[bytes], terminated: bool, slots: np.ndarray) -> None:
+        """
+        Track the order of a batch of lines that were counted by :py:meth:`MasterIndex.update`.
+
+        :param target:      The index of the target stream
+        :param lines:       The line contents (without terminators)
+        :param terminated:  Whether the lines ended in a newline
+        :param slots:       The slots returned by :py:meth:`MasterIndex.update` for the lines
+        :return:
+        """
+        state = self._targets[target]
+        lengths = np.fromiter(map(len, lines), dtype = np.int64, count = len(lines)) + int(terminated)
+        ends = state.offset + np.cumsum(lengths)
+        offsets = ends - lengths
+        state.offset += int(lengths.sum())
+
+        bad = np.flatnonzero(slots < 0)
+        state.invalid += len(bad)
+        for idx in bad[:max(MAX_INVALID - len(state.torn), 0)]:
+            state.torn.append((int(offsets[idx]), lines[idx][:PREVIEW]))
+
+        good = np.flatnonzero(slots >= 0)
+        if not len(good):
+            return
+        positions = self._index.positions[slots[good]]
+
+        # A run breaks wherever the next line is not the next master event
+        previous = np.concatenate(([-2 if state.current is None else state.current.last], positions[:-1]))
+        starts = np.flatnonzero(positions != previous + 1)
+        bounds = np.concatenate((starts, [len(positions)]))
+
+        if bounds[0]:
+            # The batch continues the open run
+            stop = bounds[0] - 1
+            state.current = state.current._replace(
+                end   = int(ends[good[stop]]),
+                last  = int(positions[stop]),
+                count = state.current.count + int(bounds[0])
+            )
+        for start, stop in zip(bounds[:-1], bounds[1:] - 1):
+            state.close()
+            state.current = Run(
+                offset = int(offsets[good[start]]),
+                end    = int(ends[good[stop]]),
+                first  = int(positions[start]),
+                last   = int(positions[stop]),
+                count  = int(stop - start + 1),
+                head   = lines[good[start]][:PREVIEW]
+            )
+
+    @staticmethod
+    def _backbone(runs: Sequence[Run]) -> List[int]:
+        """
+        Find the chain of runs, in file order and with increasing master line numbers, holding the most events.
+
+        :return:    The indexes of the runs in the chain
+        """
+        lasts = sorted({run.last for run in runs})
+        tree = [(0, -1)] * (len(lasts) + 1)
+        scores, previous = [], []
+        for idx, run in enumerate(runs):
+            # Best chain whose last event is before the first event of this run (Fenwick prefix maximum)
+            best, key = (0, -1), bisect.bisect_left(lasts, run.first)
+            while key > 0:
+                best = max(best, tree[key])
+                key -= key & -key
+            scores.append(best[0] + run.count)
+            previous.append(best[1])
+
+            key = bisect.bisect_left(lasts, run.last) + 1
+            while key < len(tree):
+                tree[key] = max(tree[key], (scores[idx], idx))
+                key += key & -key
+
+        chain, idx = [], max(range(len(runs)), key = scores.__getitem__, default = -1)
+        while idx >= 0:
+            chain.append(idx)
+            idx = previous[idx]
+        return chain[::-1]
+
+    @staticmethod
+    def _blocks(runs: Sequence[Run], chain: Sequence[int]) -> List[Run]:
+        """
+        Merge the runs outside of the backbone into blocks, neighbouring runs that stay in order form one block.
+
+        :return:    The displaced blocks in file order
+        """
+        blocks, inside, previous = [], set(chain), None
+        for idx, run in enumerate(runs):
+            if idx in inside:
+                previous = None
+            elif previous is not None and previous.last < run.first:
+                previous = previous._replace(end = run.end, last = run.last, count = previous.count + run.count)
+                blocks[-1] = previous
+            else:
+                blocks.append(run)
+                previous = run
+        return blocks
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Close every stream and compile the report. Master line numbers in the report start at 1.
+
+        :return:    ``results`` as returned by :py:meth:`MasterIndex.results`, the ``displaced`` blocks, the
+                    ``missing`` and ``duplicate`` line ranges and the ``invalid`` lines of each target
+        """
+        displaced = []
+        for state in self._targets:
+            state.close()
+            chain = self._backbone(state.runs)
+            backbone = [state.runs[idx] for idx in chain]
+            lasts = [run.last for run in backbone]
+            for run in self._blocks(state.runs, chain):
+                before = bisect.bisect_left(lasts, run.first)
+                displaced.append({
+                    'target':          state.name,
+                    'offset':          run.offset,
+                    'bytes':           run.end - run.offset,
+                    'events':          (run.first + 1, run.last + 1),
+                    'count':           run.count,
+                    'head':            run.head.decode(errors = 'replace'),
+                    'expected_offset': backbone[before - 1].end if before else (backbone[0].offset if backbone else 0),
+                    'after_event':     backbone[before - 1].last + 1 if before else None
+                })
+
+        counts, positions = self._index.counts, self._index.positions
+        return {
+            'results':   self._index.results(),
+            'displaced': displaced,
+            'missing':   [(start + 1, end + 1) for start, end in ranges(positions[counts == 0])],
+            'duplicate': [(start + 1, end + 1) for start, end in ranges(positions[counts > 1])],
+            'invalid':   {
+                state.name: {
+                    'count': state.invalid,
+                    'lines': [(offset, line.decode(errors = 'replace')) for offset, line in state.torn]
+                } for state in self._targets if state.invalid
+            }
+        }
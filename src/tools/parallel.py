@@ -0,0 +1,220 @@
+import os
+import logging
+import numpy as np
+
+from pathlib import Path
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import IO, Callable, Dict, List, Optional, Tuple, Union
+from src.tools.index import CHUNK_SIZE, MasterIndex, digest, interleave, read_chunks, split_lines
+
+_logger = logging.getLogger(__name__)
+
+# Hash tasks in flight per worker before the reader waits, bounds the memory held by queued blocks
+BACKLOG = 2
+
+# State of the shard owned by a worker process
+_parts: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+_index: Optional[MasterIndex] = None
+
+
+def _partition(keys: np.ndarray, shards: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group line positions by the shard owning their digest.
+
+    :return:    The positions ordered by shard and the bounds of each shard in that order
+    """
+    shard = (keys % np.uint64(shards)).astype(np.intp)
+    order = np.argsort(shard, kind = 'stable')
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(shard, minlength = shards))))
+    return order, bounds
+
+
+def _hash_master(block: bytes, terminated: bool, offset: int,
+                 shards: int) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Hash a block of master lines and split the digests, offsets and lengths by shard.
+    """
+    lines = split_lines(block, terminated)
+    keys = digest(lines, terminated)
+    lengths = np.fromiter(map(len, lines), dtype = np.uint32, count = len(lines)) + np.uint32(terminated)
+    offsets = np.concatenate((np.zeros(1, dtype = np.uint64), np.cumsum(lengths[:-1], dtype = np.uint64)))
+    offsets += np.uint64(offset)
+
+    order, bounds = _partition(keys, shards)
+    return [
+        (keys[positions], offsets[positions], lengths[positions])
+        for positions in (order[bounds[shard]:bounds[shard + 1]] for shard in range(shards))
+    ]
+
+
+def _hash_target(block: bytes, terminated: bool, shards: int,
+                 collisions: np.ndarray) -> List[Tuple[np.ndarray, Dict[int, bytes], bool]]:
+    """
+    Hash a block of received lines and split the digests by shard, along with the exact lines of any digest that
+    needs a byte for byte comparison.
+    """
+    lines = split_lines(block, terminated)
+    keys = digest(lines, terminated)
+
+    order, bounds = _partition(keys, shards)
+    result = []
+    for shard in range(shards):
+        positions = order[bounds[shard]:bounds[shard + 1]]
+        exact = {}
+        if len(collisions):
+            exact = {
+                int(idx): lines[positions[idx]] for idx in np.flatnonzero(np.isin(keys[positions], collisions))
+            }
+        result.append((keys[positions], exact, terminated))
+    return result
+
+
+def _add_master(keys: np.ndarray, offsets: np.ndarray, lengths: np.ndarray) -> None:
+    _parts.append((keys, offsets, lengths))
+
+
+def _seal(master: Union[str, Path]) -> np.ndarray:
+    global _index
+    keys, offsets, lengths = (np.concatenate(part) for part in zip(*_parts)) if _parts else (
+        np.empty(0, dtype = np.uint64), np.empty(0, dtype = np.uint64), np.empty(0, dtype = np.uint32)
+    )
+    _parts.clear()
+    _index = MasterIndex.from_digests(master, keys, lengths, offsets)
+    return _index.collisions
+
+
+def _count(keys: np.ndarray, exact: Dict[int, bytes], terminated: bool) -> None:
+    _index.count(_index.find(keys, exact, terminated))
+
+
+def _results() -> Dict[str, int]:
+    return _index.results()
+
+
+class ShardedVerifier:
+    """
+    Verify received events on a pool of processes, each owning the shard of the master index whose digests fall
+    into it.
+
+    Files are read in large blocks by the calling process and hashed on the pool. The digests of every block are
+    routed to the process owning their shard, which counts them, and the per-shard results are summed at the end.
+    """
+    def __init__(self, master: Union[str, Path], workers: Optional[int] = None, chunk_size: int = CHUNK_SIZE):
+        self.master     = master
+        self.chunk_size = chunk_size
+        self.shards     = workers or os.cpu_count()
+        self._collisions = np.empty(0, dtype = np.uint64)
+        self._pool = [ProcessPoolExecutor(max_workers = 1) for _ in range(self.shards)]
+        self._next = 0
+
+    def __enter__(self) -> 'ShardedVerifier':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for worker in self._pool:
+            worker.shutdown()
+
+    def _submit(self, func, *args) -> Future:
+        """
+        Submit a stateless task to the next worker in turn
+        """
+        worker = self._pool[self._next]
+        self._next = (self._next + 1) % self.shards
+        return worker.submit(func, *args)
+
+    @staticmethod
+    def _drain(pending: deque, limit: int, route: Callable) -> None:
+        """
+        Route the parts of the oldest hash tasks to their shards until at most ``limit`` are pending
+        """
+        while len(pending) > limit:
+            for shard, part in enumerate(pending.popleft().result()):
+                route(shard, part)
+
+    def build(self) -> None:
+        """
+        Hash the master file on the pool and build each shard of the index in its owning process.
+
+        :return:
+        """
+        _logger.info(f'Building {self.shards} master index shards...')
+
+        def route(shard: int, part: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+            self._pool[shard].submit(_add_master, *part)
+
+        pending, offset = deque(), 0
+        with open(self.master, mode = 'rb') as source:
+            for block, terminated in read_chunks(source, self.chunk_size):
+                pending.append(self._submit(_hash_master, block, terminated, offset, self.shards))
+                offset += len(block)
+                self._drain(pending, BACKLOG * self.shards, route)
+        self._drain(pending, 0, route)
+
+        sealed = [worker.submit(_seal, self.master) for worker in self._pool]
+        self._collisions = np.concatenate([future.result() for future in sealed])
+
+    def feed(self, *files: IO[bytes]) -> None:
+        """
+        Read the files round-robin in large blocks and count their events on the shard owners.
+
+        :arg files: The file descriptors to verify
+        :return:
+        """
+        counted = []
+
+        def route(shard: int, part: Tuple[np.ndarray, Dict[int, bytes], bool]):
+            counted.append(self._pool[shard].submit(_count, *part))
+
+        pending = deque()
+        for _, block, terminated in interleave(files, self.chunk_size, reader = read_chunks):
+            pending.append(self._submit(_hash_target, block, terminated, self.shards, self._collisions))
+            self._drain(pending, BACKLOG * self.shards, route)
+            counted = self._reap(counted)
+        self._drain(pending, 0, route)
+
+        for future in counted:
+            future.result()
+
+    @staticmethod
+    def _reap(futures: List[Future]) -> List[Future]:
+        """
+        Raise the error of any finished task and return the ones still running
+        """
+        running = []
+        for future in futures:
+            if future.done():
+                future.result()
+            else:
+                running.append(future)
+        return running
+
+    def results(self) -> Dict[str, int]:
+        """
+        Sum the ``valid``/``duplicate``/``missing``/``invalid`` results of every shard.
+
+        :return:
+        """
+        results = {}
+        for result in [worker.submit(_results) for worker in self._pool]:
+            for key, value in result.result().items():
+                results[key] = results.get(key, 0) + value
+        return results
+
+
+def sharded_check(master: Union[str, Path], *files: IO[bytes], workers: Optional[int] = None) -> Dict[str, int]:
+    """
+    Count the events received in ``files`` against ``master`` on a pool of shard owning processes.
+
+    :param master:  The location of the Master file
+    :arg files:     The file descriptors to verify
+    :param workers: The number of processes (and shards), defaults to the number of CPUs
+    :return:        The ``valid``/``duplicate``/``missing``/``invalid`` results
+    """
+    with ShardedVerifier(master, workers) as verifier:
+        verifier.build()
+        verifier.feed(*files)
+        return verifier.results()
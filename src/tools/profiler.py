@@ -0,0 +1,233 @@
+import sys
+import json
+import time
+import pytest
+import cProfile
+import logging
+import resource
+import tracemalloc
+
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+from prettytable import PrettyTable
+
+_logger = logging.getLogger(__name__)
+
+# What is measured, each level adding to the previous one
+OFF      = 'off'
+TIME     = 'time'
+MEMORY   = 'memory'
+CPROFILE = 'cprofile'
+LEVELS   = [OFF, TIME, MEMORY, CPROFILE]
+
+# The session fixtures profiled by default
+FIXTURES = ('build', 'start', 'run')
+
+# ru_maxrss is in kilobytes on Linux, bytes on macOS
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# The profiler the phases are recorded by, see :py:func:`phase`
+_active: Optional['PhaseProfiler'] = None
+
+
+def _rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+
+
+class _Phase:
+    def __init__(self, name: str, node: str, traced: int):
+        self.name  = name
+        self.node  = node
+        self.wall  = time.perf_counter()
+        self.cpu   = time.process_time()
+        self.start = traced
+        self.peak  = traced
+        self.profile: Optional[cProfile.Profile] = None
+
+
+class PhaseProfiler:
+    """
+    A pytest plugin timing the phases of a session: the setup and teardown of the session and class fixtures in
+    ``fixtures`` (the image build, compose up and down, the agent transfer) and the phases the tools mark with
+    :py:func:`phase` (master indexing, verification).
+
+    Each phase records its wall and CPU time (of the whole process, so the threads it waits on count too) and the
+    high water mark of the process RSS, which cost a few system calls per phase and are meant to be left on. From the
+    ``memory`` level on the peak of the Python allocations during the phase is traced with :py:mod:`tracemalloc`,
+    which slows allocation heavy code down, and at the ``cprofile`` level the outermost phases are also run under
+    :py:mod:`cProfile`, with a ``.prof`` dump each.
+
+    The phases are added to the ``user_properties`` of the test they ran in, which land in the junit-xml, and written
+    to a JSON summary when the session finishes.
+
+    :param level:       ``time``, ``memory`` or ``cprofile``
+    :param output:      The JSON summary
+    :param dump_dir:    Where the ``.prof`` dumps go
+    :param fixtures:    The names of the fixtures to profile
+    """
+    def __init__(self, level: str, output: Union[str, Path], dump_dir: Union[str, Path, None] = None,
+                 fixtures: Sequence[str] = FIXTURES):
+        self.level    = level
+        self.output   = Path(output)
+        self.dump_dir = Path(dump_dir) if dump_dir is not None else self.output.parent
+        self.fixtures = set(fixtures)
+        self.records: List[Dict[str, Any]] = []
+        self._stack:  List[_Phase] = []
+        self._item = None
+        self._memory = LEVELS.index(level) >= LEVELS.index(MEMORY)
+
+    def install(self) -> None:
+        global _active
+        _active = self
+        if self._memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def uninstall(self) -> None:
+        global _active
+        if _active is self:
+            _active = None
+        if self._memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _traced(self) -> int:
+        if not self._memory:
+            return 0
+        current, peak = tracemalloc.get_traced_memory()
+        # The enclosing phase keeps the peak reached so far before it is reset for this one
+        if self._stack:
+            self._stack[-1].peak = max(self._stack[-1].peak, peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        return current
+
+    def begin(self, name: str, node: str = '') -> None:
+        """
+        Start timing a phase. Phases nest, each one ends before the one it started in.
+
+        :param name:    The phase
+        :param node:    The pytest node it runs for
+        :return:
+        """
+        record = _Phase(name, node, self._traced())
+        if self.level == CPROFILE and not self._stack:
+            record.profile = cProfile.Profile()
+            record.profile.enable()
+        self._stack.append(record)
+
+    def end(self) -> Dict[str, Any]:
+        """
+        Stop timing the innermost phase and record it.
+
+        :return:    The record
+        """
+        wall, cpu = time.perf_counter(), time.process_time()
+        record = self._stack[-1]
+        if record.profile is not None:
+            record.profile.disable()
+        if self._memory:
+            record.peak = max(record.peak, tracemalloc.get_traced_memory()[1])
+        self._stack.pop()
+        if self._stack:
+            self._stack[-1].peak = max(self._stack[-1].peak, record.peak)
+
+        result = {
+            'phase': record.name,
+            'node':  record.node,
+            'wall':  wall - record.wall,
+            'cpu':   cpu - record.cpu,
+            'rss':   _rss()
+        }
+        if self._memory:
+            result['traced_peak'] = record.peak - record.start
+        if record.profile is not None:
+            self.dump_dir.mkdir(parents = True, exist_ok = True)
+            dump = Path(self.dump_dir, f'{record.name.replace(":", "_")}_{len(self.records)}.prof')
+            record.profile.dump_stats(dump)
+            result['profile'] = str(dump)
+        self.records.append(result)
+
+        if self._item is not None:
+            self._item.user_properties.append((
+                f'profile:{record.name}',
+                ' '.join(f'{key}={value:.3f}' if isinstance(value, float) else f'{key}={value}'
+                         for key, value in result.items() if key not in ('phase', 'node', 'profile'))
+            ))
+        return result
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        The records totalled by phase: the count, the wall and CPU time, and the highest peaks
+        """
+        totals: Dict[str, Dict[str, Any]] = {}
+        for record in self.records:
+            total = totals.setdefault(record['phase'], {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'rss': 0})
+            total['count'] += 1
+            total['wall']  += record['wall']
+            total['cpu']   += record['cpu']
+            total['rss']    = max(total['rss'], record['rss'])
+            if 'traced_peak' in record:
+                total['traced_peak'] = max(total.get('traced_peak', 0), record['traced_peak'])
+        return totals
+
+    @staticmethod
+    def table(summary: Dict[str, Dict[str, Any]]) -> PrettyTable:
+        table = PrettyTable(field_names = ['phase', 'count', 'wall (s)', 'cpu (s)', 'rss (MiB)', 'traced peak (MiB)'])
+        for name, total in sorted(summary.items(), key = lambda item: -item[1]['wall']):
+            table.add_row([
+                name, total['count'], f'{total["wall"]:.3f}', f'{total["cpu"]:.3f}', f'{total["rss"] / 2 ** 20:.1f}',
+                f'{total["traced_peak"] / 2 ** 20:.1f}' if 'traced_peak' in total else '-'
+            ])
+        return table
+
+    def pytest_runtest_protocol(self, item):
+        self._item = item
+
+    @pytest.hookimpl(hookwrapper = True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        if fixturedef.argname not in self.fixtures:
+            yield
+            return
+
+        node = request.node.nodeid
+        self.begin(f'{fixturedef.argname}:setup', node)
+        try:
+            yield
+        finally:
+            self.end()
+
+        # Added last, so run first when the fixture is finished, right before its own teardown
+        fixturedef.addfinalizer(lambda: self.begin(f'{fixturedef.argname}:teardown', node))
+
+    def pytest_fixture_post_finalizer(self, fixturedef, request):
+        if fixturedef.argname in self.fixtures and self._stack and \
+                self._stack[-1].name == f'{fixturedef.argname}:teardown':
+            self.end()
+
+    def pytest_sessionfinish(self, session):
+        while self._stack:
+            self.end()
+        summary = self.summary()
+        self.output.parent.mkdir(parents = True, exist_ok = True)
+        self.output.write_text(json.dumps({'level': self.level, 'phases': summary, 'records': self.records},
+                                          indent = 4))
+        if summary:
+            _logger.info(f'Session phases:\n{self.table(summary)}')
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Time a phase with the installed :py:class:`PhaseProfiler`, a no-op without one
+
+    :param name:    The phase
+    :return:
+    """
+    if _active is None:
+        yield
+        return
+    _active.begin(name, getattr(_active._item, 'nodeid', ''))
+    try:
+        yield
+    finally:
+        _active.end()
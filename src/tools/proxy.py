@@ -0,0 +1,308 @@
+import re
+import json
+import time
+import random
+import signal
+import socket
+import asyncio
+import logging
+import argparse
+
+from typing import Any, Callable, Dict, NamedTuple, Optional, Sequence, Set, Tuple
+
+# Only the standard library, so the compose stack runs this file on its own in a stock Python image
+
+_logger = logging.getLogger(__name__)
+
+LOCALHOST = '127.0.0.1'
+
+# Bytes read from a socket at a time (the Node stream default)
+READ_SIZE = 64 * 1024
+
+# Seconds of bandwidth written at a time, so a capped stream flows evenly instead of in bursts
+QUANTUM = 0.01
+
+_SIZES = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+_TIMES = {'': 1.0, 's': 1.0, 'ms': 1e-3, 'us': 1e-6}
+
+
+def _size(value: str) -> int:
+    number, unit = re.fullmatch(r'([\d.]+)([kmg]?)i?b?', value.lower()).groups()
+    return int(float(number) * _SIZES[unit])
+
+
+def _seconds(value: str) -> float:
+    number, unit = re.fullmatch(r'([\d.]+)(s|ms|us)?', value.lower()).groups()
+    return float(number) * _TIMES[unit or '']
+
+
+class Impairment(NamedTuple):
+    """
+    What a :py:class:`ThrottlingProxy` does to the stream it forwards.
+
+    :param bandwidth:   Bytes per second, 0 for no cap
+    :param latency:     Seconds each chunk is held before it is forwarded
+    :param jitter:      Up to this many seconds more or less latency per chunk, drawn uniformly
+    :param stall:       Seconds the stream stops for, every ``stall_every`` seconds
+    :param stall_every: Seconds between the stalls
+    :param segment:     Forward each chunk in writes of 1 to this many bytes, splitting the events, 0 for whole chunks
+    :param buffer:      Bytes held before the proxy stops reading, which is what pushes back on the sender
+    :param seed:        The random seed of the jitter and the segment sizes
+    """
+    bandwidth:   int   = 0
+    latency:     float = 0.0
+    jitter:      float = 0.0
+    stall:       float = 0.0
+    stall_every: float = 0.0
+    segment:     int   = 0
+    buffer:      int   = READ_SIZE
+    seed:        int   = 0
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Impairment':
+        """
+        Parse ``key=value`` pairs separated by commas, e.g. ``bandwidth=1M,latency=5ms,jitter=2ms,stall=500ms,
+        stall_every=2s``. Sizes take a K, M or G suffix (powers of 1024), times a s, ms or us suffix.
+
+        :param spec:    The impairment
+        :return:
+        """
+        values = {}
+        for item in filter(None, spec.split(',')):
+            key, _, value = item.partition('=')
+            if key not in cls._fields:
+                raise ValueError(f'Unknown impairment {key!r} in {spec!r}, one of {", ".join(cls._fields)}')
+            kind = cls.__annotations__[key]
+            try:
+                values[key] = int(value) if key == 'seed' else _size(value) if kind is int else _seconds(value)
+            except (AttributeError, ValueError):
+                raise ValueError(f'Invalid {key} {value!r} in {spec!r}')
+        return cls(**values)
+
+
+def impairments(values: Sequence[str], targets: Sequence[str]) -> Dict[str, str]:
+    """
+    Resolve ``[<target>:]<spec>`` options to the impairment of each Target, a spec without a Target applying to all
+
+    :param values:  The options, later ones win
+    :param targets: The Target names
+    :return:        The spec by Target, each one checked with :py:meth:`Impairment.parse`
+    """
+    resolved = {}
+    for value in values:
+        target, _, spec = value.rpartition(':')
+        if target and target not in targets:
+            raise ValueError(f'Cannot impair {target}, not one of {", ".join(targets)}')
+        Impairment.parse(spec)
+        resolved.update({name: spec for name in ([target] if target else targets)})
+    return resolved
+
+
+class ThrottlingProxy:
+    """
+    A TCP proxy forwarding to ``upstream`` with an :py:class:`Impairment`, to play a slow consumer.
+
+    Each connection is relayed to a connection of its own upstream. What is received is held, in order, until it is
+    due (the latency and jitter), then written upstream in segments at the capped bandwidth and waited on until it
+    drains, with the stream stopping for the stalls. Once ``buffer`` bytes are held the proxy stops reading, so the
+    kernel buffers fill and the sender sees its writes not flush. What comes back from upstream is relayed untouched.
+
+    The counters are kept over all the connections: :py:attr:`held_peak` is the most bytes held at once, and
+    :py:attr:`paused` the seconds reading was stopped for.
+
+    :param upstream:    The host and port to forward to
+    :param impairment:  What to do to the stream
+    :param name:        Names the proxy in its log lines
+    :param log:         Where the connections and their counters are logged, the module logger by default
+    """
+    def __init__(self, upstream: Optional[Tuple[str, int]], impairment: Impairment = Impairment(), name: str = '',
+                 log: Optional[Callable[[str], None]] = None):
+        self.upstream    = upstream
+        self.impairment  = impairment
+        self.name        = name
+        self.log         = log or _logger.info
+        self.connections = 0
+        self.received    = 0
+        self.sent        = 0
+        self.writes      = 0
+        self.held        = 0
+        self.held_peak   = 0
+        self.pauses      = 0
+        self.paused      = 0.0
+        self.stalls      = 0
+        self.stalled     = 0.0
+        self._rng        = random.Random(impairment.seed)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handlers: Set[asyncio.Task] = set()
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str = LOCALHOST, port: int = 0) -> int:
+        """
+        Listen on ``host`` and ``port`` (any free port by default). The receive buffer of the connections is cut down
+        to the impairment ``buffer``, or the kernel would take in megabytes before the sender noticed.
+
+        :return:    The port listened on
+        """
+        listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.impairment.buffer)
+        listener.bind((host, port))
+        self._server = await asyncio.start_server(self._handle, sock = listener)
+        return self.port
+
+    async def stop(self) -> None:
+        """
+        Stop listening and drop the connections still open
+        """
+        self._server.close()
+        for handler in self._handlers:
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions = True)
+        await self._server.wait_closed()
+
+    def counters(self) -> Dict[str, Any]:
+        return {
+            'proxy':       self.name,
+            'connections': self.connections,
+            'received':    self.received,
+            'sent':        self.sent,
+            'writes':      self.writes,
+            'held':        self.held,
+            'held_peak':   self.held_peak,
+            'pauses':      self.pauses,
+            'paused':      round(self.paused, 6),
+            'stalls':      self.stalls,
+            'stalled':     round(self.stalled, 6)
+        }
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._handlers.add(handler := asyncio.current_task())
+        self.log(f'client connected, forwarding to {self.upstream[0]}:{self.upstream[1]} with {self.impairment}')
+        upstream_writer = None
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(*self.upstream)
+            queue: asyncio.Queue = asyncio.Queue()
+            space = asyncio.Event()
+            await asyncio.gather(
+                self._receive(reader, queue, space),
+                self._send(upstream_writer, queue, space),
+                self._relay(upstream_reader, writer)
+            )
+        except asyncio.CancelledError:
+            # Dropped by stop(), the connection is closed below
+            pass
+        finally:
+            self._handlers.discard(handler)
+            for stream in (writer, upstream_writer):
+                if stream is not None:
+                    stream.close()
+            self.log(f'client disconnected {json.dumps(self.counters())}')
+
+    async def _receive(self, reader: asyncio.StreamReader, queue: asyncio.Queue, space: asyncio.Event) -> None:
+        loop, due = asyncio.get_running_loop(), 0.0
+        impairment = self.impairment
+        try:
+            while data := await reader.read(min(READ_SIZE, impairment.buffer)):
+                self.received += len(data)
+                self.held += len(data)
+                self.held_peak = max(self.held_peak, self.held)
+                delay = impairment.latency + (self._rng.uniform(-1, 1) * impairment.jitter if impairment.jitter else 0)
+                # TCP keeps the order, so a chunk is never due before the one ahead of it
+                due = max(due, loop.time() + max(delay, 0.0))
+                queue.put_nowait((due, data))
+
+                if self.held >= impairment.buffer:
+                    self.pauses += 1
+                    start = loop.time()
+                    while self.held >= impairment.buffer:
+                        space.clear()
+                        await space.wait()
+                    self.paused += loop.time() - start
+        finally:
+            queue.put_nowait(None)
+
+    async def _send(self, writer: asyncio.StreamWriter, queue: asyncio.Queue, space: asyncio.Event) -> None:
+        loop = asyncio.get_running_loop()
+        impairment = self.impairment
+        quantum = max(int(impairment.bandwidth * QUANTUM), 1) if impairment.bandwidth else 0
+        paced = loop.time()
+        stall_at = loop.time() + impairment.stall_every if impairment.stall else None
+        while (item := await queue.get()) is not None:
+            due, data = item
+            if (wait := due - loop.time()) > 0:
+                await asyncio.sleep(wait)
+            offset = 0
+            while offset < len(data):
+                if stall_at is not None and loop.time() >= stall_at:
+                    self.stalls += 1
+                    await asyncio.sleep(impairment.stall)
+                    self.stalled += impairment.stall
+                    stall_at = loop.time() + impairment.stall_every
+
+                size = self._rng.randint(1, impairment.segment) if impairment.segment else len(data)
+                size = min(size, quantum or size, len(data) - offset)
+                writer.write(data[offset:offset + size])
+                await writer.drain()
+                offset += size
+                self.sent += size
+                self.writes += 1
+                self.held -= size
+                space.set()
+
+                if impairment.bandwidth:
+                    paced = max(paced, loop.time()) + size / impairment.bandwidth
+                    if (wait := paced - loop.time()) > 0:
+                        await asyncio.sleep(wait)
+        writer.close()
+        await writer.wait_closed()
+
+    @staticmethod
+    async def _relay(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while data := await reader.read(READ_SIZE):
+            writer.write(data)
+            await writer.drain()
+
+
+def _address(value: str) -> Tuple[str, int]:
+    host, _, port = value.rpartition(':')
+    return host, int(port)
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    proxy = ThrottlingProxy(args.upstream, Impairment.parse(args.impair), args.name)
+    port = await proxy.start(*args.listen)
+    _logger.info(f'{args.name} listening on {args.listen[0]}:{port}')
+    stopped = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, stopped.set)
+    last = time.monotonic()
+    while not stopped.is_set():
+        try:
+            await asyncio.wait_for(stopped.wait(), args.report or None)
+        except asyncio.TimeoutError:
+            pass
+        if time.monotonic() - last >= args.report > 0:
+            _logger.info(json.dumps(proxy.counters()))
+            last = time.monotonic()
+    await proxy.stop()
+    _logger.info(json.dumps(proxy.counters()))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description = 'Forward TCP connections with a bandwidth cap, latency and stalls')
+    parser.add_argument('--listen', type = _address, default = ('0.0.0.0', 9997), help = 'host:port to listen on')
+    parser.add_argument('--upstream', type = _address, required = True, help = 'host:port to forward to')
+    parser.add_argument('--impair', default = '', help = 'The impairment, e.g. bandwidth=1M,latency=5ms')
+    parser.add_argument('--name', default = 'proxy', help = 'The name in the log lines')
+    parser.add_argument('--report', type = float, default = 10.0, help = 'Seconds between counter reports, 0 for none')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s %(message)s')
+    asyncio.run(_serve(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import re
+import mmap
+import random
+import logging
+import statistics
+
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+from src.tools.sequence import PATTERN
+
+_logger = logging.getLogger(__name__)
+
+# Corrupt lines listed in a report, the summary covers all of them
+MAX_LINES = 1000
+
+# Bytes of a line kept in the report
+PREVIEW = 80
+
+# Chunk sizes sampled for the median, it is exact up to this many torn lines
+RESERVOIR = 10000
+
+
+class _Grammar:
+    """
+    The compiled forms of an event line grammar.
+    """
+    def __init__(self, grammar: bytes):
+        # Every line that is not a whole event, found without looking at the good lines from Python
+        self.corrupt = re.compile(rb'^(?!(?:' + grammar + rb')$)[^\n]*', re.MULTILINE)
+        # The leftmost whole event ending a line, everything before it is the torn fragment
+        self.tail = re.compile(rb'(?:' + grammar + rb')\Z')
+        self.line = re.compile(rb'(?:' + grammar + rb')\n')
+        self.numbered = self.line.groups >= 1
+
+
+class _Sequence:
+    """
+    Byte length arithmetic of consecutive events ``prefix + str(number) + suffix + '\\n'``.
+    """
+    def __init__(self, fixed: int):
+        self.fixed = fixed
+
+    def length(self, first: int, stop: int) -> int:
+        """
+        The bytes taken by the events ``first`` up to ``stop`` (exclusive).
+        """
+        total, low = (stop - first) * self.fixed, first
+        while low < stop:
+            digits = len(str(low))
+            high = min(stop, 10 ** digits)
+            total += (high - low) * digits
+            low = high
+        return total
+
+
+class _Chunks:
+    """
+    Running count, min and max of the chunk sizes, and the median of a uniform sample of at most ``size`` of them
+    (reservoir sampling, seeded so a file always gets the same report), in memory that does not grow with the file.
+    """
+    def __init__(self, size: int = RESERVOIR):
+        self.size   = size
+        self.count  = 0
+        self.min    = None
+        self.max    = None
+        self.sample = []
+        self._rng   = random.Random(0)
+
+    def add(self, value: int) -> None:
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.sample) < self.size:
+            self.sample.append(value)
+        elif (slot := self._rng.randrange(self.count)) < self.size:
+            self.sample[slot] = value
+
+    def summary(self) -> Dict[str, Any]:
+        return {'count': self.count, 'min': self.min, 'median': statistics.median(self.sample), 'max': self.max}
+
+
+def _block_end(view: mmap.mmap, grammar: _Grammar, start: int, stop: int) -> Optional[int]:
+    """
+    Find where the block of consecutive events written from ``start`` ends, before ``stop``.
+
+    A line at offset ``x`` holding event ``m`` is in the block iff ``x`` is exactly where event ``m`` falls when every
+    event from the first one follows on, so the end is found by bisection over the offsets without reading the lines
+    in between.
+
+    :return:    The offset after the last event of the block
+    """
+    match = grammar.line.match(view, start)
+    if match is None or not grammar.numbered:
+        return None
+    first = int(match.group(1))
+    sequence = _Sequence(match.end() - start - len(match.group(1)))
+
+    def event_at(offset: int) -> Optional[re.Match]:
+        line = view.rfind(b'\n', start, offset) + 1 or start
+        found = grammar.line.match(view, line)
+        if found and line == start + sequence.length(first, int(found.group(1))):
+            return found
+        return None
+
+    low, high = match.end(), stop
+    end = match.end()
+    while low < high:
+        middle = (low + high) // 2
+        found = event_at(middle + 1)
+        if found is None:
+            high = middle
+        else:
+            end = max(end, found.end())
+            low = found.end()
+    return end
+
+
+def scan(path: Union[str, Path], grammar: bytes = PATTERN, max_lines: int = MAX_LINES) -> Dict[str, Any]:
+    """
+    Memory-map an events.log and find every line that breaks the event line ``grammar`` in one pass.
+
+    Each corrupt line is tied to its byte offset. When the line ends in a whole event, as
+    ``This is event This is event number 78085`` does, the offset where that event starts is the *tear*: the end of an
+    interrupted write. If the grammar's first group is a sequence number the write that landed at the tear is
+    measured up to the first break in the sequence, estimating the size of the chunk that caused the corruption; the
+    chunk sizes are summarised in constant memory, the median from a sample of :py:data:`RESERVOIR` of them.
+
+    :param path:        The location of the events.log
+    :param grammar:     Regex of a single event line, with the sequence number as its first group
+    :param max_lines:   The number of corrupt lines listed in the report
+    :return:            The report
+    """
+    compiled = _Grammar(grammar)
+    report = {'file': str(path), 'bytes': 0, 'grammar': grammar.decode(), 'corrupt': 0, 'torn': 0, 'lines': []}
+    chunks = _Chunks()
+
+    with open(path, mode = 'rb') as file:
+        size = Path(path).stat().st_size
+        report['bytes'] = size
+        if not size:
+            return report
+
+        with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as view:
+            for match in compiled.corrupt.finditer(view):
+                start, end = match.span()
+                if start == size:
+                    # The empty match after the final newline is not a line
+                    break
+
+                report['corrupt'] += 1
+                line = match.group()
+                entry = {
+                    'offset':     start,
+                    'length':     end - start,
+                    'line':       line[:PREVIEW].decode(errors = 'replace'),
+                    'terminated': end < size
+                }
+                tail = compiled.tail.search(line)
+                if tail is not None and tail.start() > 0:
+                    report['torn'] += 1
+                    tear = start + tail.start()
+                    entry.update(tear = tear, fragment = line[:tail.start()][:PREVIEW].decode(errors = 'replace'))
+
+                    # The torn line's event plus the consecutive events written with it
+                    stop = _block_end(view, compiled, end + 1, size) if end < size else None
+                    if stop is not None:
+                        entry['chunk_bytes'] = stop - tear
+                        chunks.add(stop - tear)
+                if len(report['lines']) < max_lines:
+                    report['lines'].append(entry)
+
+    if chunks.count:
+        report['chunks'] = chunks.summary()
+    _logger.info(f'Scanned {path}: {report["corrupt"]} corrupt lines, {report["torn"]} torn')
+    return report
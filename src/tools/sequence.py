@@ -0,0 +1,253 @@
+import re
+import logging
+import numpy as np
+
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Tuple, Union
+from src.tools.index import CHUNK_SIZE, interleave, read_chunks, split_lines
+from src.tools.filter import EventFilter
+
+_logger = logging.getLogger(__name__)
+
+# Shape of the agent events, the only group is the sequence number (no leading zeros so each number is one line)
+PATTERN = rb'This is event number (0|[1-9]\d*)'
+
+# Bitmap bytes unpacked at a time when encoding ranges
+BLOCK = 1024 * 1024
+
+# The five bitmaps take 5 bits per sequence number in the span, the generic index about 9 bytes per event, so past
+# this many numbers in the span per master event the generic index is the smaller one
+SPARSE = 14
+
+# Spans up to this many numbers always get the bitmaps, at most 640 KiB of them
+MIN_SPAN = 1 << 20
+
+# Set bits of every byte value
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype = np.uint8)
+
+
+def _compile(pattern: bytes) -> Tuple['re.Pattern', 're.Pattern']:
+    """
+    Compile the buffer wide and the single line form of an event pattern.
+    """
+    return re.compile(rb'^(?:' + pattern + rb')\n', re.MULTILINE), re.compile(pattern)
+
+
+def bit_ranges(bitmap: np.ndarray, size: int, base: int = 0) -> List[Tuple[int, int]]:
+    """
+    Run-length encode the set bits of a little endian packed bitmap into inclusive ``(start, end)`` ranges.
+
+    :param bitmap:  The packed bitmap
+    :param size:    The number of bits in use
+    :param base:    The value of bit 0
+    :return:
+    """
+    result, start, previous = [], None, 0
+    for offset in range(0, len(bitmap), BLOCK):
+        bits = np.unpackbits(bitmap[offset:offset + BLOCK], bitorder = 'little')[:size - offset * 8]
+        for idx in np.flatnonzero(np.diff(bits, prepend = np.uint8(previous))):
+            if bits[idx]:
+                start = base + offset * 8 + int(idx)
+            else:
+                result.append((start, base + offset * 8 + int(idx) - 1))
+        previous = bits[-1] if len(bits) else previous
+    if previous:
+        result.append((start, base + size - 1))
+    return result
+
+
+class SequenceCheck:
+    """
+    Verification fast path for events carrying a sequence number.
+
+    The numbers of a whole buffer are parsed at once into an integer array and marked off in packed bitmaps of the
+    expected, seen and duplicated events; no line is hashed. Missing and duplicate events come back as ranges of
+    sequence numbers.
+
+    Use :py:meth:`build`, which returns ``None`` when a master line does not match the pattern, or when the numbers
+    are too sparse for bitmaps sized by their span, so the caller can fall back to the generic
+    :py:class:`MasterIndex`. Received lines that do not match are not master events and are
+    counted as invalid, exactly as the generic path would.
+
+    With an :py:class:`EventFilter` the master events it drops are kept out of the expected bitmap and in a dropped
+    one instead, and the ones received anyway are reported as ``leaked`` ranges.
+    """
+    def __init__(self, pattern: bytes, low: int, size: int):
+        self._buffer, self._line = _compile(pattern)
+        self.low      = low
+        self.size     = size
+        self.expected = np.zeros((size + 7) // 8, dtype = np.uint8)
+        self.seen     = np.zeros_like(self.expected)
+        self.repeated = np.zeros_like(self.expected)
+        self.dropped  = np.zeros_like(self.expected)
+        self.leaked   = np.zeros_like(self.expected)
+        self.filtered = False
+        self.invalid  = 0
+
+    @classmethod
+    def build(cls, master: Union[str, Path], pattern: bytes = PATTERN, chunk_size: int = CHUNK_SIZE,
+              event_filter: Optional[EventFilter] = None) -> Optional['SequenceCheck']:
+        """
+        Parse the master sequence numbers, if every master line matches ``pattern``.
+
+        :param master:          The location of the Master file
+        :param pattern:         The event pattern, its only group being the sequence number
+        :param chunk_size:      The number of bytes to read at a time
+        :param event_filter:    The splitter filter, split off the events it drops in the same pass
+        :return:                ``None`` if the master file does not follow the pattern or its numbers are sparser than
+                                :py:data:`SPARSE` per event
+        """
+        search, _ = _compile(pattern)
+        numbers, dropped = [], []
+        with open(master, mode = 'rb') as source:
+            for block, terminated in read_chunks(source, chunk_size):
+                found = search.findall(block)
+                if not terminated or len(found) != block.count(b'\n'):
+                    _logger.info(f'{master} does not follow {pattern}, using the generic verification')
+                    return None
+                numbers.append(np.fromiter(map(int, found), dtype = np.int64, count = len(found)))
+                if event_filter is not None:
+                    dropped.append(numbers[-1][event_filter.dropped(block)])
+
+        numbers = np.concatenate(numbers) if numbers else np.empty(0, dtype = np.int64)
+        low = int(numbers.min()) if len(numbers) else 0
+        span = int(numbers.max()) - low + 1 if len(numbers) else 0
+        if span > max(SPARSE * len(numbers), MIN_SPAN):
+            _logger.info(f'{master} has {len(numbers)} sequence numbers over a span of {span}, using the generic '
+                         f'verification')
+            return None
+        check = cls(pattern, low, span)
+        check._set(check.expected, numbers - low)
+        if event_filter is not None:
+            check.filtered = True
+            check._set(check.dropped, np.concatenate(dropped) - low if dropped else numbers)
+            check.expected &= ~check.dropped
+            _logger.info(f'{int(POPCOUNT[check.dropped].sum(dtype = np.int64))} master events are expected to be '
+                         f'dropped by the splitter filter')
+        _logger.info(f'Parsed {len(numbers)} sequence numbers from {master} ({low}-{low + check.size - 1})')
+        return check
+
+    @staticmethod
+    def _test(bitmap: np.ndarray, bits: np.ndarray) -> np.ndarray:
+        return ((bitmap[bits >> 3] >> (bits & 7).astype(np.uint8)) & 1).astype(bool)
+
+    @staticmethod
+    def _set(bitmap: np.ndarray, bits: np.ndarray) -> None:
+        np.bitwise_or.at(bitmap, bits >> 3, np.left_shift(1, bits & 7).astype(np.uint8))
+
+    def parse(self, block: bytes, terminated: bool = True) -> np.ndarray:
+        """
+        Parse the sequence numbers of a block of lines. Lines that do not match the pattern are counted as invalid.
+
+        :param block:       A block of lines from :py:func:`read_chunks`
+        :param terminated:  Whether the block ends in a newline
+        :return:            The sequence numbers
+        """
+        found = self._buffer.findall(block) if terminated else []
+        lines = block.count(b'\n') + (0 if terminated else 1)
+        if len(found) != lines:
+            # Only blocks holding a line that doesn't match are split up
+            found = []
+            for line in split_lines(block, terminated) if terminated else []:
+                match = self._line.fullmatch(line)
+                if match:
+                    found.append(match.group(1))
+            self.invalid += lines - len(found)
+        return np.fromiter(map(int, found), dtype = np.int64, count = len(found))
+
+    def mark(self, numbers: np.ndarray) -> np.ndarray:
+        """
+        Mark received sequence numbers off in the bitmaps.
+
+        :param numbers: The sequence numbers
+        :return:        The numbers among them that have now been received more than once
+        """
+        bits = numbers - self.low
+        inside = (bits >= 0) & (bits < self.size)
+        bits, counts = np.unique(bits[inside], return_counts = True)
+        expected = self._test(self.expected, bits)
+        leaked = ~expected & self._test(self.dropped, bits)
+        self._set(self.leaked, bits[leaked])
+        self.invalid += int(np.count_nonzero(~inside) + counts[~expected & ~leaked].sum())
+
+        bits, counts = bits[expected], counts[expected]
+        again = bits[self._test(self.seen, bits) | (counts > 1)]
+        self._set(self.repeated, again)
+        self._set(self.seen, bits)
+        return again + self.low
+
+    def leaks(self, numbers: np.ndarray) -> np.ndarray:
+        """
+        Find the received sequence numbers the splitter filter drops.
+
+        :param numbers: The sequence numbers
+        :return:        The numbers among them that should not have been received
+        """
+        if not self.filtered:
+            return numbers[:0]
+        bits = numbers - self.low
+        numbers = numbers[(bits >= 0) & (bits < self.size)]
+        return numbers[self._test(self.dropped, numbers - self.low)]
+
+    def update(self, block: bytes, terminated: bool = True) -> np.ndarray:
+        """
+        Parse and mark off a block of received lines.
+
+        :param block:       A block of lines from :py:func:`read_chunks`
+        :param terminated:  Whether the block ends in a newline
+        :return:            The sequence numbers
+        """
+        numbers = self.parse(block, terminated)
+        self.mark(numbers)
+        return numbers
+
+    def results(self) -> Dict[str, Union[int, List[Tuple[int, int]]]]:
+        """
+        Summarise the bitmaps.
+
+        :return:    The ``valid`` and ``invalid`` counts, and the ``duplicate`` and ``missing`` sequence number ranges,
+                    plus the ``leaked`` ones when filtered
+        """
+        missing = self.expected & ~self.seen
+        valid = self.seen & ~self.repeated
+        results = {
+            'valid':     int(POPCOUNT[valid].sum(dtype = np.int64)),
+            'duplicate': bit_ranges(self.repeated, self.size, self.low),
+            'missing':   bit_ranges(missing, self.size, self.low)
+        }
+        if self.filtered:
+            results['leaked'] = bit_ranges(self.leaked, self.size, self.low)
+        results['invalid'] = self.invalid
+        return results
+
+
+def format_ranges(ranges: List[Tuple[int, int]], limit: int = 10) -> str:
+    """
+    Render ranges as ``78085–78212, 80000``, listing at most ``limit`` of them.
+
+    :param ranges:  Inclusive ``(start, end)`` ranges
+    :param limit:   The number of ranges to list
+    :return:
+    """
+    text = ', '.join(f'{start}–{end}' if end != start else f'{start}' for start, end in ranges[:limit])
+    if len(ranges) > limit:
+        text += f', ... ({len(ranges) - limit} more)'
+    return text or '0'
+
+
+def sequence_check(master: Union[str, Path], *files: IO[bytes],
+                   pattern: bytes = PATTERN) -> Optional[Dict[str, Union[int, List[Tuple[int, int]]]]]:
+    """
+    Verify the received events with :py:class:`SequenceCheck`.
+
+    :param master:  The location of the Master file
+    :arg files:     The file descriptors to verify
+    :param pattern: The event pattern, its only group being the sequence number
+    :return:        The results, or ``None`` if ``master`` does not follow the pattern (nothing is read from ``files``)
+    """
+    check = SequenceCheck.build(master, pattern)
+    if check is None:
+        return None
+    for _, block, terminated in interleave(files, reader = read_chunks):
+        check.update(block, terminated)
+    return check.results()
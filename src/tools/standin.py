@@ -0,0 +1,436 @@
+import json
+import time
+import shlex
+import asyncio
+import logging
+import tarfile
+import threading
+
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Any, Coroutine, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+from src.tools.enums import ServiceType
+from src.tools.latency import stamped
+from src.tools.proxy import Impairment, ThrottlingProxy
+
+_logger = logging.getLogger(__name__)
+
+LOCALHOST = '127.0.0.1'
+
+# Bytes read from a socket or file at a time (the Node stream default)
+READ_SIZE = 64 * 1024
+
+# Buffered bytes at which a socket write reports it did not flush (the Node socket highWaterMark)
+HIGH_WATER = 16 * 1024
+
+# Bytes per chunk of a streamed archive
+ARCHIVE_CHUNK_SIZE = 2 * 1024 * 1024
+
+# Seconds between checks that every byte sent by the agent has landed
+POLL_INTERVAL = 0.005
+
+
+class _Service:
+    """
+    Base of the in-process stand-ins for the ``node app.js`` roles, configured from ``src/app/<role>/*.json``.
+    """
+    role: ServiceType
+
+    def __init__(self, name: str, app: 'LocalApp'):
+        self.name    = name
+        self.app     = app
+        self.dir     = Path(app.workdir, name)
+        self.running = False
+        self.history: List[Tuple[datetime, str]] = []
+
+    def config(self, name: str) -> Dict[str, Any]:
+        with Path(self.app.config_dir, self.role.value, name).open() as file:
+            return json.load(file)
+
+    def log(self, message: str) -> None:
+        self.history.append((datetime.now(timezone.utc), message))
+
+    def logs(self, timestamps: bool = False, since: Union[datetime, int, float, None] = None) -> List[bytes]:
+        """
+        The log lines of the service, in the shape ``docker logs`` returns them.
+        """
+        if isinstance(since, (int, float)):
+            since = datetime.fromtimestamp(since, timezone.utc)
+        elif since is not None and since.tzinfo is None:
+            since = since.replace(tzinfo = timezone.utc)
+        return [
+            (f'{stamp.isoformat().replace("+00:00", "Z")} ' if timestamps else '').encode() + f'{message}\n'.encode()
+            for stamp, message in list(self.history) if since is None or stamp >= since
+        ]
+
+
+class Target(_Service):
+    """
+    Listens on the ``inputs.json`` port and appends everything received to the ``outputs.json`` file.
+    """
+    role = ServiceType.TARGET
+
+    def __init__(self, name: str, app: 'LocalApp'):
+        super().__init__(name, app)
+        self.file    = Path(self.dir, self.config('outputs.json')['file'])
+        self.written = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self.dir.mkdir(parents = True, exist_ok = True)
+        # A fresh container starts without an output file
+        self.file.unlink(missing_ok = True)
+        port = self.config('inputs.json')['tcp']
+        self._server = await asyncio.start_server(self._handle, LOCALHOST, 0)
+        self.app.register(self.name, port, self._server.sockets[0].getsockname()[1])
+        self.log('working as target')
+        self.log(f'outputfile {self.file.name}')
+        self.log(f'App listening on port {port}')
+        self.running = True
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+        self.running = False
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.log('client connected')
+        with self.file.open(mode = 'ab', buffering = 0) as file:
+            while data := await reader.read(READ_SIZE):
+                file.write(data)
+                self.written += len(data)
+        writer.close()
+
+
+class Splitter(_Service):
+    """
+    Forwards what it receives to the ``outputs.json`` targets like ``app.ts``: each received chunk goes to the current
+    target up to its first newline and the rest to the next target, which becomes the current one. When a target does
+    not flush, reading from the agent pauses until that target drains. The current target is shared by every agent
+    connection and carries over from one to the next, as ``sockIdx`` does in ``app.ts``.
+
+    ``filter.json`` is loaded into :py:attr:`filter` but, as in ``app.ts``, not applied.
+    """
+    role = ServiceType.SPLITTER
+
+    def __init__(self, name: str, app: 'LocalApp', targets: Optional[Sequence[str]] = None):
+        super().__init__(name, app)
+        self.targets = self.config('outputs.json')['tcp']
+        if targets is not None:
+            port = self.targets[0]['port'] if self.targets else 9997
+            self.targets = [{'host': target, 'port': port} for target in targets]
+        self.filter    = self.config('filter.json').get('filter')
+        self.received  = 0
+        self.forwarded = 0
+        self.pauses    = 0
+        self.paused    = 0.0
+        self.current   = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        port = self.config('inputs.json')['tcp']
+        self._server = await asyncio.start_server(self._handle, LOCALHOST, 0)
+        self.app.register(self.name, port, self._server.sockets[0].getsockname()[1])
+        self.log('working as splitter')
+        self.log(f'targets {json.dumps(self.targets)}')
+        self.log(f'App listening on port {port}')
+        self.running = True
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+        self.running = False
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.log('client connected')
+        outputs = []
+        for target in self.targets:
+            self.log(f'processing {json.dumps(target)}')
+            _, output = await asyncio.open_connection(*self.app.address(target['host'], target['port']))
+            output.transport.set_write_buffer_limits(high = HIGH_WATER)
+            outputs.append(output)
+            self.log(f'Connected to {json.dumps(target)}')
+
+        while data := await reader.read(READ_SIZE):
+            self.received += len(data)
+            split = data.find(b'\n')
+            parts = [(self.current, data if split == -1 else data[:split + 1])]
+            if split != -1:
+                self.current = (self.current + 1) % len(outputs)
+                parts.append((self.current, data[split + 1:]))
+
+            for idx, part in parts:
+                if part:
+                    outputs[idx].write(part)
+                    self.forwarded += len(part)
+
+            # Pause the agent socket until every target that did not flush drains
+            unflushed = [output for output in outputs if output.transport.get_write_buffer_size() >= HIGH_WATER]
+            if unflushed:
+                self.pauses += 1
+                start = time.monotonic()
+                await asyncio.gather(*(output.drain() for output in unflushed))
+                self.paused += time.monotonic() - start
+
+        for output in outputs:
+            await output.drain()
+            output.close()
+        writer.close()
+
+
+class Proxy(_Service):
+    """
+    A :py:class:`ThrottlingProxy` in front of a Target, registered under the Target's host and port so the Splitter
+    connects to it in the Target's place. Its counters are logged as each connection closes.
+    """
+    role = ServiceType.PROXY
+
+    def __init__(self, name: str, app: 'LocalApp', target: Target, impairment: Impairment):
+        super().__init__(name, app)
+        self.target = target
+        self.proxy  = ThrottlingProxy(None, impairment, name, log = self.log)
+
+    async def start(self) -> None:
+        port = self.target.config('inputs.json')['tcp']
+        self.proxy.upstream = self.app.address(self.target.name, port)
+        self.app.register(self.target.name, port, await self.proxy.start())
+        self.log(f'proxying {self.target.name} with {self.proxy.impairment}')
+        self.running = True
+
+    async def stop(self) -> None:
+        await self.proxy.stop()
+        self.running = False
+
+
+class Agent(_Service):
+    """
+    Streams the ``inputs.json`` monitor file to the ``outputs.json`` host, filling in the send time of latency
+    stamped events as they go when ``stamp`` is set.
+    """
+    role = ServiceType.AGENT
+
+    def __init__(self, name: str, app: 'LocalApp', monitor: Optional[Path] = None):
+        super().__init__(name, app)
+        self.monitor = monitor
+        self.stamp   = False
+        self.sent    = 0
+
+    async def run(self) -> bytes:
+        self.history.clear()
+        self.log('Working as agent')
+        hostport = self.config('outputs.json')['tcp']
+        self.log(f'tcp= {json.dumps(hostport)}')
+        monitor = self.monitor or Path(self.app.config_dir, self.role.value, self.config('inputs.json')['monitor'])
+        self.log(f'monitored_filename= {monitor}')
+
+        self.log(f'Connecting to  {json.dumps(hostport)}')
+        _, writer = await asyncio.open_connection(*self.app.address(hostport['host'], hostport['port']))
+        self.log(f'connected to target {json.dumps(hostport)}')
+        with Path(monitor).open(mode = 'rb') as file:
+            chunks = iter(lambda: file.read(READ_SIZE), b'')
+            for chunk in stamped(chunks) if self.stamp else chunks:
+                writer.write(chunk)
+                self.sent += len(chunk)
+                await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+        return b''.join(self.logs())
+
+
+class ExecResult(NamedTuple):
+    exit_code: Optional[int]
+    output:    Union[bytes, Iterator]
+
+
+class LocalContainer:
+    """
+    The slice of :py:class:`docker.models.containers.Container` the tests use, backed by a stand-in service.
+    """
+    def __init__(self, service: _Service):
+        self._service = service
+        self.name     = service.name
+        self.labels   = {'operation-mode': service.role.value}
+
+    def exec_run(self, cmd: Union[str, List[str]], **kwargs) -> ExecResult:
+        """
+        Answer the commands the tests run in the containers: ``pidof``, ``test -f``, ``stat -c %s``, ``ping`` and, with
+        ``stream``, ``tail -c +1 -F``
+        """
+        args = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+        if args[:4] == ['tail', '-c', '+1', '-F'] and kwargs.get('stream'):
+            chunks = self._follow(Path(self._service.dir, Path(args[4]).name))
+            return ExecResult(None, ((chunk, None) for chunk in chunks) if kwargs.get('demux') else chunks)
+        if args[:1] == ['pidof']:
+            return ExecResult(int(not (self._service.running and args[-1] == self._service.role.value)), b'')
+        if args[:2] == ['test', '-f']:
+            return ExecResult(int(not Path(self._service.dir, args[2]).is_file()), b'')
+        if args[:3] == ['stat', '-c', '%s']:
+            file = Path(self._service.dir, args[3])
+            return ExecResult(0, f'{file.stat().st_size}\n'.encode()) if file.is_file() else ExecResult(1, b'')
+        if args[:1] == ['ping']:
+            return ExecResult(int(args[-1] not in self._service.app.services), b'')
+        return ExecResult(127, f'{args[0]}: not found in the stand-in\n'.encode())
+
+    def remove(self, **kwargs) -> None:
+        pass
+
+    def _follow(self, file: Path) -> Iterator[bytes]:
+        """
+        Poll a file from its first byte as it grows, until the service stops
+        """
+        while not file.exists():
+            if not self._service.running:
+                return
+            time.sleep(POLL_INTERVAL)
+        with file.open(mode = 'rb') as source:
+            while True:
+                if chunk := source.read(READ_SIZE):
+                    yield chunk
+                elif self._service.running:
+                    time.sleep(POLL_INTERVAL)
+                else:
+                    return
+
+    def logs(self, timestamps: bool = False, since: Union[datetime, int, float, None] = None, stream: bool = False,
+             **kwargs) -> Union[bytes, Iterator[bytes]]:
+        lines = self._service.logs(timestamps, since)
+        return iter(lines) if stream else b''.join(lines)
+
+
+class _Containers:
+    def __init__(self, app: 'LocalApp'):
+        self._app = app
+
+    def get(self, name: str) -> LocalContainer:
+        return LocalContainer(self._app.services[getattr(name, 'value', name)])
+
+    def list(self, **kwargs) -> List[LocalContainer]:
+        return self._app.containers()
+
+
+class _API:
+    def __init__(self, app: 'LocalApp'):
+        self._app = app
+
+    def get_archive(self, container: str, path: Union[str, Path],
+                    chunk_size: int = ARCHIVE_CHUNK_SIZE, **kwargs) -> Tuple[Iterator[bytes], Dict[str, Any]]:
+        """
+        Stream a tar of a file in the service directory, as :py:meth:`docker.api.APIClient.get_archive` does
+        """
+        file = Path(self._app.services[container].dir, Path(path).name)
+        info = tarfile.TarInfo(file.name)
+        stat = file.stat()
+        info.size, info.mtime, info.mode = stat.st_size, int(stat.st_mtime), 0o644
+
+        def _stream() -> Iterator[bytes]:
+            yield info.tobuf(format = tarfile.GNU_FORMAT)
+            with file.open(mode = 'rb') as source:
+                remaining = info.size
+                while remaining and (chunk := source.read(min(chunk_size, remaining))):
+                    remaining -= len(chunk)
+                    yield chunk
+            yield bytes(-info.size % tarfile.BLOCKSIZE + 2 * tarfile.BLOCKSIZE)
+
+        return _stream(), {'name': file.name, 'size': info.size, 'mode': info.mode, 'mtime': stat.st_mtime}
+
+
+class LocalClient:
+    """
+    The slice of :py:class:`DockerClient` the tests use, answered by a :py:class:`LocalApp`.
+    """
+    def __init__(self, app: 'LocalApp'):
+        self.app        = app
+        self.containers = _Containers(app)
+        self.api        = _API(app)
+
+
+class LocalApp:
+    """
+    Pure Python, single process stand-in for the agent, splitter and targets of ``docker-app-compose.yml``.
+
+    The services run on an asyncio loop in a background thread, on localhost ports. The hostnames and ports in the
+    ``src/app`` configs are mapped to the ports the stand-ins actually listen on, so the configs are used unchanged.
+
+    :param config_dir:  The ``src/app`` directory
+    :param workdir:     Where each service gets a directory for its output file
+    :param targets:     Target hostnames replacing the splitter ``outputs.json`` list
+    :param monitor:     A file for the agent to send instead of the ``inputs.json`` monitor file
+    :param impairments: By Target, the impairment of a :py:class:`Proxy` put in front of it
+    """
+    def __init__(self, config_dir: Path, workdir: Path, targets: Optional[Sequence[str]] = None,
+                 monitor: Optional[Path] = None, impairments: Optional[Dict[str, Impairment]] = None):
+        self.config_dir = Path(config_dir)
+        self.workdir    = Path(workdir)
+        self._ports: Dict[Tuple[str, int], int] = {}
+        self._loop:   Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+        self.splitter = Splitter(ServiceType.SPLITTER.value, self, targets)
+        self.targets  = [Target(target['host'], self) for target in self.splitter.targets]
+        self.proxies  = [
+            Proxy(f'{ServiceType.PROXY.value}_{target.name}', self, target, impairments[target.name])
+            for target in self.targets if target.name in (impairments or {})
+        ]
+        self.agent    = Agent(ServiceType.AGENT.value, self, monitor)
+        self.services: Dict[str, _Service] = {
+            service.name: service for service in [*self.targets, *self.proxies, self.splitter]
+        }
+
+    def register(self, host: str, port: int, local_port: int) -> None:
+        self._ports[(host, port)] = local_port
+
+    def address(self, host: str, port: int) -> Tuple[str, int]:
+        return LOCALHOST, self._ports[(host, port)]
+
+    def containers(self) -> List[LocalContainer]:
+        return [LocalContainer(service) for service in self.services.values() if service.running]
+
+    def _call(self, coroutine: Coroutine, timeout: Optional[float] = None) -> Any:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    def start(self) -> None:
+        """
+        Start the targets, then their proxies, then the splitter
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target = self._loop.run_forever, name = 'stand-in', daemon = True)
+        self._thread.start()
+        for service in [*self.targets, *self.proxies, self.splitter]:
+            service.history.clear()
+            self._call(service.start())
+        _logger.info(f'Stand-in is up: {", ".join(f"{host}:{port}->{local}" for (host, port), local in self._ports.items())}')
+
+    def stop(self) -> None:
+        for service in [self.splitter, *self.proxies, *self.targets]:
+            if service.running:
+                self._call(service.stop())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._ports.clear()
+
+    async def _run_agent(self) -> None:
+        await self.agent.run()
+        # The agent is done once the splitter has everything and every forwarded byte is written
+        while self.splitter.received < self.agent.sent or \
+                sum(target.written for target in self.targets) < self.splitter.forwarded:
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def run_agent(self, monitor: Optional[Path] = None, stamp: bool = False,
+                  timeout: Optional[float] = None) -> 'LocalContainer':
+        """
+        Run the agent until its monitor file has landed in the target files.
+
+        :param monitor: A file to send instead of the configured one, for this run
+        :param stamp:   Fill in the send time of the latency stamped events, see :py:func:`stamped`
+        :param timeout: Seconds to wait
+        :return:        The agent container, its output is in its logs
+        """
+        if monitor is not None:
+            self.agent.monitor = monitor
+        self.agent.stamp = stamp
+        self.agent.sent = self.splitter.received = self.splitter.forwarded = 0
+        for target in self.targets:
+            target.written = 0
+        self._call(self._run_agent(), timeout)
+        return LocalContainer(self.agent)
@@ -0,0 +1,215 @@
+import json
+import logging
+import threading
+import numpy as np
+
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from prettytable import PrettyTable
+
+_logger = logging.getLogger(__name__)
+
+# The metrics decoded from each stats reading, in the order they are kept
+METRICS = ('cpu', 'memory', 'rx_bytes', 'tx_bytes', 'pids')
+
+# Cumulative counters, whose per interval differences are the throughput curves
+COUNTERS = ('rx_bytes', 'tx_bytes')
+
+
+def _timestamp(read: str) -> float:
+    """
+    The UNIX time of a stats ``read`` stamp, e.g. ``2022-03-01T12:00:00.123456789Z`` (nanoseconds cut to micro)
+    """
+    stamp, _, fraction = read.rstrip('Z').partition('.')
+    seconds = datetime.strptime(stamp, '%Y-%m-%dT%H:%M:%S').replace(tzinfo = timezone.utc).timestamp()
+    return seconds + (int(fraction[:6].ljust(6, '0')) / 1e6 if fraction else 0.0)
+
+
+def decode(stats: Dict[str, Any]) -> Tuple[float, ...]:
+    """
+    Decode a reading of the Docker stats stream the way ``docker stats`` does.
+
+    :param stats:   The decoded JSON of one reading
+    :return:        Its time and the :py:data:`METRICS`: the CPU % (100 per core), the memory used without the page
+                    cache, the bytes received and sent over all the networks and the number of processes
+    """
+    cpu, precpu = stats.get('cpu_stats', {}), stats.get('precpu_stats', {})
+    cpu_delta = cpu.get('cpu_usage', {}).get('total_usage', 0) - precpu.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+    cores = cpu.get('online_cpus') or len(cpu.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+    memory = stats.get('memory_stats', {})
+    cache = memory.get('stats', {}).get('inactive_file', memory.get('stats', {}).get('cache', 0))
+    networks = (stats.get('networks') or {}).values()
+    return (
+        _timestamp(stats['read']),
+        cpu_delta / system_delta * cores * 100 if system_delta > 0 and cpu_delta > 0 else 0.0,
+        max(memory.get('usage', 0) - cache, 0),
+        sum(network.get('rx_bytes', 0) for network in networks),
+        sum(network.get('tx_bytes', 0) for network in networks),
+        stats.get('pids_stats', {}).get('current', 0)
+    )
+
+
+class StatsSampler:
+    """
+    Consume the stats streams of several containers (``container.stats(stream = True, decode = True)``) on background
+    threads, one per stream as each blocks until its next reading (about one a second from Docker).
+
+    The readings are decoded as they arrive (see :py:func:`decode`) and kept as rows; :py:meth:`series` resamples them
+    onto one fixed ``interval`` grid shared by all the containers, as arrays, and derives the throughput curves from
+    the cumulative network counters. :py:meth:`summary` gives the peaks and means of each container, and for the
+    ``relays`` (the Splitters) the peak of the bytes received but not yet sent on, a measure of backpressure.
+
+    :param sources:     The stats stream of each container, by name
+    :param interval:    Seconds between the samples of the series
+    :param relays:      The names of the containers forwarding what they receive
+    """
+    def __init__(self, sources: Dict[str, Iterable[Dict[str, Any]]], interval: float = 1.0,
+                 relays: Sequence[str] = ()):
+        self.sources  = sources
+        self.interval = interval
+        self.relays   = set(relays)
+        self.rows: Dict[str, List[Tuple[float, ...]]] = {name: [] for name in sources}
+        self.errors: Dict[str, BaseException] = {}
+        self._stop = threading.Event()
+        self._threads = [
+            threading.Thread(target = self._consume, args = (name, source), name = f'stats-{name}', daemon = True)
+            for name, source in sources.items()
+        ]
+
+    def start(self) -> 'StatsSampler':
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _consume(self, name: str, source: Iterable[Dict[str, Any]]) -> None:
+        try:
+            for stats in source:
+                if self._stop.is_set():
+                    break
+                if stats.get('read', '').startswith('0001'):
+                    # The container is not running (yet, or any more)
+                    continue
+                self.rows[name].append(decode(stats))
+        except Exception as error:
+            self.errors[name] = error
+            _logger.warning(f'Stopped sampling {name}: {error!r}')
+        finally:
+            if close := getattr(source, 'close', None):
+                close()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop sampling. Each stream is closed at its next reading, waited for up to ``timeout`` seconds (two intervals
+        by default); a stream that does not deliver is left to its daemon thread.
+        """
+        self._stop.set()
+        for thread in self._threads:
+            if thread.ident is not None:
+                thread.join(timeout if timeout is not None else 2 * self.interval)
+
+    def series(self) -> Dict[str, np.ndarray]:
+        """
+        The samples on a fixed grid: ``time`` (seconds from the first reading) and per container and metric an array
+        named ``<container>.<metric>``, the last reading in each interval carried forward over the intervals without
+        one, and NaN before the first. The ``<container>.<counter>_rate`` arrays are the bytes per second of each
+        interval.
+
+        :return:
+        """
+        rows = {name: np.asarray(rows, dtype = np.float64) for name, rows in self.rows.items() if rows}
+        if not rows:
+            return {'time': np.empty(0, dtype = np.float32)}
+        start = min(float(values[0, 0]) for values in rows.values())
+        end = max(float(values[-1, 0]) for values in rows.values())
+        size = int((end - start) // self.interval) + 1
+        series = {'time': (np.arange(size) * self.interval).astype(np.float32)}
+
+        for name, values in rows.items():
+            slots = ((values[:, 0] - start) // self.interval).astype(np.intp)
+            # The last reading of each slot, then carried forward
+            taken = np.full(size, -1, dtype = np.intp)
+            taken[slots] = np.arange(len(slots))
+            taken = np.maximum.accumulate(taken)
+            for column, metric in enumerate(METRICS, start = 1):
+                array = np.where(taken >= 0, values[np.maximum(taken, 0), column], np.nan)
+                dtype = np.float32 if metric == 'cpu' else np.float64
+                series[f'{name}.{metric}'] = array.astype(dtype)
+                if metric in COUNTERS:
+                    series[f'{name}.{metric}_rate'] = (
+                        np.diff(array, prepend = array[:1]) / self.interval
+                    ).astype(np.float32)
+        return series
+
+    def summary(self, series: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        The peaks and means of each container over the series
+
+        :param series:  The :py:meth:`series`, computed when not given
+        :return:
+        """
+        series = series if series is not None else self.series()
+        summary = {}
+        for name in self.rows:
+            if f'{name}.cpu' not in series:
+                continue
+
+            def _stat(metric: str, reduce) -> float:
+                values = series[f'{name}.{metric}']
+                return float(reduce(values)) if not np.isnan(values).all() else 0.0
+
+            rx, tx = series[f'{name}.rx_bytes'], series[f'{name}.tx_bytes']
+            first = int(np.argmax(~np.isnan(rx)))
+            summary[name] = {
+                'samples':      len(self.rows[name]),
+                'cpu_peak':     _stat('cpu', np.nanmax),
+                'cpu_mean':     _stat('cpu', np.nanmean),
+                'memory_peak':  int(_stat('memory', np.nanmax)),
+                'rx_bytes':     int(rx[-1] - rx[first]),
+                'tx_bytes':     int(tx[-1] - tx[first]),
+                'rx_rate_peak': _stat('rx_bytes_rate', np.nanmax),
+                'tx_rate_peak': _stat('tx_bytes_rate', np.nanmax)
+            }
+            if name in self.relays:
+                backlog = (rx - rx[first]) - (tx - tx[first])
+                summary[name]['backlog_peak'] = int(np.nanmax(backlog)) if not np.isnan(backlog).all() else 0
+        return summary
+
+    @staticmethod
+    def table(summary: Dict[str, Dict[str, Any]]) -> PrettyTable:
+        table = PrettyTable(field_names = [
+            'container', 'samples', 'cpu peak', 'cpu mean', 'memory peak (MiB)', 'rx (MiB)', 'tx (MiB)',
+            'rx peak (MiB/s)', 'tx peak (MiB/s)', 'backlog peak (KiB)'
+        ])
+        for name, stats in summary.items():
+            table.add_row([
+                name, stats['samples'], f'{stats["cpu_peak"]:.1f}%', f'{stats["cpu_mean"]:.1f}%',
+                f'{stats["memory_peak"] / 2 ** 20:.1f}', f'{stats["rx_bytes"] / 2 ** 20:.1f}',
+                f'{stats["tx_bytes"] / 2 ** 20:.1f}', f'{stats["rx_rate_peak"] / 2 ** 20:.2f}',
+                f'{stats["tx_rate_peak"] / 2 ** 20:.2f}',
+                f'{stats["backlog_peak"] / 2 ** 10:.1f}' if 'backlog_peak' in stats else '-'
+            ])
+        return table
+
+    def save(self, directory: Union[str, Path], name: str = 'telemetry') -> Dict[str, Any]:
+        """
+        Write the :py:meth:`series` to ``<name>.npz`` and the :py:meth:`summary` to ``<name>.json`` in ``directory``
+        and log the summary table.
+
+        :param directory:   Where to write them
+        :param name:        The file name stem
+        :return:            The summary
+        """
+        series = self.series()
+        summary = self.summary(series)
+        directory = Path(directory)
+        directory.mkdir(parents = True, exist_ok = True)
+        np.savez_compressed(Path(directory, f'{name}.npz'), **series)
+        Path(directory, f'{name}.json').write_text(json.dumps({
+            'interval':   self.interval,
+            'containers': summary,
+            'errors':     {container: repr(error) for container, error in self.errors.items()}
+        }, indent = 4))
+        _logger.info(f'Container telemetry over {len(series["time"]) * self.interval:.0f}s:\n{self.table(summary)}')
+        return summary
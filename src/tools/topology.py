@@ -0,0 +1,204 @@
+import json
+import logging
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+from src.tools.enums import ServiceType
+from src.tools.namespace import LABEL, Namespace
+
+_logger = logging.getLogger(__name__)
+
+# Container label naming the Splitter a Target is fed by
+SPLITTER_LABEL = 'timberbrook.splitter'
+
+# The port every app role listens on
+PORT = 9997
+
+# Written next to the rendered files, see :py:meth:`Topology.load`
+MANIFEST = 'topology.json'
+
+# The image the proxies run src/tools/proxy.py in, unless PROXY_IMAGE is set
+PROXY_IMAGE = 'python:3.11-slim'
+
+
+class Topology:
+    """
+    The services of the compose stack: ``targets`` Targets fed by ``splitters`` Splitters, each Splitter fanning out to
+    its own contiguous group of Targets and sent to by its own Agent run. A single Splitter keeps the ``splitter``
+    service name, several are ``splitter_1`` .. ``splitter_<n>``; the Targets are ``target_1`` .. ``target_<n>``.
+
+    :py:meth:`render` writes the compose file and the Splitter and Agent ``outputs.json`` of the topology, with the
+    container names and hostnames in ``namespace``. The names held here are the service names, resolved to container
+    names by the :py:class:`Namespace`.
+
+    An impaired Target gets a ``proxy_<target>`` service in front of it running :py:mod:`src.tools.proxy`, and its
+    Splitter is pointed at the proxy instead.
+
+    :param targets:     The number of Targets
+    :param splitters:   The number of Splitters, at most one per Target
+    :param namespace:   The namespace of the stack
+    :param directory:   Where the files were rendered, if they were
+    :param impairments: The :py:class:`Impairment` spec of each impaired Target
+    """
+    def __init__(self, targets: int = 2, splitters: int = 1, namespace: Optional[Namespace] = None,
+                 directory: Union[str, Path, None] = None, impairments: Optional[Dict[str, str]] = None):
+        if targets < 1 or not 1 <= splitters <= targets:
+            raise ValueError(f'Cannot feed {targets} Targets from {splitters} Splitters')
+        self.namespace = namespace if namespace is not None else Namespace()
+        self.directory = Path(directory) if directory is not None else None
+        self.targets   = [f'{ServiceType.TARGET.value}_{idx}' for idx in range(1, targets + 1)]
+        if splitters == 1:
+            self.splitters = [ServiceType.SPLITTER.value]
+        else:
+            self.splitters = [f'{ServiceType.SPLITTER.value}_{idx}' for idx in range(1, splitters + 1)]
+
+        # Contiguous groups, the first ones one Target larger when they don't divide evenly
+        size, extra = divmod(targets, splitters)
+        self.groups: Dict[str, List[str]] = {}
+        start = 0
+        for idx, splitter in enumerate(self.splitters):
+            end = start + size + (1 if idx < extra else 0)
+            self.groups[splitter] = self.targets[start:end]
+            start = end
+        self.impairments = impairments or {}
+        if unknown := set(self.impairments) - set(self.targets):
+            raise ValueError(f'Cannot impair {", ".join(sorted(unknown))}, not one of the Targets')
+
+    @classmethod
+    def load(cls, directory: Union[str, Path]) -> 'Topology':
+        """
+        The topology rendered to ``directory`` by ``pytest_configure``
+
+        :param directory:   Where the files were rendered
+        :return:
+        """
+        manifest = json.loads(Path(directory, MANIFEST).read_text())
+        return cls(manifest['targets'], manifest['splitters'], Namespace(manifest['namespace']), directory,
+                   manifest.get('impairments'))
+
+    @property
+    def services(self) -> List[str]:
+        return [*self.splitters, *self.targets]
+
+    @staticmethod
+    def proxy(target: str) -> str:
+        return f'{ServiceType.PROXY.value}_{target}'
+
+    def upstream(self, target: str) -> str:
+        """
+        The service a Splitter connects to for ``target``, its proxy when it is impaired
+        """
+        return self.proxy(target) if target in self.impairments else target
+
+    def splitter_of(self, target: str) -> str:
+        return next(splitter for splitter, targets in self.groups.items() if target in targets)
+
+    def links(self) -> List[tuple]:
+        """
+        The (source, destination) service pairs that must reach each other: each Splitter and its Targets both ways,
+        and each Target the next one of its group. For the default topology that is every pair of services.
+        """
+        links = []
+        for splitter, targets in self.groups.items():
+            for target in targets:
+                links += [(splitter, target), (target, splitter)]
+            if len(targets) > 1:
+                links += [(target, targets[(idx + 1) % len(targets)]) for idx, target in enumerate(targets)]
+        return list(dict.fromkeys(links))
+
+    def outputs(self, service: str) -> Path:
+        """
+        The rendered ``outputs.json`` of a Splitter
+
+        :param service: A Splitter service name
+        :return:
+        """
+        return Path(self.directory, service, 'outputs.json')
+
+    def agent_outputs(self, splitter: str) -> Path:
+        return Path(self.directory, ServiceType.AGENT.value, f'{splitter}.json')
+
+    def _service(self, name: str, role: ServiceType, **extra: Any) -> Dict[str, Any]:
+        return {
+            'image':          '${IMAGE_BASE_TAG:?err}',
+            'container_name': self.namespace(name),
+            'hostname':       self.namespace(name),
+            'labels':         {'operation-mode': role.value, LABEL: self.namespace.name, **extra.pop('labels', {})},
+            'expose':         [f'{PORT}/tcp'],
+            'networks':       ['timbernet'],
+            'command':        ['node', 'app.js', role.value],
+            **extra
+        }
+
+    def compose(self, working_dir: str = '/app') -> Dict[str, Any]:
+        """
+        The compose file of the topology, with the ``outputs.json`` rendered to :py:attr:`directory` mounted into the
+        Splitters and ``proxy.py`` into the proxies
+
+        :param working_dir: The Image Working Directory
+        :return:
+        """
+        services = {}
+        for splitter, targets in self.groups.items():
+            for target in targets:
+                services[target] = self._service(
+                    target, ServiceType.TARGET, labels = {SPLITTER_LABEL: self.namespace(splitter)}
+                )
+                if target in self.impairments:
+                    services[self.proxy(target)] = self._service(
+                        self.proxy(target), ServiceType.PROXY,
+                        labels     = {SPLITTER_LABEL: self.namespace(splitter)},
+                        image      = f'${{PROXY_IMAGE:-{PROXY_IMAGE}}}',
+                        command    = [
+                            'python', '/proxy/proxy.py', '--listen', f'0.0.0.0:{PORT}',
+                            '--upstream', f'{self.namespace(target)}:{PORT}', '--impair', self.impairments[target],
+                            '--name', self.namespace(self.proxy(target))
+                        ],
+                        volumes    = [f'{Path(__file__).with_name("proxy.py").resolve()}:/proxy/proxy.py:ro'],
+                        depends_on = [target]
+                    )
+            services[splitter] = self._service(
+                splitter, ServiceType.SPLITTER,
+                volumes    = [f'{self.outputs(splitter).resolve()}:{working_dir}/{ServiceType.SPLITTER.value}/'
+                              f'outputs.json:ro'],
+                depends_on = [self.upstream(target) for target in targets]
+            )
+        return {
+            'version':  '3',
+            'services': services,
+            # NETWORK is the namespace network unless set by the user, see Namespace.environ
+            'networks': {'timbernet': {'name': '${NETWORK:?err}'}}
+        }
+
+    def render(self, directory: Union[str, Path], working_dir: str = '/app') -> Path:
+        """
+        Write the compose file, the Splitter and Agent ``outputs.json`` and the manifest to ``directory``.
+
+        The compose file is JSON, which compose reads as YAML.
+
+        :param directory:   Where to write them
+        :param working_dir: The Image Working Directory
+        :return:            The compose file
+        """
+        self.directory = Path(directory)
+        for splitter, targets in self.groups.items():
+            self._write(self.outputs(splitter), {
+                'tcp': [{'host': self.namespace(self.upstream(target)), 'port': PORT} for target in targets]
+            })
+            self._write(self.agent_outputs(splitter), {'tcp': {'host': self.namespace(splitter), 'port': PORT}})
+        self._write(Path(self.directory, MANIFEST), {
+            'targets':     len(self.targets),
+            'splitters':   len(self.splitters),
+            'namespace':   self.namespace.name,
+            'impairments': self.impairments
+        })
+        compose = Path(self.directory, 'docker-app-compose.json')
+        self._write(compose, self.compose(working_dir))
+        _logger.info(f'Rendered {len(self.targets)} Targets fed by {len(self.splitters)} Splitters in the '
+                     f'{self.namespace.name or "default"} namespace to {self.directory}')
+        return compose
+
+    @staticmethod
+    def _write(path: Path, content: Dict[str, Any]) -> None:
+        path.parent.mkdir(parents = True, exist_ok = True)
+        path.write_text(json.dumps(content, indent = 4))
@@ -1,97 +1,249 @@
+import os
 import json
 import logging
+import numpy as np
 
 from pathlib import Path
-from typing import IO, Union
+from typing import IO, Any, Dict, Optional, Union
 from prettytable import PrettyTable
+from src.tools.index import MasterIndex, interleave, read_chunks
+from src.tools.order import OrderCheck
+from src.tools.parallel import sharded_check
+from src.tools.sequence import SequenceCheck, format_ranges
+from src.tools.distribution import Distribution
+from src.tools.filter import EventFilter
+from src.tools.index_cache import IndexCache
+from src.tools.profiler import phase
+from src.tools.sketch import BloomFilter, CountMinSketch, HyperLogLog, line_hashes
 
 _logger = logging.getLogger(__name__)
 
 
-def event_check(master: Union[str, Path], *files: IO[bytes]) -> None:
-    results = {'valid': 0, 'duplicate': 0, 'missing': 0, 'invalid': 0}
-    table = PrettyTable(field_names = results.keys())
+def event_check(master: Union[str, Path], *files: IO[bytes], workers: int = 1, pattern: Optional[bytes] = None,
+                distribution: bool = False, event_filter: Optional[EventFilter] = None,
+                cache: Optional[IndexCache] = None) -> Optional[Dict[str, Any]]:
+    """
+    Count each *event* received in the given file descriptors against the events in ``master``.
+
+    The master events are held in a compact :py:class:`MasterIndex` and the files are read in large chunks, round-robin.
+    With more than one worker the index is sharded by digest across a pool of processes (see
+    :py:class:`ShardedVerifier`).
+
+    With a ``pattern`` and a master file whose every line matches it, the sequence numbers are checked off in a bitmap
+    instead (see :py:class:`SequenceCheck`) and missing/duplicate events are reported as ranges of sequence numbers.
+
+    With ``distribution`` the spread of the events over the files is analysed in the same pass (see
+    :py:class:`Distribution`) and its tables are appended to the report. The sharded verification does not see which
+    file a line came from, so there the analysis is skipped.
+
+    With an ``event_filter`` the master events the splitter is expected to drop are split off while the master is
+    indexed; those received anyway are reported as ``leaked``, and the ones wrongly dropped show up as ``missing``.
+    The sharded verification does not take a filter, a filtered check always runs in this process.
+
+    With a ``cache`` the master index (or sequence bitmap) is mapped in from an :py:class:`IndexCache` entry when the
+    master was indexed before, and stored there otherwise. The sharded verification indexes its shards in the workers
+    and does not use it.
 
+    The master indexing and the verification are timed as the ``index`` and ``verify`` phases of the session profile
+    (see :py:func:`phase`); the files are streamed as they are verified, so fetching them counts as verification.
+
+    Raises an :py:class:`AssertionError` if any master event is missing, duplicated or leaked, or if an event that is
+    not in ``master`` was received.
+
+    :param master:          The location of the Master file
+    :arg files:             The file descriptors to search
+    :param workers:         The number of processes to verify on
+    :param pattern:         The event pattern, its only group being the sequence number
+    :param distribution:    Analyse how the events were spread over the files
+    :param event_filter:    The splitter filter
+    :param cache:           The cache of master indexes
+    :return:                The distribution analysis, if any
+    """
     _logger.info('Start Master Event search...')
-    with open(master, mode = 'rb') as source:
-        # Read in all master events
-        master_events = {
-            event: 0 for event in source.readlines()
-        }
-        invalid = 0
-
-        while any(events := [file.readline() for file in files]):
-            # While there is an event record remaining in a target file, record the result
-            for event in events:
-                if event:
-                    status = master_events.get(event)
-                    if status is None:
-                        # Event was not found
-                        invalid += 1
-                    else:
-                        master_events[event] += 1
-
-    # Compile results
-    results['invalid'] = invalid
-    for value in master_events.values():
-        if value == 0:
-            results['missing'] += 1
-        elif value == 1:
-            results['valid'] += 1
-        else:
-            results['duplicate'] += 1
-
-    table.add_row(results.values())
-    _logger.info(f'\n{table}')
-
-    assert results['duplicate'] == results['missing'] == invalid == 0, f'Event errors found:\n{table}'
-
-
-def file_cmp(master: Union[str, Path], *files: IO[bytes]) -> None:
+    names = [str(getattr(file, 'name', idx)) for idx, file in enumerate(files)]
+    spread = None
+    check = None
+    if pattern:
+        with phase('index'):
+            check = cache.sequence_check(master, pattern, event_filter) if cache else \
+                SequenceCheck.build(master, pattern, event_filter = event_filter)
+    if check is not None:
+        spread = Distribution(names, check.size) if distribution else None
+        with phase('verify'):
+            for idx, block, terminated in interleave(files, reader = read_chunks):
+                numbers = check.update(block, terminated)
+                if spread is not None:
+                    spread.update(idx, numbers - check.low, len(block))
+        results = check.results()
+    elif workers > 1 and event_filter is None:
+        if distribution:
+            _logger.info(f'No distribution analysis with {workers} verification workers')
+        # The shards are indexed in the workers, while the files are read
+        with phase('verify'):
+            results = sharded_check(master, *files, workers = workers)
+    else:
+        with phase('index'):
+            index = cache.master_index(master, distribution, event_filter) if cache else \
+                MasterIndex.build(master, positions = distribution, event_filter = event_filter)
+        if distribution:
+            spread = Distribution(names, int(index.positions.max()) + 1 if len(index.positions) else 0)
+        with phase('verify'):
+            for idx, lines, terminated in interleave(files):
+                slots = index.update(lines, terminated)
+                if spread is not None:
+                    spread.update(
+                        idx, index.positions[slots[slots >= 0]], sum(map(len, lines)) + len(lines) - (not terminated)
+                    )
+        results = index.results()
+
+    report = spread.results() if spread is not None else None
+    assert_results(results, *(Distribution.tables(report) if report is not None else []))
+    return report
+
+
+def approximate_check(master: Union[str, Path], *files: IO[bytes], error: float = 0.001, precision: int = 14,
+                      capacity: int = 0, event_filter: Optional[EventFilter] = None) -> Dict[str, Any]:
+    """
+    A go/no-go pre-check of the *events* received in the given file descriptors against ``master``, in memory that
+    does not grow with the received events, to skip the exact :py:func:`event_check` of a clean run.
+
+    The master is read once and its events are added to three sketches of their line hashes (see
+    :py:func:`line_hashes`), with the events ``event_filter`` drops left out:
+
+        - A :py:class:`BloomFilter`, a received event it does not hold is certainly not a master event (or leaked
+          past the filter), sized for ``capacity`` events at ``error`` false positives, about 3 bytes per event at 0.1%
+        - A :py:class:`CountMinSketch` of ``e / error`` by ``ln(1 / error)`` counters, compared cell by cell with one
+          of the received events: any cell that differs means events are missing or duplicated, and bounds how many
+        - A :py:class:`HyperLogLog` of ``2 ** precision`` registers, compared register by register with the union of
+          those of each file, which also estimate how many distinct events each file holds
+
+    The received events are also counted. A discrepancy is certain, while a clean run is only probably clean: a
+    missing event and a duplicate cancel out in the count and, with probability ``(1 / width) ** depth``, in the
+    count-min sketch, and an invalid event hides in the Bloom filter with the probability reported as
+    ``bloom_error``, ``error`` up to its capacity.
+
+    :param master:          The location of the Master file
+    :arg files:             The file descriptors to search
+    :param error:           The Bloom filter false positive rate and the count-min sketch relative error
+    :param precision:       The HyperLogLog precision
+    :param capacity:        The master events the Bloom filter is sized for, by default estimated from the size of the
+                            master and the line length of its first chunk. A fixed capacity bounds the memory, past it
+                            the false positive rate goes up
+    :param event_filter:    The splitter filter
+    :return:                The report, ``clean`` when no discrepancy was found
     """
-    Attempt to find each *event* in ``master`` in the given file descriptors::
+    names = [str(getattr(file, 'name', idx)) for idx, file in enumerate(files)]
+    sketch, distinct = CountMinSketch(error, error), HyperLogLog(precision)
+    bloom, expected = None, 0
+    with phase('index'), open(master, mode = 'rb') as source:
+        for block, terminated in read_chunks(source):
+            if bloom is None:
+                # Lines per byte of the first chunk, over the whole master
+                estimate = os.fstat(source.fileno()).st_size * (block.count(b'\n') + 1) // len(block)
+                bloom = BloomFilter(capacity or estimate, error)
+            hashes = line_hashes(block, terminated)
+            if event_filter is not None:
+                hashes = hashes[~event_filter.dropped(block, terminated)]
+            for target in (bloom, sketch, distinct):
+                target.add(hashes)
+            expected += len(hashes)
+    bloom = bloom or BloomFilter(capacity, error)
+
+    received, counts, unknown = CountMinSketch(error, error), [0] * len(files), 0
+    spread = [HyperLogLog(precision) for _ in files]
+    with phase('verify'):
+        for idx, block, terminated in interleave(files, reader = read_chunks):
+            hashes = line_hashes(block, terminated)
+            unknown += int(np.count_nonzero(~bloom.contains(hashes)))
+            received.add(hashes)
+            spread[idx].add(hashes)
+            counts[idx] += len(hashes)
+
+    union = HyperLogLog(precision)
+    for each in spread:
+        union.merge(each)
+    compared = received.compare(sketch)
+    report = {
+        'clean':    sum(counts) == expected and not unknown and not compared['cells'] and
+                    np.array_equal(union.registers, distinct.registers),
+        'expected': expected,
+        'received': sum(counts),
+        'unknown':  unknown,
+        'excess':   compared['excess'],
+        'deficit':  compared['deficit'],
+        'distinct': {'master': round(distinct.estimate()), 'received': round(union.estimate()),
+                     **{name: round(each.estimate()) for name, each in zip(names, spread)}},
+        'counts':   dict(zip(names, counts)),
+        'bounds':   {'error': error, 'bloom_error': bloom.false_positives(expected), 'capacity': bloom.capacity,
+                     'distinct_error': distinct.error},
+        'memory':   bloom.nbytes + sketch.nbytes + received.nbytes + distinct.registers.nbytes * (len(files) + 2)
+    }
+    table = PrettyTable(field_names = ['clean', 'expected', 'received', 'unknown', 'excess', 'deficit',
+                                       'distinct master', 'distinct received', 'memory (MiB)'])
+    table.add_row([report['clean'], expected, report['received'], unknown, report['excess'], report['deficit'],
+                   report['distinct']['master'], report['distinct']['received'], f'{report["memory"] / 2 ** 20:.1f}'])
+    _logger.info(f'Approximate check:\n{table}')
+    return report
 
-    Raises and :py:class:`AssertionError` if:
-        - Master File is exhausted and events still exist in files
-        - Duplicate events found in files
-        - Extra events found in files
 
-    :param master:  The location of the Master file
-    :arg files:     The file descriptors to search
+def assert_results(results: Dict[str, Union[int, list]], *tables: PrettyTable) -> None:
+    """
+    Log the verification results as a table and raise an :py:class:`AssertionError` if any event is missing,
+    duplicated, leaked past the splitter filter or invalid.
+
+    :param results: The ``valid``/``duplicate``/``missing``/``invalid`` (and ``leaked``) counts, or ranges of
+                    sequence numbers
+    :arg tables:    More tables appended to the report
     :return:
     """
-    current = {
-        idx: file.readline().decode().strip() for idx, file in enumerate(files)
-    }
+    table = PrettyTable(field_names = results.keys())
+    table.add_row([format_ranges(value) if isinstance(value, list) else value for value in results.values()])
+    report = '\n'.join(map(str, (table, *tables)))
+    _logger.info(f'\n{report}')
+
+    assert not (results['duplicate'] or results['missing'] or results.get('leaked') or results['invalid']), \
+        f'Event errors found:\n{report}'
+
+
+def file_cmp(master: Union[str, Path], *files: IO[bytes]) -> Dict[str, Any]:
+    """
+    Verify the *events* in ``master`` were received, in order, in the given file descriptors.
+
+    Each file should hold its share of the master events in master order (see :py:class:`OrderCheck`). Every file
+    is read to the end and all problems are collected in one report, logged as tables and returned::
+
+        - Displaced blocks: byte offset, the master events they hold and where they belonged
+        - Missing and duplicate events as ranges of master line numbers
+        - Lines that are not master events (e.g. torn lines)
+
+    Raises an :py:class:`AssertionError` with the report tables if anything was out of order, missing, duplicated
+    or invalid.
 
-    with open(master, mode = 'rb') as source:
-        while master_line := source.readline().decode().strip():
-            # If masterFile is empty, all file readlines should be as well
-            if not master_line:
-                assert all(line == '' for line in current.values()), \
-                    f'Events detected in files with an empty {master} file'
-
-            # Are all lines unique?
-            lines = list(current.values())
-            if len(set(lines)) != len(lines):
-                raise AssertionError(
-                    'Duplicate events were found:\n'
-                    f'{json.dumps([line for line in lines if line], indent = 4)}'
-                )
-
-            # Check each file for the line
-            for file_no, line in current.items():
-                if line == master_line:
-                    print(f'Found [{master_line}] in {files[file_no].name}')
-                    current[file_no] = files[file_no].readline().decode().strip()
-                    break
-            else:
-                lines = '    \n'.join(f'{name}: {line if line else "<empty>"}' for name, line in current.items())
-                raise AssertionError(
-                    f'The event: [{master_line}]\n'
-                    f'was not found in: {[file.name for file in files]}\n'
-                    f'  Last:\n{lines}'
-                )
-
-        assert all(line == '' for line in current.values()), \
-            f'Extra Events detected in files:\n{json.dumps([line for line in lines if line], indent = 4)}'
+    :param master:  The location of the Master file
+    :arg files:     The file descriptors to search
+    :return:        The report
+    """
+    index = MasterIndex.build(master, positions = True)
+    check = OrderCheck(index, [str(getattr(file, 'name', idx)) for idx, file in enumerate(files)])
+    for idx, lines, terminated in interleave(files):
+        check.update(idx, lines, terminated, index.update(lines, terminated))
+    report = check.report()
+
+    summary = PrettyTable(field_names = [*report['results'].keys(), 'displaced'])
+    summary.add_row([*report['results'].values(), len(report['displaced'])])
+    blocks = PrettyTable(field_names = ['target', 'offset', 'bytes', 'events', 'expected offset', 'after event'])
+    for block in report['displaced']:
+        blocks.add_row([
+            block['target'], block['offset'], block['bytes'], '{}-{}'.format(*block['events']),
+            block['expected_offset'], block['after_event']
+        ])
+    _logger.info(f'\n{summary}\n{blocks}')
+    for key in ('missing', 'duplicate'):
+        if report[key]:
+            _logger.info(f'{key}: ' + ', '.join(f'{start}-{end}' for start, end in report[key]))
+    for name, invalid in report['invalid'].items():
+        _logger.info(f'invalid in {name}:\n{json.dumps(invalid, indent = 4)}')
+
+    assert not (report['displaced'] or any(report['results'][key] for key in ('duplicate', 'missing', 'invalid'))), \
+        f'Event errors found:\n{summary}\n{blocks}'
+    return report